@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   Navbar, 
   NavbarBrand, 
@@ -19,9 +19,14 @@ import {
   Switch
 } from "@nextui-org/react";
 import { FiSend, FiDatabase, FiRefreshCw, FiInfo, FiMoon, FiSun } from 'react-icons/fi';
-import ChatMessage from './components/ChatMessage';
-import ResultPanel from './components/ResultPanel';
 import axios from 'axios';
+import ChatMessage from './components/ChatMessage';
+import ResultPanel, { appendRows, toResultRows } from './components/ResultPanel';
+import { conditionalPost } from './conditionalPost';
+
+const API_URL = 'http://localhost:8000';
+// Most rows loaded by scrolling; past this, a narrower query is the better way to find a record
+const MAX_LOADED_RESULTS = 500;
 
 function App() {
   const [darkMode, setDarkMode] = useState(window.matchMedia('(prefers-color-scheme: dark)').matches);
@@ -30,6 +35,11 @@ function App() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [results, setResults] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Query and paging cursor of the page after the loaded results, while HubSpot has more
+  const [nextPage, setNextPage] = useState(null);
+  // Request for the next page, while one is in flight
+  const pageRef = useRef(null);
 
   useEffect(() => {
     if (darkMode) {
@@ -39,6 +49,43 @@ function App() {
     }
   }, [darkMode]);
 
+  const stopLoadingMore = () => {
+    if (pageRef.current) {
+      pageRef.current.abort();
+      pageRef.current = null;
+    }
+    setNextPage(null);
+    setLoadingMore(false);
+  };
+
+  const capped = Boolean(nextPage) && (results?.length ?? 0) >= MAX_LOADED_RESULTS;
+
+  // Fetch the next page when the table is scrolled near its end; the server reuses
+  // the query's plan, so only HubSpot is asked again
+  const loadMoreResults = () => {
+    if (!nextPage || pageRef.current || capped) return;
+    const controller = new AbortController();
+    pageRef.current = controller;
+    setLoadingMore(true);
+    axios.post(`${API_URL}/query/more`, { query: nextPage.query, after: nextPage.after }, { signal: controller.signal })
+      .then(response => {
+        const after = response.data.paging?.next?.after;
+        setResults(prev => appendRows(prev, response.data.results));
+        setNextPage(after ? { query: nextPage.query, after } : null);
+      })
+      .catch(err => {
+        if (axios.isCancel(err)) return;
+        console.error('Error loading more results:', err);
+        setNextPage(null);
+      })
+      .finally(() => {
+        if (pageRef.current === controller) {
+          pageRef.current = null;
+          setLoadingMore(false);
+        }
+      });
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     if (!query.trim()) return;
@@ -52,6 +99,7 @@ function App() {
     setMessages(prev => [...prev, userMessage]);
     setLoading(true);
     setError(null);
+    stopLoadingMore();
     setResults(null);
 
     try {
@@ -61,10 +109,11 @@ function App() {
         content: msg.content
       }));
 
-      const response = await axios.post('http://localhost:8000/query', {
+      // Repeated queries are revalidated with their ETag; the server ignores the history
+      const response = await conditionalPost(`${API_URL}/query`, {
         query: query,
         history: history
-      });
+      }, { query: query });
 
       const assistantMessage = {
         role: 'assistant',
@@ -74,9 +123,13 @@ function App() {
 
       setMessages(prev => [...prev, assistantMessage]);
       
-      // If there are sources or structured data in the response
-      if (response.data.sources) {
-        setResults(response.data.sources);
+      // Show the first page; further pages are loaded as the table is scrolled
+      const data = response.data.data;
+      if (data && Array.isArray(data.results) && data.results.length > 0) {
+        setResults(toResultRows(data.results));
+        if (data.paging?.next?.after) {
+          setNextPage({ query: query, after: data.paging.next.after });
+        }
       }
     } catch (err) {
       console.error('Error querying the API:', err);
@@ -88,6 +141,7 @@ function App() {
   };
 
   const clearChat = () => {
+    stopLoadingMore();
     setMessages([]);
     setResults(null);
     setError(null);
@@ -210,7 +264,12 @@ function App() {
             </CardHeader>
             <Divider />
             <CardBody className="overflow-y-auto max-h-[60vh] min-h-[60vh]">
-              <ResultPanel results={results} />
+              <ResultPanel
+                results={results}
+                loadingMore={loadingMore}
+                capped={capped}
+                onEndReached={loadMoreResults}
+              />
             </CardBody>
           </Card>
         </div>
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import axios from 'axios';
+import { conditionalPost } from './conditionalPost';
 
 function SimpleApp() {
   const [query, setQuery] = useState('');
@@ -32,7 +32,8 @@ function SimpleApp() {
       
       const endpoint = isSearch ? 'search' : 'query';
       
-      const response = await axios.post(`http://localhost:8000/${endpoint}`, {
+      // Repeated queries are revalidated with their ETag and reuse the data if unchanged
+      const response = await conditionalPost(`http://localhost:8000/${endpoint}`, {
         query: query,
         object_type: objectType,
         limit: 10
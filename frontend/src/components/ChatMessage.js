@@ -72,4 +72,5 @@ const ChatMessage = ({ message }) => {
   );
 };
 
-export default ChatMessage;
+// Memoized: earlier messages don't re-render (and re-parse markdown) as results stream in
+export default React.memo(ChatMessage);
@@ -1,8 +1,228 @@
-import React from 'react';
-import { Card, CardBody, Tabs, Tab, Code, Accordion, AccordionItem } from "@nextui-org/react";
-import { FiInfo } from 'react-icons/fi';
+import React, { useDeferredValue, useEffect, useMemo, useRef, useState } from 'react';
+import { Card, CardBody, Tabs, Tab, Code, Input, Spinner } from "@nextui-org/react";
+import { FiInfo, FiArrowUp, FiArrowDown, FiSearch } from 'react-icons/fi';
+
+// Rows are a fixed height so the visible window can be computed from the scroll offset
+const ROW_HEIGHT = 44;
+const VIEWPORT_HEIGHT = 360;
+// Rows mounted above and below the visible ones, so fast scrolling doesn't show gaps
+const OVERSCAN = 8;
+// Rows from the end at which the next page is requested, so it arrives before it is needed
+const END_REACHED_ROWS = 10;
+// Raw JSON of every row would be as slow to render as the rows themselves
+const RAW_PREVIEW_ROWS = 100;
+
+const COLUMNS = {
+  contacts: [
+    { key: 'name', label: 'Name' },
+    { key: 'email', label: 'Email' },
+    { key: 'company', label: 'Company' },
+  ],
+  deals: [
+    { key: 'name', label: 'Deal' },
+    { key: 'amount', label: 'Amount', numeric: true },
+    { key: 'stage', label: 'Stage' },
+  ],
+  companies: [
+    { key: 'name', label: 'Company' },
+    { key: 'domain', label: 'Domain' },
+    { key: 'industry', label: 'Industry' },
+  ],
+};
+
+const TAB_TITLES = { contacts: 'Contacts', deals: 'Deals', companies: 'Companies' };
+
+// Object type of a HubSpot record, from the properties each type has
+export const inferObjectType = (record) => {
+  const props = record.properties || {};
+  if ('dealname' in props || 'dealstage' in props) return 'deals';
+  if ('email' in props || 'firstname' in props || 'lastname' in props) return 'contacts';
+  if ('domain' in props || 'name' in props) return 'companies';
+  return null;
+};
+
+// Table rows for HubSpot records
+export const toResultRows = (records, objectType = null) =>
+  (records || []).map((record) => {
+    const props = record.properties || {};
+    const type = objectType || inferObjectType(record);
+    const contactName = [props.firstname, props.lastname].filter(Boolean).join(' ');
+    return {
+      id: `${type}:${record.id}`,
+      type,
+      name: type === 'contacts' ? contactName : (props.dealname || props.name),
+      email: props.email,
+      company: props.company,
+      amount: props.amount,
+      stage: props.dealstage,
+      domain: props.domain,
+      industry: props.industry,
+      data: record,
+    };
+  });
+
+// rows followed by the records not already among them
+export const appendRows = (rows, records, objectType = null) => {
+  const seen = new Set((rows || []).map(row => row.id));
+  const added = toResultRows(records, objectType).filter(row => !seen.has(row.id));
+  return added.length ? [...(rows || []), ...added] : rows;
+};
+
+const formatJSON = (json) => {
+  if (typeof json === 'string') {
+    try {
+      return JSON.stringify(JSON.parse(json), null, 2);
+    } catch (e) {
+      return json;
+    }
+  }
+  return JSON.stringify(json, null, 2);
+};
+
+const compareRows = (column, direction) => (a, b) => {
+  const x = a[column.key];
+  const y = b[column.key];
+  // Empty values last, whichever the direction
+  if (x == null || x === '') return y == null || y === '' ? 0 : 1;
+  if (y == null || y === '') return -1;
+  const order = column.numeric
+    ? Number(x) - Number(y)
+    : String(x).localeCompare(String(y), undefined, { sensitivity: 'base', numeric: true });
+  return direction === 'asc' ? order : -order;
+};
+
+// Mounts only the rows inside the scrolled viewport (plus OVERSCAN on each side), and
+// calls onEndReached when the viewport comes within END_REACHED_ROWS of the last row
+const WindowedRows = ({ rows, renderRow, onEndReached }) => {
+  const [scrollTop, setScrollTop] = useState(0);
+  const frame = useRef(null);
+
+  useEffect(() => () => cancelAnimationFrame(frame.current), []);
+
+  const onScroll = (e) => {
+    const top = e.currentTarget.scrollTop;
+    if (onEndReached && top + VIEWPORT_HEIGHT >= (rows.length - END_REACHED_ROWS) * ROW_HEIGHT) {
+      onEndReached();
+    }
+    // At most one re-render per animation frame while scrolling
+    if (frame.current) cancelAnimationFrame(frame.current);
+    frame.current = requestAnimationFrame(() => setScrollTop(top));
+  };
+
+  const first = Math.max(0, Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN);
+  const last = Math.min(rows.length, Math.ceil((scrollTop + VIEWPORT_HEIGHT) / ROW_HEIGHT) + OVERSCAN);
+
+  return (
+    <div style={{ height: VIEWPORT_HEIGHT, overflowY: 'auto' }} onScroll={onScroll}>
+      <div style={{ height: rows.length * ROW_HEIGHT, position: 'relative' }}>
+        <div style={{ transform: `translateY(${first * ROW_HEIGHT}px)` }}>
+          {rows.slice(first, last).map((row, offset) => renderRow(row, first + offset))}
+        </div>
+      </div>
+    </div>
+  );
+};
+
+// Sorting and filtering happen here, on the rows already loaded; neither calls the server
+const RecordTable = ({ type, rows, onEndReached }) => {
+  const columns = COLUMNS[type];
+  const [filter, setFilter] = useState('');
+  const [sort, setSort] = useState(null);
+  const [selectedId, setSelectedId] = useState(null);
+  // Typing stays responsive while a large table is re-filtered
+  const deferredFilter = useDeferredValue(filter.trim().toLowerCase());
+
+  const visible = useMemo(() => {
+    const matching = deferredFilter
+      ? rows.filter(row => columns.some(column => String(row[column.key] ?? '').toLowerCase().includes(deferredFilter)))
+      : rows;
+    if (!sort) return matching;
+    const column = columns.find(c => c.key === sort.key);
+    return [...matching].sort(compareRows(column, sort.direction));
+  }, [rows, columns, deferredFilter, sort]);
+
+  const selected = selectedId ? rows.find(row => row.id === selectedId) : null;
+
+  const toggleSort = (key) => {
+    setSort(current => {
+      if (!current || current.key !== key) return { key, direction: 'asc' };
+      return current.direction === 'asc' ? { key, direction: 'desc' } : null;
+    });
+  };
+
+  const gridTemplateColumns = `repeat(${columns.length}, minmax(0, 1fr))`;
+
+  return (
+    <Card className="mt-4">
+      <CardBody className="gap-3">
+        <div className="flex items-center gap-3">
+          <Input
+            size="sm"
+            placeholder={`Filter ${TAB_TITLES[type].toLowerCase()}...`}
+            startContent={<FiSearch />}
+            value={filter}
+            onValueChange={setFilter}
+            isClearable
+            onClear={() => setFilter('')}
+          />
+          <span className="text-xs text-gray-500 whitespace-nowrap">
+            {visible.length === rows.length ? rows.length : `${visible.length} of ${rows.length}`}
+          </span>
+        </div>
+
+        <div className="grid text-xs font-semibold border-b border-gray-500/30 pb-2" style={{ gridTemplateColumns }}>
+          {columns.map(column => (
+            <button
+              key={column.key}
+              type="button"
+              className="flex items-center gap-1 text-left px-2"
+              onClick={() => toggleSort(column.key)}
+            >
+              {column.label}
+              {sort?.key === column.key && (sort.direction === 'asc' ? <FiArrowUp /> : <FiArrowDown />)}
+            </button>
+          ))}
+        </div>
+
+        <WindowedRows
+          rows={visible}
+          onEndReached={onEndReached}
+          renderRow={(row, index) => (
+            <div
+              key={row.id}
+              className={`grid items-center text-sm cursor-pointer border-b border-gray-500/10 ${row.id === selectedId ? 'bg-secondary-100' : ''}`}
+              style={{ gridTemplateColumns, height: ROW_HEIGHT }}
+              onClick={() => setSelectedId(row.id === selectedId ? null : row.id)}
+            >
+              {columns.map(column => (
+                <span key={column.key} className="truncate px-2">
+                  {row[column.key] || (column.key === 'name' ? `#${index + 1}` : '')}
+                </span>
+              ))}
+            </div>
+          )}
+        />
+
+        {selected && (
+          <Code block className="text-xs max-h-[240px] overflow-auto">
+            {formatJSON(selected.data)}
+          </Code>
+        )}
+      </CardBody>
+    </Card>
+  );
+};
+
+const ResultPanel = ({ results, loadingMore = false, capped = false, onEndReached }) => {
+  // Grouped once per change of results, not on every render
+  const groups = useMemo(() => {
+    const byType = { contacts: [], deals: [], companies: [] };
+    (results || []).forEach(row => {
+      if (byType[row.type]) byType[row.type].push(row);
+    });
+    return byType;
+  }, [results]);
 
-const ResultPanel = ({ results }) => {
   if (!results) {
     return (
       <div className="flex flex-col items-center justify-center h-full text-center text-gray-500 p-4">
@@ -15,107 +235,40 @@ const ResultPanel = ({ results }) => {
     );
   }
 
-  // Function to format JSON for display
-  const formatJSON = (json) => {
-    if (typeof json === 'string') {
-      try {
-        return JSON.stringify(JSON.parse(json), null, 2);
-      } catch (e) {
-        return json;
-      }
-    }
-    return JSON.stringify(json, null, 2);
-  };
-
-  // Determine if we have contacts, deals, or companies data
-  const hasContacts = results.some(item => item.type === 'contacts');
-  const hasDeals = results.some(item => item.type === 'deals');
-  const hasCompanies = results.some(item => item.type === 'companies');
-
   return (
-    <Tabs aria-label="Data Tabs" color="secondary" variant="bordered">
-      {hasContacts && (
-        <Tab key="contacts" title="Contacts">
-          <Card className="mt-4">
-            <CardBody>
-              <Accordion>
-                {results
-                  .filter(item => item.type === 'contacts')
-                  .map((contact, index) => (
-                    <AccordionItem 
-                      key={index} 
-                      title={contact.name || `Contact #${index + 1}`}
-                      subtitle={contact.email || 'No email'}
-                    >
-                      <Code block className="text-xs">
-                        {formatJSON(contact.data)}
-                      </Code>
-                    </AccordionItem>
-                  ))}
-              </Accordion>
-            </CardBody>
-          </Card>
-        </Tab>
+    <>
+      {loadingMore && (
+        <div className="flex items-center gap-2 text-xs text-gray-500 mb-2">
+          <Spinner size="sm" color="secondary" />
+          Loading more results ({results.length} so far)
+        </div>
       )}
-      
-      {hasDeals && (
-        <Tab key="deals" title="Deals">
-          <Card className="mt-4">
-            <CardBody>
-              <Accordion>
-                {results
-                  .filter(item => item.type === 'deals')
-                  .map((deal, index) => (
-                    <AccordionItem 
-                      key={index} 
-                      title={deal.name || `Deal #${index + 1}`}
-                      subtitle={`${deal.amount || 'No amount'} - ${deal.stage || 'No stage'}`}
-                    >
-                      <Code block className="text-xs">
-                        {formatJSON(deal.data)}
-                      </Code>
-                    </AccordionItem>
-                  ))}
-              </Accordion>
-            </CardBody>
-          </Card>
-        </Tab>
+      {capped && (
+        <p className="text-xs text-gray-500 mb-2">
+          Showing the first {results.length} results. Narrow the query to see the others.
+        </p>
       )}
-      
-      {hasCompanies && (
-        <Tab key="companies" title="Companies">
+      <Tabs aria-label="Data Tabs" color="secondary" variant="bordered">
+        {Object.keys(COLUMNS).filter(type => groups[type].length > 0).map(type => (
+          <Tab key={type} title={`${TAB_TITLES[type]} (${groups[type].length})`}>
+            <RecordTable type={type} rows={groups[type]} onEndReached={onEndReached} />
+          </Tab>
+        ))}
+
+        <Tab key="raw" title="Raw Data">
           <Card className="mt-4">
             <CardBody>
-              <Accordion>
-                {results
-                  .filter(item => item.type === 'companies')
-                  .map((company, index) => (
-                    <AccordionItem 
-                      key={index} 
-                      title={company.name || `Company #${index + 1}`}
-                      subtitle={company.domain || 'No domain'}
-                    >
-                      <Code block className="text-xs">
-                        {formatJSON(company.data)}
-                      </Code>
-                    </AccordionItem>
-                  ))}
-              </Accordion>
+              {results.length > RAW_PREVIEW_ROWS && (
+                <p className="text-xs text-gray-500 mb-2">First {RAW_PREVIEW_ROWS} of {results.length} records</p>
+              )}
+              <Code block className="text-xs max-h-[400px] overflow-auto">
+                {formatJSON(results.slice(0, RAW_PREVIEW_ROWS).map(row => row.data))}
+              </Code>
             </CardBody>
           </Card>
         </Tab>
-      )}
-      
-      <Tab key="raw" title="Raw Data">
-        <Card className="mt-4">
-          <CardBody>
-            <Code block className="text-xs max-h-[400px] overflow-auto">
-              {formatJSON(results)}
-            </Code>
-          </CardBody>
-        </Card>
-      </Tab>
-    </Tabs>
+      </Tabs>
+    </>
   );
 };
 
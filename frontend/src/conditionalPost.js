@@ -0,0 +1,33 @@
+import axios from 'axios';
+
+// Keep the last few responses; the server revalidates them from their ETag
+const MAX_VALIDATED = 50;
+
+// Last response and ETag per request, most recent last
+const validated = new Map();
+
+// POST that sends back the ETag of the previous identical request. When the server
+// answers 304 (nothing changed), the previous response data is returned instead.
+// keyFields are the body fields that identify the request (all of them by default).
+export async function conditionalPost(url, body, keyFields = body) {
+  const key = `${url} ${JSON.stringify(keyFields)}`;
+  const previous = validated.get(key);
+
+  const response = await axios.post(url, body, {
+    headers: previous ? { 'If-None-Match': previous.etag } : {},
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  });
+
+  if (response.status === 304 && previous) {
+    return { ...response, data: previous.data, notModified: true };
+  }
+
+  validated.delete(key);
+  if (response.headers.etag) {
+    validated.set(key, { etag: response.headers.etag, data: response.data });
+    if (validated.size > MAX_VALIDATED) {
+      validated.delete(validated.keys().next().value);
+    }
+  }
+  return response;
+}
@@ -0,0 +1,217 @@
+# Admission control and backpressure for the expensive endpoints
+# Caps concurrent requests per endpoint with a bounded wait queue, enforces per-client
+# quotas, and rejects quickly with 503/429 and Retry-After when saturated instead of
+# letting latency collapse for everyone.
+
+from typing import Any, Callable, Collection, Dict, Optional
+import asyncio
+import math
+import time
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    def to_response(self) -> JSONResponse:
+        return JSONResponse(
+            status_code=self.status_code,
+            content={"response": self.reason, "data": None},
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+class EndpointLimiter:
+    """Concurrency cap with a bounded FIFO wait queue and a wait deadline"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait_seconds: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait_seconds = 0.0
+        self.max_observed_wait = 0.0
+        self.max_observed_queue = 0
+        self.total_service_seconds = 0.0
+        self.completed = 0
+
+    def estimated_wait(self) -> float:
+        """Rough time until a slot frees up, used for Retry-After"""
+        service = self.total_service_seconds / self.completed if self.completed else 1.0
+        return service * (self.queued + 1) / self.max_concurrent
+
+    async def acquire(self):
+        if self._semaphore is None:
+            # Created lazily so it binds to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        started = time.monotonic()
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise AdmissionRejected(503, f"The server is busy ({self.name} queue is full). Please retry shortly.", self.estimated_wait())
+            self.queued += 1
+            self.max_observed_queue = max(self.max_observed_queue, self.queued)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait_seconds)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise AdmissionRejected(503, f"The server is busy ({self.name} wait deadline exceeded). Please retry shortly.", self.estimated_wait())
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        waited = time.monotonic() - started
+        self.total_wait_seconds += waited
+        self.max_observed_wait = max(self.max_observed_wait, waited)
+        self.admitted += 1
+        self.in_flight += 1
+
+    def release(self, service_seconds: float):
+        self.in_flight -= 1
+        self.completed += 1
+        self.total_service_seconds += service_seconds
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_observed_queue": self.max_observed_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_ms": round(self.total_wait_seconds * 1000 / self.admitted, 1) if self.admitted else None,
+            "max_wait_ms": round(self.max_observed_wait * 1000, 1),
+            "avg_service_ms": round(self.total_service_seconds * 1000 / self.completed, 1) if self.completed else None,
+        }
+
+
+class ClientQuota:
+    """Token-bucket request quota per client or API key"""
+
+    def __init__(self, requests_per_minute: float, burst: int, max_clients: int = 10000):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: Dict[str, list] = {}
+        self.rejected = 0
+
+    def check(self, client_id: str):
+        now = time.monotonic()
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self._buckets[client_id] = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.rejected += 1
+            raise AdmissionRejected(429, "Too many requests from this client. Please slow down.", (1 - tokens) / self.rate)
+        bucket[0] = tokens - 1
+
+    def _prune(self, now: float):
+        """Drop buckets that have refilled completely; they carry no state"""
+        full_after = self.burst / self.rate if self.rate else 0
+        for client_id in [key for key, (_, updated) in self._buckets.items() if now - updated >= full_after]:
+            del self._buckets[client_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_per_minute": round(self.rate * 60, 1),
+            "burst": self.burst,
+            "tracked_clients": len(self._buckets),
+            "rejected": self.rejected,
+        }
+
+
+def client_id(request: Request, trusted_proxies: Collection[str] = ()) -> str:
+    """Identify the caller by peer address.
+
+    X-Forwarded-For is only honoured when the peer is one of trusted_proxies, and then
+    the rightmost address not added by a trusted proxy is the client; any caller can
+    put whatever it likes at the left of the header.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if peer in trusted_proxies:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if hop not in trusted_proxies:
+                return f"ip:{hop}"
+    return f"ip:{peer}"
+
+
+class AdmissionController:
+    """Per-endpoint limiters and per-client quotas applied as HTTP middleware.
+
+    Quotas are kept per authenticated identity when identify returns one for the
+    request, otherwise per client address.
+    """
+
+    def __init__(
+        self,
+        limiters: Dict[str, EndpointLimiter],
+        quota: Optional[ClientQuota] = None,
+        identify: Optional[Callable[[Request], Optional[str]]] = None,
+        trusted_proxies: Collection[str] = (),
+    ):
+        self.limiters = limiters
+        self.quota = quota
+        self.identify = identify
+        self.trusted_proxies = frozenset(trusted_proxies)
+
+    def client_id(self, request: Request) -> str:
+        identity = self.identify(request) if self.identify is not None else None
+        return f"auth:{identity}" if identity else client_id(request, self.trusted_proxies)
+
+    async def __call__(self, request: Request, call_next):
+        limiter = self.limiters.get(request.url.path)
+        if limiter is None or request.method != "POST":
+            return await call_next(request)
+
+        try:
+            if self.quota is not None:
+                self.quota.check(self.client_id(request))
+            await limiter.acquire()
+        except AdmissionRejected as rejection:
+            return rejection.to_response()
+
+        started = time.monotonic()
+        try:
+            return await call_next(request)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": {path: limiter.stats() for path, limiter in self.limiters.items()},
+            "client_quota": self.quota.stats() if self.quota is not None else None,
+        }
+
+
+def parse_limits(spec: str) -> Dict[str, EndpointLimiter]:
+    """Parse "path:max_concurrent:max_queue:max_wait_seconds,..." into limiters"""
+    limiters = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        path, max_concurrent, max_queue, max_wait = item.rsplit(":", 3)
+        limiters[path] = EndpointLimiter(path, int(max_concurrent), int(max_queue), float(max_wait))
+    return limiters
@@ -0,0 +1,516 @@
+# In-memory association graph for HubSpot companies, contacts and deals
+# Records are bulk-loaded in the background and their associations read through the v4
+# batch API into compact adjacency arrays keyed by integer ids, then kept up to date
+# incrementally, so relationship questions ("deals for
+# contacts at Acme", "companies with open deals over $50k") are answered with in-process
+# joins instead of many serial API calls.
+
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import re
+import threading
+import time
+
+OBJECT_TYPES = ["contacts", "companies", "deals"]
+
+# Properties kept in memory for each object type
+GRAPH_PROPERTIES = {
+    "contacts": ["firstname", "lastname", "email"],
+    "companies": ["name", "domain"],
+    "deals": ["dealname", "amount", "dealstage", "hs_is_closed"],
+}
+
+# Associations read for each object type after loading the records. Edges are stored in
+# both directions, so these three pairs cover every relationship between the object types.
+LOAD_ASSOCIATIONS = {
+    "contacts": ["companies", "deals"],
+    "companies": ["deals"],
+    "deals": [],
+}
+
+# Property holding the last-modified timestamp used for incremental refreshes
+LAST_MODIFIED_PROPERTY = {
+    "contacts": "lastmodifieddate",
+    "companies": "hs_lastmodifieddate",
+    "deals": "hs_lastmodifieddate",
+}
+
+CLOSED_DEAL_STAGES = {"closedwon", "closedlost"}
+
+TOKEN_PATTERN = re.compile(r'[\w&-]+')
+
+# HubSpot's page size for list, search and batch endpoints
+PAGE_SIZE = 100
+
+# Pages of deleted records read per refresh; see AssociationGraph._sweep_archived
+ARCHIVED_PAGES_PER_REFRESH = 5
+
+Fetch = Callable[..., Dict[str, Any]]
+
+
+class GraphLoading(Exception):
+    """The graph has not finished its first load yet"""
+
+
+class _ObjectTable:
+    """Interned ids and the few properties needed to filter and describe nodes"""
+
+    def __init__(self):
+        self.hubspot_ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.amounts = array('d')
+        self.open_flags = array('b')
+        # 1 once the record's properties are loaded; nodes only named by an association stay 0
+        self.loaded = array('b')
+        self.properties: List[Dict[str, Any]] = []
+        # Lower-cased name token -> node ids, for name lookups without a scan
+        self.tokens: Dict[str, Set[int]] = {}
+        # Nodes of deleted records; their ids are not reused
+        self.removed: Set[int] = set()
+
+    def intern(self, hubspot_id: str) -> int:
+        node = self.index.get(hubspot_id)
+        if node is None:
+            node = len(self.hubspot_ids)
+            self.index[hubspot_id] = node
+            self.hubspot_ids.append(hubspot_id)
+            self.names.append("")
+            self.amounts.append(0.0)
+            self.open_flags.append(1)
+            self.loaded.append(0)
+            self.properties.append({})
+        return node
+
+    def set_properties(self, node: int, object_type: str, props: Dict[str, Any]):
+        for token in TOKEN_PATTERN.findall(self.names[node].lower()):
+            self.tokens.get(token, set()).discard(node)
+
+        if object_type == "contacts":
+            name = f"{props.get('firstname') or ''} {props.get('lastname') or ''}".strip() or (props.get("email") or "")
+        elif object_type == "companies":
+            name = props.get("name") or props.get("domain") or ""
+        else:
+            name = props.get("dealname") or ""
+            try:
+                self.amounts[node] = float(props.get("amount") or 0)
+            except (TypeError, ValueError):
+                self.amounts[node] = 0.0
+            closed = props.get("hs_is_closed")
+            if closed is None:
+                is_open = (props.get("dealstage") or "") not in CLOSED_DEAL_STAGES
+            else:
+                is_open = str(closed).lower() != "true"
+            self.open_flags[node] = 1 if is_open else 0
+
+        self.names[node] = name
+        self.loaded[node] = 1
+        self.properties[node] = {key: props.get(key) for key in GRAPH_PROPERTIES[object_type] if props.get(key) is not None}
+        for token in TOKEN_PATTERN.findall(name.lower()):
+            self.tokens.setdefault(token, set()).add(node)
+
+    def remove(self, node: int):
+        for token in TOKEN_PATTERN.findall(self.names[node].lower()):
+            self.tokens.get(token, set()).discard(node)
+        # A record restored later is interned again as a new node
+        del self.index[self.hubspot_ids[node]]
+        self.names[node] = ""
+        self.loaded[node] = 0
+        self.properties[node] = {}
+        self.removed.add(node)
+
+    def nodes(self) -> Set[int]:
+        """Nodes of records whose properties are loaded"""
+        return {node for node, loaded in enumerate(self.loaded) if loaded}
+
+
+class AssociationGraph:
+    """Company/contact/deal association graph with multi-hop joins"""
+
+    def __init__(
+        self,
+        fetch: Fetch,
+        refresh_seconds: float = 300,
+        full_reload_seconds: float = 3600,
+        max_records: int = 50000,
+        archived_pages_per_refresh: int = ARCHIVED_PAGES_PER_REFRESH,
+    ):
+        self.fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.max_records = max_records
+        self.archived_pages_per_refresh = archived_pages_per_refresh
+        # Cursor into each type's deleted records where the next sweep continues
+        self._archived_after: Dict[str, Optional[str]] = {}
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._reset()
+        self.loaded_at: Optional[float] = None
+        self.refreshed_at: Optional[float] = None
+        self._sync_ms: Optional[int] = None
+        self._refreshing = False
+        self._loading = False
+        self.load_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.joins = 0
+        self.join_seconds = 0.0
+
+    def _reset(self):
+        self.tables = {object_type: _ObjectTable() for object_type in OBJECT_TYPES}
+        # (from_type, to_type) -> list indexed by from node of neighbor node arrays
+        self.edges: Dict[Tuple[str, str], List[array]] = {
+            (a, b): [] for a in OBJECT_TYPES for b in OBJECT_TYPES if a != b
+        }
+
+    # Loading
+
+    def start(self):
+        """Start the first load in the background, unless it is running or done"""
+        with self._load_lock:
+            if self.loaded_at is not None or self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._background_load, name="association-graph-load", daemon=True).start()
+
+    def _background_load(self):
+        try:
+            self.load()
+            self.load_error = None
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"Error loading association graph: {e}")
+        finally:
+            self._loading = False
+
+    def ensure_fresh(self):
+        """Refresh the graph in the background when stale.
+
+        Raises GraphLoading until the first load has finished (starting it if it failed
+        or never started), so requests never wait for a full load.
+        """
+        if self.loaded_at is None:
+            self.start()
+            raise GraphLoading("The association graph is still loading")
+
+        now = time.time()
+        if self._refreshing:
+            return
+        if now - self.loaded_at > self.full_reload_seconds or now - (self.refreshed_at or self.loaded_at) > self.refresh_seconds:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh, name="association-graph-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            if time.time() - self.loaded_at > self.full_reload_seconds:
+                self.load()
+            else:
+                self.refresh()
+        except Exception as e:
+            print(f"Error refreshing association graph: {e}")
+        finally:
+            self._refreshing = False
+
+    def load(self):
+        """Bulk-load every object and its associations, replacing the current graph"""
+        started = time.time()
+        sync_ms = int(started * 1000)
+        staged = AssociationGraph(self.fetch, max_records=self.max_records)
+        for object_type in OBJECT_TYPES:
+            table = staged.tables[object_type]
+            for record in self._page(object_type):
+                table.set_properties(table.intern(str(record["id"])), object_type, record.get("properties", {}))
+        for from_type, to_types in LOAD_ASSOCIATIONS.items():
+            for to_type in to_types:
+                staged._load_associations(from_type, to_type)
+
+        with self._lock:
+            self.tables = staged.tables
+            self.edges = staged.edges
+            self.loaded_at = time.time()
+            self.refreshed_at = self.loaded_at
+            self._sync_ms = sync_ms
+            self.load_seconds = self.loaded_at - started
+        print(f"Association graph loaded in {self.load_seconds:.2f}s: {self.stats()['nodes']}")
+
+    def refresh(self):
+        """Apply records modified or deleted since the last sync, re-reading the associations of modified ones"""
+        if self._sync_ms is None:
+            self.load()
+            return
+        sync_ms = int(time.time() * 1000)
+        for object_type in OBJECT_TYPES:
+            self._sweep_archived(object_type)
+            modified = list(self._modified_since(object_type, self._sync_ms))
+            if not modified:
+                continue
+            with self._lock:
+                for record in modified:
+                    node = self.tables[object_type].intern(record["id"])
+                    self.tables[object_type].set_properties(node, object_type, record.get("properties", {}))
+            for other_type in OBJECT_TYPES:
+                if other_type != object_type:
+                    self._refresh_associations(object_type, other_type, [record["id"] for record in modified])
+        self._sync_ms = sync_ms
+        self.refreshed_at = time.time()
+
+    def _page(self, object_type: str) -> Iterable[Dict[str, Any]]:
+        """Iterate over all records of a type via the list endpoint"""
+        params = {"limit": PAGE_SIZE, "archived": "false", "properties": ",".join(GRAPH_PROPERTIES[object_type])}
+        seen = 0
+        while True:
+            response = self.fetch(f"/crm/v3/objects/{object_type}", params=params)
+            if "error" in response:
+                raise RuntimeError(f"Failed to load {object_type}: {response['error']}")
+            for record in response.get("results", []):
+                yield record
+                seen += 1
+            after = response.get("paging", {}).get("next", {}).get("after")
+            if not after or seen >= self.max_records:
+                return
+            params = dict(params, after=after)
+
+    def _sweep_archived(self, object_type: str):
+        """Drop records that were deleted, reading the next few pages of deleted records.
+
+        HubSpot lists deleted records by id, not by when they were deleted, so there is
+        no way to ask for just the recent ones. Each refresh reads at most
+        archived_pages_per_refresh pages and the next one continues from there, starting
+        over after the last page; the periodic full reload drops everything deleted anyway.
+        Removing a node drops its edges, so deleted associations go with the record.
+        """
+        after = self._archived_after.get(object_type)
+        for _ in range(self.archived_pages_per_refresh):
+            params = {"limit": PAGE_SIZE, "archived": "true", "properties": ""}
+            if after:
+                params["after"] = after
+            response = self.fetch(f"/crm/v3/objects/{object_type}", params=params)
+            if "error" in response:
+                raise RuntimeError(f"Failed to list deleted {object_type}: {response['error']}")
+            with self._lock:
+                for record in response.get("results", []):
+                    self._remove_record(object_type, str(record["id"]))
+            after = response.get("paging", {}).get("next", {}).get("after")
+            if not after:
+                break
+        self._archived_after[object_type] = after
+
+    def _modified_since(self, object_type: str, since_ms: int) -> Iterable[Dict[str, Any]]:
+        body = {
+            "filterGroups": [{"filters": [{
+                "propertyName": LAST_MODIFIED_PROPERTY[object_type],
+                "operator": "GTE",
+                "value": str(since_ms),
+            }]}],
+            "properties": GRAPH_PROPERTIES[object_type],
+            "limit": PAGE_SIZE,
+        }
+        while True:
+            response = self.fetch(f"/crm/v3/objects/{object_type}/search", method="POST", data=body)
+            if "error" in response:
+                raise RuntimeError(f"Failed to refresh {object_type}: {response['error']}")
+            for record in response.get("results", []):
+                yield record
+            after = response.get("paging", {}).get("next", {}).get("after")
+            if not after:
+                return
+            body = dict(body, after=after)
+
+    def _read_associations(self, from_type: str, to_type: str, hubspot_ids: List[str]) -> Dict[str, Set[str]]:
+        """Ids of the to_type records associated with each record, via the v4 associations batch API.
+
+        A record with more associations than fit in one response is read again from its
+        own paging cursor until every association has been read.
+        """
+        found: Dict[str, Set[str]] = {hubspot_id: set() for hubspot_id in hubspot_ids}
+        inputs = [{"id": hubspot_id} for hubspot_id in hubspot_ids]
+        while inputs:
+            batch, inputs = inputs[:PAGE_SIZE], inputs[PAGE_SIZE:]
+            response = self.fetch(f"/crm/v4/associations/{from_type}/{to_type}/batch/read", method="POST", data={"inputs": batch})
+            if "error" in response:
+                raise RuntimeError(f"Failed to read {from_type}->{to_type} associations: {response['error']}")
+            for result in response.get("results", []):
+                from_id = str(result.get("from", {}).get("id"))
+                # The same pair is listed once, with all of its association labels
+                found.setdefault(from_id, set()).update(str(item.get("toObjectId")) for item in result.get("to", []))
+                after = result.get("paging", {}).get("next", {}).get("after")
+                if after:
+                    inputs.append({"id": from_id, "after": after})
+        return found
+
+    def _load_associations(self, from_type: str, to_type: str):
+        """Add the edges between every loaded from_type record and its to_type associations"""
+        table = self.tables[from_type]
+        hubspot_ids = [table.hubspot_ids[node] for node in sorted(table.nodes())]
+        for start in range(0, len(hubspot_ids), PAGE_SIZE):
+            found = self._read_associations(from_type, to_type, hubspot_ids[start:start + PAGE_SIZE])
+            for hubspot_id, neighbor_ids in found.items():
+                node = table.intern(hubspot_id)
+                for neighbor_id in neighbor_ids:
+                    self._add_edge(from_type, node, to_type, self.tables[to_type].intern(neighbor_id), check=False)
+
+    def _refresh_associations(self, from_type: str, to_type: str, hubspot_ids: List[str]):
+        """Replace the edges of the given records with their current associations"""
+        for start in range(0, len(hubspot_ids), PAGE_SIZE):
+            found = self._read_associations(from_type, to_type, hubspot_ids[start:start + PAGE_SIZE])
+            with self._lock:
+                for hubspot_id, neighbor_ids in found.items():
+                    self._replace_edges(from_type, hubspot_id, to_type, sorted(neighbor_ids))
+
+    # Mutation
+
+    def _remove_record(self, object_type: str, hubspot_id: str):
+        node = self.tables[object_type].index.get(hubspot_id)
+        if node is None:
+            return
+        for other_type in OBJECT_TYPES:
+            if other_type == object_type:
+                continue
+            for neighbor in self._adjacency(object_type, other_type, node):
+                reverse = self._adjacency(other_type, object_type, neighbor)
+                while node in reverse:
+                    reverse.remove(node)
+            self.edges[(object_type, other_type)][node] = array('l')
+        self.tables[object_type].remove(node)
+
+    def _adjacency(self, from_type: str, to_type: str, node: int) -> array:
+        lists = self.edges[(from_type, to_type)]
+        while len(lists) <= node:
+            lists.append(array('l'))
+        return lists[node]
+
+    def _add_edge(self, a_type: str, a: int, b_type: str, b: int, check: bool = True):
+        forward = self._adjacency(a_type, b_type, a)
+        if check and b in forward:
+            return
+        forward.append(b)
+        self._adjacency(b_type, a_type, b).append(a)
+
+    def _replace_edges(self, from_type: str, hubspot_id: str, to_type: str, neighbor_ids: List[str]):
+        node = self.tables[from_type].intern(hubspot_id)
+        for old in self._adjacency(from_type, to_type, node):
+            reverse = self._adjacency(to_type, from_type, old)
+            if node in reverse:
+                reverse.remove(node)
+        self.edges[(from_type, to_type)][node] = array('l')
+        for neighbor_id in neighbor_ids:
+            self._add_edge(from_type, node, to_type, self.tables[to_type].intern(neighbor_id))
+
+    # Queries
+
+    def match_names(self, object_type: str, name: str) -> Set[int]:
+        """Nodes whose name contains every token of the given name"""
+        table = self.tables[object_type]
+        tokens = TOKEN_PATTERN.findall(name.lower())
+        if not tokens:
+            return set()
+        matches = None
+        for token in tokens:
+            nodes = table.tokens.get(token)
+            if not nodes:
+                # Fall back to substring matching for partial tokens
+                nodes = {node for node, node_name in enumerate(table.names) if token in node_name.lower()}
+            matches = set(nodes) if matches is None else matches & nodes
+            if not matches:
+                return set()
+        return matches
+
+    def deal_filter(self, nodes: Iterable[int], min_amount: Optional[float] = None, open_only: bool = False) -> Set[int]:
+        table = self.tables["deals"]
+        return {
+            node for node in nodes
+            if (min_amount is None or table.amounts[node] >= min_amount)
+            and (not open_only or table.open_flags[node])
+        }
+
+    def traverse(self, start_type: str, start_nodes: Iterable[int], path: List[str]) -> Set[int]:
+        """Follow associations hop by hop, e.g. companies -> contacts -> deals"""
+        current_type = start_type
+        current = set(start_nodes)
+        for next_type in path:
+            lists = self.edges[(current_type, next_type)]
+            reached: Set[int] = set()
+            for node in current:
+                if node < len(lists):
+                    reached.update(lists[node])
+            # Records only known from an association (not loaded, e.g. past max_records) have no
+            # properties to filter or show, so joins neither return them nor pass through them
+            loaded = self.tables[next_type].loaded
+            current_type, current = next_type, {node for node in reached if loaded[node]}
+        return current
+
+    def related(
+        self,
+        target_type: str,
+        source_type: str,
+        source_name: Optional[str] = None,
+        via: Optional[str] = None,
+        min_amount: Optional[float] = None,
+        open_only: bool = False,
+        limit: int = 25,
+    ) -> Dict[str, Any]:
+        """Records of target_type associated with the matching source records.
+
+        Deal criteria (min_amount, open_only) apply to whichever end of the join is deals.
+        Raises GraphLoading until the graph has been loaded.
+        """
+        if target_type not in OBJECT_TYPES or source_type not in OBJECT_TYPES or target_type == source_type:
+            raise ValueError(f"Unsupported relationship: {source_type} -> {target_type}")
+        if via is not None and via in (target_type, source_type):
+            via = None
+
+        self.ensure_fresh()
+        started = time.perf_counter()
+        with self._lock:
+            if source_name:
+                sources = self.match_names(source_type, source_name)
+            else:
+                sources = self.tables[source_type].nodes()
+            if source_type == "deals":
+                sources = self.deal_filter(sources, min_amount, open_only)
+
+            path = [via, target_type] if via else [target_type]
+            targets = self.traverse(source_type, sources, path)
+            if target_type == "deals":
+                targets = self.deal_filter(targets, min_amount, open_only)
+
+            table = self.tables[target_type]
+            ordered = sorted(targets, key=lambda node: table.names[node].lower())
+            results = [
+                {"id": table.hubspot_ids[node], "properties": dict(table.properties[node])}
+                for node in ordered[:limit]
+            ]
+        elapsed = time.perf_counter() - started
+        self.joins += 1
+        self.join_seconds += elapsed
+        return {
+            "results": results,
+            "total": len(targets),
+            "source_matches": len(sources),
+            "join_microseconds": round(elapsed * 1e6, 1),
+        }
+
+    def associated_ids(self, source_type: str, source_ids: Iterable[str], target_type: str) -> Dict[str, List[str]]:
+        """HubSpot ids of the target_type records associated with each source record"""
+        with self._lock:
+            sources = self.tables[source_type]
+            targets = self.tables[target_type]
+            associated = {}
+            for source_id in source_ids:
+                node = sources.index.get(source_id)
+                nodes = self.traverse(source_type, [node], [target_type]) if node is not None else set()
+                associated[source_id] = [targets.hubspot_ids[target] for target in sorted(nodes)]
+            return associated
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": self.loaded_at is not None,
+                "loading": self._loading,
+                "load_error": self.load_error,
+                "nodes": {object_type: len(table.nodes()) for object_type, table in self.tables.items()},
+                "edges": sum(len(neighbors) for lists in self.edges.values() for neighbors in lists) // 2,
+                "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+                "last_refresh_age_seconds": round(time.time() - self.refreshed_at, 1) if self.refreshed_at else None,
+                "joins": self.joins,
+                "avg_join_microseconds": round(self.join_seconds * 1e6 / self.joins, 1) if self.joins else None,
+            }
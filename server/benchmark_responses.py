@@ -0,0 +1,95 @@
+"""Benchmark the /query response encoding path.
+
+Compares CPU time per request and bytes on the wire for the previous path
+(decode HubSpot bytes, validate the envelope with pydantic, re-encode with the
+stdlib) against the fast path (raw passthrough spliced into the envelope).
+
+Usage:
+    python benchmark_responses.py --records 100 --iterations 2000
+"""
+
+from typing import Any, Callable, Dict, Optional
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from fast_json import FastJSONResponse, RawPayload, compress, ORJSON_AVAILABLE, BROTLI_AVAILABLE
+
+
+class QueryResponse(BaseModel):
+    response: str
+    data: Optional[Dict[str, Any]] = None
+    partial: Optional[bool] = None
+
+
+def sample_payload(records: int) -> bytes:
+    """A HubSpot search response with realistic contact properties"""
+    results = []
+    for i in range(records):
+        results.append({
+            "id": str(1000 + i),
+            "properties": {
+                "createdate": "2024-03-01T10:15:00.000Z",
+                "email": f"contact{i}@example{i % 17}.com",
+                "firstname": f"First{i}",
+                "lastname": f"Last{i}",
+                "company": f"Company {i % 23}",
+                "phone": f"+1 555 010 {i:04d}",
+                "hs_object_id": str(1000 + i),
+                "lastmodifieddate": "2024-05-12T08:00:00.000Z",
+            },
+            "createdAt": "2024-03-01T10:15:00.000Z",
+            "updatedAt": "2024-05-12T08:00:00.000Z",
+            "archived": False,
+        })
+    return json.dumps({"total": records, "results": results}).encode("utf-8")
+
+
+def legacy_path(content: bytes) -> bytes:
+    data = json.loads(content)
+    model = QueryResponse(response="Found contacts.", data=data)
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(content: bytes) -> bytes:
+    data = RawPayload.from_bytes(content)
+    return FastJSONResponse({"response": "Found contacts.", "data": data}).body
+
+
+def cpu_per_call(fn: Callable[[bytes], bytes], content: bytes, iterations: int) -> float:
+    started = time.process_time()
+    for _ in range(iterations):
+        fn(content)
+    return (time.process_time() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    content = sample_payload(args.records)
+    # Both paths must produce the same document
+    legacy_body, fast_body = json.loads(legacy_path(content)), json.loads(fast_path(content))
+    assert legacy_body["data"] == fast_body["data"] and legacy_body["response"] == fast_body["response"]
+
+    print(f"Payload: {args.records} records, {len(content):,} bytes (orjson: {ORJSON_AVAILABLE}, brotli: {BROTLI_AVAILABLE})")
+    legacy = cpu_per_call(legacy_path, content, args.iterations)
+    fast = cpu_per_call(fast_path, content, args.iterations)
+    print(f"CPU per request: legacy {legacy * 1e6:,.0f} us, fast {fast * 1e6:,.0f} us ({legacy / fast:.1f}x)")
+
+    body = fast_path(content)
+    encodings = ["gzip"] + (["br"] if BROTLI_AVAILABLE else [])
+    print(f"Bytes on the wire: identity {len(body):,}")
+    for encoding in encodings:
+        compressed = compress(body, encoding)
+        cost = cpu_per_call(lambda payload: compress(payload, encoding), body, max(1, args.iterations // 10))
+        print(f"  {encoding}: {len(compressed):,} bytes ({len(compressed) / len(body):.1%}), {cost * 1e6:,.0f} us to compress")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""Bulk upsert contacts, companies or deals into HubSpot from a CSV or NDJSON file.
+
+Rows are streamed from the input and deduplicated by their id property (email for
+contacts, domain for companies). They are then written with batch upsert calls of up
+to 100 records, a few calls at a time, within the portal's rate budget. Rows HubSpot
+rejects are reported one by one. A checkpoint records how far the input has been
+committed, so an interrupted run resumes where it stopped. Memory use does not grow
+with the size of the file.
+
+Usage:
+    python bulk_upsert.py contacts.csv --object-type contacts --checkpoint contacts.checkpoint
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import contextvars
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+# HubSpot batch endpoints accept at most this many inputs per call
+BATCH_SIZE = 100
+
+# Unique property each object type is upserted by, unless another one is given
+ID_PROPERTIES = {
+    "contacts": "email",
+    "companies": "domain",
+}
+
+# Recently seen ids kept for deduplication; upserts are idempotent, so a duplicate
+# that falls out of the window is only a wasted write, never a wrong one
+DEDUPE_WINDOW = 100_000
+
+# Backoff between retries of a batch HubSpot could not take (rate limit, 5xx, open circuit)
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+# (row number, fields, parse error) for each input row
+Row = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+# Input parsing
+
+def iter_rows(lines: Iterable[str], input_format: str) -> Iterator[Row]:
+    """Stream rows from CSV (with a header) or NDJSON text, one at a time.
+
+    CSV rows are numbered from 1 after the header; NDJSON rows by line number.
+    NDJSON objects may be flat or carry their fields under "properties".
+    """
+    if input_format == "csv":
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            # Cells beyond the header are collected under a None key
+            yield number, {key.strip(): value for key, value in row.items() if key is not None}, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(value, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, value["properties"] if isinstance(value.get("properties"), dict) else value, None
+
+
+def input_format_for(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def normalize_id(id_property: str, value: Any) -> Optional[str]:
+    """Canonical form of an id value, so the same record is recognized however it is written"""
+    value = str(value or "").strip()
+    if id_property == "email":
+        value = value.lower()
+        return value if re.fullmatch(r'[^@\s]+@[^@\s]+\.[^@\s]+', value) else None
+    if id_property == "domain":
+        value = re.sub(r'^[a-z]+://', "", value.lower())
+        value = value.split("/", 1)[0]
+        return value[4:] if value.startswith("www.") else value or None
+    return value or None
+
+
+def clean_properties(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Properties to write; empty cells are left out rather than clearing existing values"""
+    return {key: value for key, value in fields.items() if key and value is not None and value != ""}
+
+
+# Deduplication and checkpoints
+
+class DedupeWindow:
+    """Digest of the properties last written for each recently seen id, bounded in size.
+
+    Digests are put by the batch writers once HubSpot has taken the record, so a row whose
+    write failed is never mistaken for a duplicate of one that was written.
+    """
+
+    def __init__(self, max_ids: int = DEDUPE_WINDOW):
+        self.max_ids = max_ids
+        self._digests: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, record_id: str) -> Optional[str]:
+        with self._lock:
+            return self._digests.get(record_id)
+
+    def put(self, record_id: str, digest: str):
+        with self._lock:
+            self._digests[record_id] = digest
+            self._digests.move_to_end(record_id)
+            while len(self._digests) > self.max_ids:
+                self._digests.popitem(last=False)
+
+
+def properties_digest(properties: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(properties, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    """Last input row up to which every row has been written or reported, kept in a file"""
+
+    def __init__(self, path: str, object_type: str, source: str):
+        self.path = path
+        self.object_type = object_type
+        self.source = source
+        self.committed_row = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("object_type") != object_type or state.get("source") != source:
+                raise ValueError(f"Checkpoint {path} belongs to {state.get('object_type')} from {state.get('source')}; use another checkpoint file")
+            self.committed_row = int(state.get("committed_row", 0))
+
+    def save(self, committed_row: int, stats: Dict[str, Any]):
+        self.committed_row = committed_row
+        state = {"object_type": self.object_type, "source": self.source, "committed_row": committed_row, "stats": stats}
+        # Write and rename so an interrupted save never corrupts the checkpoint
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+# Batching and writing
+
+class UpsertBatch:
+    """Up to BATCH_SIZE records, each with the input rows it was built from"""
+
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.inputs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.rows: Dict[str, List[int]] = {}
+        # Every row up to this one is in this batch, an earlier one, or already reported
+        self.last_row = 0
+
+
+class BulkUpserter:
+    """Streams rows into batch upsert calls with bounded concurrency and per-row error reports"""
+
+    def __init__(
+        self,
+        fetch: Callable[..., Dict[str, Any]],
+        object_type: str,
+        id_property: Optional[str] = None,
+        batch_size: int = BATCH_SIZE,
+        concurrency: int = 4,
+        max_retries: int = 5,
+        dedupe_window: int = DEDUPE_WINDOW,
+        checkpoint: Optional[Checkpoint] = None,
+        on_error: Optional[Callable[[int, Optional[str], str], None]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        check: Optional[Callable[[], None]] = None,
+    ):
+        self.id_property = id_property or ID_PROPERTIES.get(object_type)
+        if not self.id_property:
+            raise ValueError(f"{object_type} have no natural unique property; give the unique property to upsert by")
+        self.fetch = fetch
+        self.object_type = object_type
+        self.endpoint = f"/crm/v3/objects/{object_type}/batch/upsert"
+        self.batch_size = max(1, min(batch_size, BATCH_SIZE))
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.window = DedupeWindow(dedupe_window)
+        self.checkpoint = checkpoint
+        self.on_error = on_error
+        self.on_progress = on_progress
+        # Raises to stop the run (e.g. the job was cancelled); called between rows and calls
+        self.check = check or (lambda: None)
+        self._lock = threading.Lock()
+        self._failure: Optional[BaseException] = None
+        self._pending_batches: Dict[int, int] = {}
+        self._next_commit_seq = 0
+        self.stats = {
+            "rows_read": 0,
+            "rows_skipped": 0,
+            "upserted": 0,
+            "created": 0,
+            "updated": 0,
+            "duplicates": 0,
+            "row_errors": 0,
+            "batches": 0,
+            "retries": 0,
+            "committed_row": 0,
+        }
+
+    def run(self, rows: Iterable[Row], resume_from_row: int = 0) -> Dict[str, Any]:
+        """Write all rows after resume_from_row (or the checkpoint); returns the run's counters"""
+        resume_from_row = max(resume_from_row, self.checkpoint.committed_row if self.checkpoint else 0)
+        self.stats["committed_row"] = resume_from_row
+        # At most this many batches are in memory: in flight plus waiting for a worker
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="bulk-upsert")
+        batch = UpsertBatch(0)
+        last_row = resume_from_row
+        try:
+            for number, fields, error in rows:
+                if number <= resume_from_row:
+                    self.stats["rows_skipped"] += 1
+                    continue
+                self._raise_failure()
+                self.check()
+                last_row = number
+                self.stats["rows_read"] += 1
+                self._add_row(batch, number, fields, error)
+                batch.last_row = number
+                if len(batch.inputs) >= self.batch_size:
+                    self._dispatch(executor, slots, batch)
+                    batch = UpsertBatch(batch.seq + 1)
+            if batch.inputs:
+                self._dispatch(executor, slots, batch)
+            executor.shutdown(wait=True)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        self._raise_failure()
+        # Rows after the last batch were all duplicates or reported errors
+        self._commit(max(last_row, self.stats["committed_row"]))
+        return dict(self.stats)
+
+    def _add_row(self, batch: UpsertBatch, number: int, fields: Optional[Dict[str, Any]], error: Optional[str]):
+        if error is not None:
+            self._row_error(number, None, error)
+            return
+        record_id = normalize_id(self.id_property, fields.get(self.id_property))
+        if record_id is None:
+            self._row_error(number, None, f"Missing or invalid {self.id_property}")
+            return
+        properties = clean_properties(fields)
+        properties[self.id_property] = record_id
+
+        pending = batch.inputs.get(record_id)
+        if pending is not None:
+            # The same record twice in one batch is rejected by HubSpot; later values win
+            pending["properties"].update(properties)
+            batch.rows[record_id].append(number)
+            self.stats["duplicates"] += 1
+            return
+        if self.window.get(record_id) == properties_digest(properties):
+            self.stats["duplicates"] += 1
+            return
+        batch.inputs[record_id] = {"idProperty": self.id_property, "id": record_id, "properties": properties}
+        batch.rows[record_id] = [number]
+
+    def _dispatch(self, executor: ThreadPoolExecutor, slots: threading.BoundedSemaphore, batch: UpsertBatch):
+        # Block reading until a slot frees up, so a large file never piles up in memory
+        while not slots.acquire(timeout=1):
+            self._raise_failure()
+            self.check()
+        with self._lock:
+            self._pending_batches[batch.seq] = batch.last_row
+            self.stats["batches"] += 1
+        # Batches run with the caller's context (portal, deadline)
+        future = executor.submit(contextvars.copy_context().run, self._write_batch, batch)
+        future.add_done_callback(lambda done: self._batch_done(done, batch, slots))
+
+    def _batch_done(self, future: Future, batch: UpsertBatch, slots: threading.BoundedSemaphore):
+        slots.release()
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            with self._lock:
+                self._failure = self._failure or error
+            return
+        with self._lock:
+            self._pending_batches[batch.seq] = -batch.last_row
+            # Advance the checkpoint over the batches that are done, in order
+            committed = None
+            while self._pending_batches.get(self._next_commit_seq, 0) < 0:
+                committed = -self._pending_batches.pop(self._next_commit_seq)
+                self._next_commit_seq += 1
+        if committed is not None:
+            self._commit(committed)
+
+    def _commit(self, committed_row: int):
+        with self._lock:
+            self.stats["committed_row"] = max(self.stats["committed_row"], committed_row)
+            stats = dict(self.stats)
+        if self.checkpoint is not None:
+            self.checkpoint.save(stats["committed_row"], stats)
+        if self.on_progress is not None:
+            self.on_progress(stats)
+
+    def _raise_failure(self):
+        if self._failure is not None:
+            raise self._failure
+
+    def _write_batch(self, batch: UpsertBatch):
+        self._write(list(batch.inputs.values()), batch.rows)
+
+    def _write(self, inputs: List[Dict[str, Any]], rows: Dict[str, List[int]]):
+        attempt = 0
+        while True:
+            self.check()
+            response = self.fetch(self.endpoint, method="POST", data={"inputs": inputs})
+            if "error" not in response and not response.get("message"):
+                break
+            status_code = response.get("status_code")
+            if "error" not in response or status_code in (401, 403, 404):
+                # Credentials, scopes or the object type are wrong; every other batch would fail too
+                raise RuntimeError(f"HubSpot refused the upsert: {response.get('message') or error_message(response)}")
+            if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+                # HubSpot rejected the batch for its data; split it to find the records at fault
+                if len(inputs) > 1:
+                    middle = len(inputs) // 2
+                    self._write(inputs[:middle], rows)
+                    self._write(inputs[middle:], rows)
+                else:
+                    self._input_error(inputs[0], rows, error_message(response))
+                return
+            attempt += 1
+            if attempt > self.max_retries:
+                for item in inputs:
+                    self._input_error(item, rows, f"Gave up after {attempt} attempts: {error_message(response)}")
+                return
+            with self._lock:
+                self.stats["retries"] += 1
+            backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            time.sleep(backoff * random.uniform(0.5, 1.0))
+
+        # A 207 response lists the records that failed next to the ones that were written
+        failed = set()
+        for error in response.get("errors", []):
+            ids = [normalize_id(self.id_property, value) for value in (error.get("context") or {}).get("ids", [])]
+            matched = [item for item in inputs if item["id"] in ids] or ([] if ids else inputs)
+            for item in matched:
+                if item["id"] not in failed:
+                    failed.add(item["id"])
+                    self._input_error(item, rows, error.get("message") or "Rejected by HubSpot")
+        # Only what HubSpot took counts for deduplicating later rows
+        for item in inputs:
+            if item["id"] not in failed:
+                self.window.put(item["id"], properties_digest(item["properties"]))
+        results = response.get("results", [])
+        created = sum(1 for result in results if result.get("new"))
+        with self._lock:
+            self.stats["upserted"] += len(inputs) - len(failed)
+            self.stats["created"] += created
+            self.stats["updated"] += max(0, len(inputs) - len(failed) - created)
+
+    def _input_error(self, item: Dict[str, Any], rows: Dict[str, List[int]], message: str):
+        for number in rows.get(item["id"], []):
+            self._row_error(number, item["id"], message)
+
+    def _row_error(self, number: int, record_id: Optional[str], message: str):
+        with self._lock:
+            self.stats["row_errors"] += 1
+        if self.on_error is not None:
+            self.on_error(number, record_id, message)
+
+
+def error_message(response: Dict[str, Any]) -> str:
+    """HubSpot's explanation of a failed call when it gave one, the HTTP error otherwise"""
+    details = response.get("details")
+    if isinstance(details, dict) and details.get("message"):
+        return str(details["message"])
+    return str(response.get("error"))
+
+
+# Command line
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV file with a header row, or NDJSON file")
+    parser.add_argument("--object-type", required=True, choices=["contacts", "companies", "deals"])
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from the file extension)")
+    parser.add_argument("--id-property", help="unique property to upsert by (default: email for contacts, domain for companies)")
+    parser.add_argument("--portal", help="portal id from HUBSPOT_PORTALS_FILE (default portal otherwise)")
+    parser.add_argument("--checkpoint", help="progress file; run again with the same file to resume")
+    parser.add_argument("--errors", help="NDJSON file for rejected rows (default: <input>.errors.ndjson)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    # Imported here so the server's configuration is only loaded when running the CLI
+    from simple_server import make_hubspot_request, tenant_registry
+    tenant = tenant_registry.get(args.portal)
+    source = os.path.abspath(args.input)
+    checkpoint = Checkpoint(args.checkpoint, args.object_type, source) if args.checkpoint else None
+    errors_path = args.errors or f"{args.input}.errors.ndjson"
+
+    with open(errors_path, "a") as errors, open(args.input, newline="", encoding="utf-8-sig") as lines:
+        errors_lock = threading.Lock()
+
+        def on_error(row: int, record_id: Optional[str], message: str):
+            with errors_lock:
+                errors.write(json.dumps({"row": row, "id": record_id, "error": message}) + "\n")
+
+        last_report = [0.0]
+
+        def on_progress(stats: Dict[str, Any]):
+            if time.monotonic() - last_report[0] >= 2:
+                last_report[0] = time.monotonic()
+                print(f"Committed through row {stats['committed_row']}: {stats['upserted']} upserted, {stats['row_errors']} errors", file=sys.stderr)
+
+        upserter = BulkUpserter(
+            lambda endpoint, **kwargs: make_hubspot_request(endpoint, tenant=tenant, **kwargs),
+            args.object_type,
+            id_property=args.id_property,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            checkpoint=checkpoint,
+            on_error=on_error,
+            on_progress=on_progress,
+        )
+        if checkpoint is not None and checkpoint.committed_row:
+            print(f"Resuming after row {checkpoint.committed_row}", file=sys.stderr)
+        stats = upserter.run(iter_rows(lines, args.format or input_format_for(args.input)))
+
+    print(json.dumps(stats, indent=2))
+    if stats["row_errors"]:
+        print(f"{stats['row_errors']} rows were rejected; see {errors_path}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
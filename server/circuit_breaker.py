@@ -0,0 +1,237 @@
+# Circuit breakers and last-known-good results for upstream incidents
+# Each upstream (HubSpot per endpoint family, each LLM provider) has a breaker that opens
+# after repeated failures so requests fail fast instead of waiting on a broken dependency,
+# then lets a few probe calls through (half-open) to detect recovery. While an upstream
+# is failing, HubSpot reads are answered from the last-known-good cache, marked stale,
+# and refreshed in the background.
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import re
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed → open after consecutive failures → half-open probes after a cool-down"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_opened_at: Optional[float] = None
+        self.probes_in_flight = 0
+        self.last_error: Optional[str] = None
+        self.failures = 0
+        self.successes = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go through now"""
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, self.reset_timeout - waited)
+                self.state = HALF_OPEN
+                self.half_opened_at = time.monotonic()
+                self.probes_in_flight = 0
+                print(f"Circuit {self.name} half-open; probing")
+            if self.state == HALF_OPEN:
+                if time.monotonic() - self.half_opened_at > self.reset_timeout:
+                    # A probe that never reported back must not keep the circuit stuck half-open
+                    self.half_opened_at = time.monotonic()
+                    self.probes_in_flight = 0
+                if self.probes_in_flight >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, 1)
+                self.probes_in_flight += 1
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                print(f"Circuit {self.name} closed; upstream recovered")
+            self.state = CLOSED
+            self.probes_in_flight = 0
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = error
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                    print(f"Circuit {self.name} opened after {self.consecutive_failures} failures: {error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probes_in_flight = 0
+
+    def release(self):
+        """Finish a call that neither succeeded nor failed from the upstream's point of view"""
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes_in_flight > 0:
+                self.probes_in_flight -= 1
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """Call fn through the breaker; any exception counts as a failure"""
+        self.allow()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(str(e))
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_after = None
+            if self.state == OPEN:
+                retry_after = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failures": self.failures,
+                "successes": self.successes,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "retry_after_seconds": retry_after,
+                "last_error": self.last_error,
+            }
+
+
+class BreakerRegistry:
+    """Breakers created on first use, all sharing the same settings"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout, self.half_open_max_calls)
+            return breaker
+
+    def any_open(self) -> bool:
+        with self._lock:
+            return any(breaker.state != CLOSED for breaker in self._breakers.values())
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+# HubSpot endpoint families, each with its own breaker. Batch writes (bulk upserts) are
+# a family of their own, so throttling of a large upload cannot open the circuit of reads.
+_FAMILY_PATTERNS = [
+    ("search", re.compile(r'^/crm/v\d+/objects/[^/]+/search')),
+    ("batch_write", re.compile(r'^/crm/v\d+/objects/[^/]+/batch/(?:upsert|create|update|archive)')),
+    ("batch", re.compile(r'^/crm/v\d+/objects/[^/]+/batch/')),
+    ("associations", re.compile(r'^/crm/v\d+/associations/')),
+    ("objects", re.compile(r'^/crm/v\d+/objects/')),
+]
+
+
+def hubspot_family(endpoint: str) -> str:
+    """Endpoint family of a HubSpot API path, e.g. /crm/v3/objects/contacts/search -> search"""
+    for family, pattern in _FAMILY_PATTERNS:
+        if pattern.match(endpoint):
+            return family
+    return "other"
+
+
+class LastKnownGood:
+    """Most recent successful result per request, served stale during incidents.
+
+    Serving a stale value schedules one background refresh per key, so the cache
+    catches up as soon as the upstream recovers.
+    """
+
+    def __init__(self, max_entries: int = 500, max_age_seconds: float = 86400, refresh_workers: int = 2):
+        self.max_entries = max_entries
+        self.max_age = max_age_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="stale-refresh")
+        self.served_stale = 0
+        self.refreshes = 0
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """(value, age_seconds) of the last good result, if it is not too old"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            age = time.time() - stored_at
+            if age > self.max_age:
+                del self._entries[key]
+                return None
+            self.served_stale += 1
+            return value, age
+
+    def revalidate(self, key: Hashable, refresh: Callable[[], Any]):
+        """Refresh a key in the background unless a refresh is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                print(f"Background refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "served_stale": self.served_stale,
+                "background_refreshes": self.refreshes,
+                "refreshing": len(self._refreshing),
+            }
@@ -0,0 +1,261 @@
+# Conditional requests for polling clients
+# Data responses carry a strong ETag computed from the versions (id + updatedAt) of the
+# records they contain, and a client that sends it back in If-None-Match gets an empty
+# 304 while nothing changed. The plan and encoded body of each validated response are
+# kept, so re-sending a query only re-runs its HubSpot fetch: no intent analysis, and no
+# LLM summary or serialization unless the records changed. Sync tokens let clients ask
+# for just the records modified since their last sync.
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import base64
+import hashlib
+import json
+import threading
+import time
+
+from starlette.responses import Response
+
+from association_graph import LAST_MODIFIED_PROPERTY
+
+# Suffixes the compression middleware appends to the ETag of an encoded representation
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+# HubSpot search returns at most this many records per page
+MAX_CHANGES_PAGE = 100
+
+
+# Entity tags
+
+def record_version(record: Dict[str, Any]) -> str:
+    """Version of a HubSpot record: its update time, or its content when there is none"""
+    props = record.get("properties") or {}
+    version = record.get("updatedAt") or props.get("hs_lastmodifieddate") or props.get("lastmodifieddate")
+    if version:
+        return str(version)
+    return hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def compute_etag(key: str, response_dict: Dict[str, Any]) -> Optional[str]:
+    """Strong ETag of a data response, or None when it must not be validated.
+
+    Errors and stale (last-known-good) results get no ETag, so clients never
+    hold on to them.
+    """
+    if not isinstance(response_dict, dict) or "error" in response_dict or response_dict.get("stale"):
+        return None
+    results = response_dict.get("results", [])
+    versions = [[str(record.get("id")), record_version(record)] for record in results]
+    return entity_tag(key, response_dict.get("total"), versions)
+
+
+def entity_tag(*parts: Any) -> str:
+    """Strong ETag over JSON-encodable parts"""
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag, as HTTP requires for 304s"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(_opaque_tag(candidate) == _opaque_tag(etag) for candidate in if_none_match.split(","))
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+# Validated responses
+
+class ValidatedResponse:
+    """The last response sent for a request, with the plan that produced its data"""
+
+    def __init__(self, etag: str, plan: Any, body: bytes):
+        self.etag = etag
+        self.plan = plan
+        self.body = body
+        self.created_at = time.monotonic()
+        self.validated_at = self.created_at
+
+
+class ConditionalResponses:
+    """Last validated response per request, for answering repeated and conditional requests.
+
+    Within fresh_seconds of the last validation a matching If-None-Match is answered
+    with a 304 without going to HubSpot at all. After max_age_seconds the entry is
+    dropped and the request runs the full pipeline again.
+    """
+
+    def __init__(self, max_entries: int = 1000, fresh_seconds: float = 5, max_age_seconds: float = 600):
+        self.max_entries = max_entries
+        self.fresh_seconds = fresh_seconds
+        self.max_age = max_age_seconds
+        self._entries: "OrderedDict[str, ValidatedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.not_modified = 0
+        self.fresh_not_modified = 0
+        self.bodies_reused = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(scope: str, path: str, request: Dict[str, Any]) -> str:
+        """Cache key of a request: the portal, the endpoint and the normalized body"""
+        return f"{scope}:{path}:{json.dumps(request, sort_keys=True, default=str)}"
+
+    def get(self, key: str) -> Optional[ValidatedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.created_at > self.max_age:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+            return entry
+
+    def plan(self, key: str) -> Any:
+        """Plan stored for a request, for fetching more of its pages; not counted as a revalidation"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry.created_at > self.max_age:
+                return None
+            return entry.plan
+
+    def is_fresh(self, entry: ValidatedResponse) -> bool:
+        return time.monotonic() - entry.validated_at < self.fresh_seconds
+
+    def put(self, key: str, etag: str, plan: Any, body: bytes):
+        with self._lock:
+            self._entries[key] = ValidatedResponse(etag, plan, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def validated(self, entry: ValidatedResponse):
+        """Record that HubSpot confirmed the entry's records are unchanged"""
+        entry.validated_at = time.monotonic()
+
+    def not_modified_response(self, etag: str, fresh: bool = False) -> Response:
+        with self._lock:
+            self.not_modified += 1
+            if fresh:
+                self.fresh_not_modified += 1
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    def reuse_response(self, entry: ValidatedResponse) -> Response:
+        """The stored body for data that is unchanged since it was encoded"""
+        with self._lock:
+            self.bodies_reused += 1
+        return Response(entry.body, media_type="application/json", headers={"ETag": entry.etag, "Cache-Control": "no-cache"})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "not_modified": self.not_modified,
+                "fresh_not_modified": self.fresh_not_modified,
+                "bodies_reused": self.bodies_reused,
+            }
+
+
+# Changes since a sync token
+
+def encode_sync_token(object_type: str, since_ms: int, seen_ids: List[str], after: Optional[str] = None) -> str:
+    state = {"o": object_type, "t": since_ms, "ids": seen_ids}
+    if after:
+        state["a"] = after
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: str, object_type: str) -> Dict[str, Any]:
+    """State of a sync token; raises ValueError if it is malformed or for another object type"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        since_ms = int(state["t"])
+        seen_ids = [str(i) for i in state.get("ids", [])]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid sync token")
+    if state.get("o") != object_type:
+        raise ValueError(f"Sync token is for {state.get('o')}, not {object_type}")
+    return {"since_ms": since_ms, "seen_ids": seen_ids, "after": state.get("a")}
+
+
+def timestamp_ms(value: Any) -> int:
+    """Epoch milliseconds of a HubSpot datetime property (ISO 8601 or epoch millis)"""
+    value = str(value)
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def changes_since(
+    fetch: Callable[..., Dict[str, Any]],
+    object_type: str,
+    token: Optional[str],
+    properties: List[str],
+    limit: int = MAX_CHANGES_PAGE,
+) -> Dict[str, Any]:
+    """Records of a type modified since the token, oldest first, and the token for the next call.
+
+    Without a token the sync starts from the beginning. The token advances to the
+    newest modification time returned; records sharing that exact time are listed in
+    it so they are not returned twice. Only a page made up entirely of records with
+    the same modification time falls back to HubSpot's paging cursor.
+    """
+    prop = LAST_MODIFIED_PROPERTY[object_type]
+    state = decode_sync_token(token, object_type) if token else {"since_ms": 0, "seen_ids": [], "after": None}
+    since_ms, seen_ids = state["since_ms"], set(state["seen_ids"])
+
+    body = {
+        "filterGroups": [{"filters": [{"propertyName": prop, "operator": "GTE", "value": str(since_ms)}]}],
+        "sorts": [{"propertyName": prop, "direction": "ASCENDING"}],
+        "properties": list(dict.fromkeys(properties + [prop])),
+        "limit": max(1, min(limit, MAX_CHANGES_PAGE)),
+    }
+    if state["after"]:
+        body["after"] = state["after"]
+    response = fetch(f"/crm/v3/objects/{object_type}/search", method="POST", data=body, allow_stale=False)
+    if "error" in response:
+        raise RuntimeError(response["error"])
+
+    results = []
+    newest_ms, newest_ids = since_ms, set(seen_ids)
+    for record in response.get("results", []):
+        modified = (record.get("properties") or {}).get(prop)
+        modified_ms = timestamp_ms(modified) if modified else since_ms
+        # Already returned at the token's modification time; a later change has a later time
+        if modified_ms == since_ms and str(record.get("id")) in seen_ids:
+            continue
+        results.append(record)
+        if modified_ms > newest_ms:
+            newest_ms, newest_ids = modified_ms, set()
+        newest_ids.add(str(record.get("id")))
+
+    after = response.get("paging", {}).get("next", {}).get("after")
+    if after and newest_ms == since_ms:
+        # The whole page has the token's modification time; page through it with the cursor
+        next_token = encode_sync_token(object_type, since_ms, sorted(newest_ids), after)
+    else:
+        next_token = encode_sync_token(object_type, newest_ms, sorted(newest_ids))
+    return {
+        "object_type": object_type,
+        "results": results,
+        "has_more": bool(after),
+        "next_token": next_token,
+    }
@@ -0,0 +1,46 @@
+# CRM connectors
+# Each integration (HubSpot first) implements the Connector hooks and is registered by
+# name with a factory that builds its connector for a portal. Connectors are created on
+# first use, one per integration and portal.
+
+from typing import Any, Callable, Dict, List
+
+from tenants import PerTenant, Tenant
+
+from .base import Connector, Page, SearchFilter
+from .hubspot import HUBSPOT_API_BASE, HubSpotConnector
+from .transport import AsyncTransport, Call, CallRejected, ConnectorError, ResponseCache
+
+
+class UnknownConnector(Exception):
+    """Raised when a request names an integration that is not registered"""
+
+
+class ConnectorRegistry:
+    """Connector factories by integration name"""
+
+    def __init__(self):
+        self._connectors: Dict[str, PerTenant[Connector]] = {}
+
+    def register(self, name: str, factory: Callable[[Tenant], Connector]):
+        self._connectors[name] = PerTenant(factory)
+
+    def get(self, name: str, tenant: Tenant) -> Connector:
+        connectors = self._connectors.get(name)
+        if connectors is None:
+            raise UnknownConnector(name)
+        return connectors.get(tenant)
+
+    def names(self) -> List[str]:
+        return list(self._connectors)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {tenant_id: connector.stats() for tenant_id, connector in connectors.items()}
+            for name, connectors in self._connectors.items()
+        }
+
+    async def close(self):
+        for connectors in self._connectors.values():
+            for _, connector in connectors.items():
+                await connector.close()
@@ -0,0 +1,175 @@
+# Common interface of CRM connectors
+# A connector describes how one integration lists, searches and batch-reads records and
+# how its pages are shaped. The calls themselves go through the connector's transport,
+# so every integration gets connection pooling, rate limiting, response caching and
+# metrics without implementing them again.
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+
+from .transport import AsyncTransport, Call
+
+
+@dataclass
+class Page:
+    """One page of records, with the cursor of the next page if there is one"""
+    object_type: str
+    results: List[Dict[str, Any]]
+    total: Optional[int] = None
+    after: Optional[str] = None
+
+
+@dataclass
+class SearchFilter:
+    """A property condition, translated by each connector into its own query syntax"""
+    property: str
+    operator: str  # eq, neq, lt, lte, gt, gte, contains
+    value: Any = None
+
+
+class Connector(ABC):
+    """Base class of integrations; subclasses build the calls and parse the pages.
+
+    list, search, batch_read and paginate are implemented here on top of the
+    build_* and parse_page hooks, so they behave (and perform) the same for
+    every integration.
+    """
+
+    # Registry name, e.g. "hubspot"
+    name = ""
+    object_types: Tuple[str, ...] = ()
+    # Properties requested when the caller names none
+    default_properties: Dict[str, List[str]] = {}
+    max_page_size = 100
+    max_batch_read = 100
+    # Batch reads of more ids than max_batch_read run this many calls at a time
+    batch_concurrency = 4
+
+    def __init__(self, transport: AsyncTransport):
+        self.transport = transport
+
+    # Hooks for each integration
+
+    @abstractmethod
+    def build_list(self, object_type: str, properties: List[str], limit: int, after: Optional[str]) -> Call:
+        """Call listing a page of records"""
+
+    @abstractmethod
+    def build_search(
+        self,
+        object_type: str,
+        query: Optional[str],
+        filters: List[SearchFilter],
+        properties: List[str],
+        limit: int,
+        after: Optional[str],
+    ) -> Call:
+        """Call searching for a page of records by text and filters"""
+
+    @abstractmethod
+    def build_batch_read(self, object_type: str, ids: List[str], properties: List[str]) -> Call:
+        """Call reading records by id"""
+
+    @abstractmethod
+    def parse_page(self, object_type: str, payload: Dict[str, Any]) -> Page:
+        """Page of records from the payload of any of the calls above"""
+
+    # Common operations
+
+    def check_object_type(self, object_type: str):
+        if object_type not in self.object_types:
+            raise ValueError(f"Unsupported object type for {self.name}: {object_type}. Must be one of: {', '.join(self.object_types)}")
+
+    def properties_for(self, object_type: str, properties: Optional[List[str]]) -> List[str]:
+        return list(properties) if properties else list(self.default_properties.get(object_type, []))
+
+    def page_size(self, limit: int) -> int:
+        return max(1, min(limit, self.max_page_size))
+
+    async def list(self, object_type: str, properties: Optional[List[str]] = None, limit: int = 10, after: Optional[str] = None) -> Page:
+        self.check_object_type(object_type)
+        call = self.build_list(object_type, self.properties_for(object_type, properties), self.page_size(limit), after)
+        return self.parse_page(object_type, await self.transport.request(call))
+
+    async def search(
+        self,
+        object_type: str,
+        query: Optional[str] = None,
+        filters: Optional[List[SearchFilter]] = None,
+        properties: Optional[List[str]] = None,
+        limit: int = 10,
+        after: Optional[str] = None,
+    ) -> Page:
+        self.check_object_type(object_type)
+        call = self.build_search(object_type, query, filters or [], self.properties_for(object_type, properties), self.page_size(limit), after)
+        return self.parse_page(object_type, await self.transport.request(call))
+
+    async def batch_read(self, object_type: str, ids: List[str], properties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Records by id, in the order asked for; ids that do not exist are left out"""
+        self.check_object_type(object_type)
+        properties = self.properties_for(object_type, properties)
+        ids = list(dict.fromkeys(str(i) for i in ids))
+        chunks = [ids[start:start + self.max_batch_read] for start in range(0, len(ids), self.max_batch_read)]
+        slots = asyncio.Semaphore(self.batch_concurrency)
+
+        async def read(chunk: List[str]) -> Page:
+            async with slots:
+                return self.parse_page(object_type, await self.transport.request(self.build_batch_read(object_type, chunk, properties)))
+
+        records = {}
+        for page in await asyncio.gather(*(read(chunk) for chunk in chunks)):
+            for record in page.results:
+                records[str(record.get("id"))] = record
+        return [records[i] for i in ids if i in records]
+
+    async def paginate(
+        self,
+        object_type: str,
+        query: Optional[str] = None,
+        filters: Optional[List[SearchFilter]] = None,
+        properties: Optional[List[str]] = None,
+        page_size: int = 100,
+        max_records: Optional[int] = None,
+        after: Optional[str] = None,
+    ) -> AsyncIterator[Page]:
+        """Pages of a list (or of a search, given a query or filters) until done or max_records.
+
+        The next page is requested while the caller processes the current one.
+        """
+        searching = bool(query or filters)
+        fetched = 0
+
+        def fetch(cursor: Optional[str], size: int):
+            if searching:
+                return asyncio.ensure_future(self.search(object_type, query, filters, properties, size, cursor))
+            return asyncio.ensure_future(self.list(object_type, properties, size, cursor))
+
+        def next_size() -> int:
+            return page_size if max_records is None else min(page_size, max_records - fetched)
+
+        pending = fetch(after, next_size())
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+                if max_records is not None:
+                    page.results = page.results[:max_records - fetched]
+                fetched += len(page.results)
+                if page.after and (max_records is None or fetched < max_records):
+                    pending = fetch(page.after, next_size())
+                yield page
+        finally:
+            if pending is not None:
+                # The caller stopped early; don't leave the read-ahead running
+                pending.cancel()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "object_types": list(self.object_types)}
+
+    def stats(self) -> Dict[str, Any]:
+        return self.transport.stats()
+
+    async def close(self):
+        await self.transport.aclose()
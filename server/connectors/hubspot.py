@@ -0,0 +1,104 @@
+# HubSpot CRM connector
+# Lists, searches and batch-reads contacts, companies and deals through the v3 objects
+# API. Its transport uses the portal's credentials and rate budget and is also the one the
+# server's blocking HubSpot calls (make_hubspot_request) go through, so every HubSpot call
+# of a portal shares one connection pool, rate budget, set of circuit breakers and metrics.
+
+from typing import Any, Dict, List, Optional
+
+from circuit_breaker import BreakerRegistry, hubspot_family
+from fast_json import RawPayload
+from query_planner import DEFAULT_PROPERTIES, SUPPORTED_OBJECT_TYPES
+from tenants import Tenant
+
+from .base import Connector, Page, SearchFilter
+from .transport import AsyncTransport, Call, ResponseCache
+
+HUBSPOT_API_BASE = "https://api.hubapi.com"
+
+# Search operators for the connector-neutral filter operators
+OPERATORS = {
+    "eq": "EQ",
+    "neq": "NEQ",
+    "lt": "LT",
+    "lte": "LTE",
+    "gt": "GT",
+    "gte": "GTE",
+    "contains": "CONTAINS_TOKEN",
+}
+
+
+class HubSpotConnector(Connector):
+    name = "hubspot"
+    object_types = tuple(SUPPORTED_OBJECT_TYPES)
+    default_properties = DEFAULT_PROPERTIES
+    max_page_size = 100
+    max_batch_read = 100
+
+    @classmethod
+    def for_tenant(
+        cls,
+        tenant: Tenant,
+        breakers: Optional[BreakerRegistry] = None,
+        cache: Optional[ResponseCache] = None,
+        timeout: float = 30,
+        rate_wait: float = 5,
+        http_transport: Optional[Any] = None,
+    ) -> "HubSpotConnector":
+        return cls(AsyncTransport(
+            f"hubspot:{tenant.tenant_id}",
+            HUBSPOT_API_BASE,
+            headers=tenant.headers,
+            params=tenant.auth_params(),
+            limiter=tenant.rate_budget,
+            breakers=breakers,
+            # One breaker per endpoint family
+            breaker_name=lambda path: f"hubspot:{tenant.tenant_id}:{hubspot_family(path)}",
+            cache=cache,
+            pool_size=tenant.pool_size,
+            timeout=timeout,
+            rate_wait=rate_wait,
+            # Unmodified payloads are passed through to clients as the bytes HubSpot sent
+            decode=RawPayload.from_bytes,
+            http_transport=http_transport,
+        ))
+
+    def build_list(self, object_type: str, properties: List[str], limit: int, after: Optional[str]) -> Call:
+        params = {"limit": limit, "properties": ",".join(properties)}
+        if after:
+            params["after"] = after
+        return Call("GET", f"/crm/v3/objects/{object_type}", params=params)
+
+    def build_search(
+        self,
+        object_type: str,
+        query: Optional[str],
+        filters: List[SearchFilter],
+        properties: List[str],
+        limit: int,
+        after: Optional[str],
+    ) -> Call:
+        body: Dict[str, Any] = {"properties": properties, "limit": limit}
+        if query:
+            body["query"] = query
+        if filters:
+            conditions = []
+            for condition in filters:
+                if condition.operator not in OPERATORS:
+                    raise ValueError(f"Unsupported filter operator: {condition.operator}. Must be one of: {', '.join(OPERATORS)}")
+                conditions.append({"propertyName": condition.property, "operator": OPERATORS[condition.operator], "value": str(condition.value)})
+            body["filterGroups"] = [{"filters": conditions}]
+        if after:
+            body["after"] = after
+        return Call("POST", f"/crm/v3/objects/{object_type}/search", json=body)
+
+    def build_batch_read(self, object_type: str, ids: List[str], properties: List[str]) -> Call:
+        return Call("POST", f"/crm/v3/objects/{object_type}/batch/read", json={"properties": properties, "inputs": [{"id": i} for i in ids]})
+
+    def parse_page(self, object_type: str, payload: Dict[str, Any]) -> Page:
+        return Page(
+            object_type,
+            payload.get("results", []),
+            total=payload.get("total"),
+            after=payload.get("paging", {}).get("next", {}).get("after"),
+        )
@@ -0,0 +1,368 @@
+# Pooled HTTP transport shared by all connectors
+# Calls run on the event loop over keep-alive connections (httpx), so a connector read
+# does not occupy a worker thread while it waits on the network. Each call draws on the
+# integration's rate budget and goes through its circuit breaker. Identical reads are
+# answered from a short-lived response cache and concurrent ones share one request.
+# Every outcome is counted in the transport's metrics. Code running in worker threads
+# sends through the same budget, breakers, metrics and error handling with send_blocking.
+
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+
+from circuit_breaker import BreakerRegistry, CircuitBreaker, CircuitOpen
+from deadlines import get_deadline
+from tenants import RateBudget
+
+# Latencies kept for the percentile in the metrics
+LATENCY_WINDOW = 500
+
+
+@dataclass
+class Call:
+    """One HTTP request of a connector operation"""
+    method: str
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    json: Optional[Dict[str, Any]] = None
+    # Reads are cached and coalesced; writes never are
+    read: bool = True
+
+    def key(self) -> str:
+        return f"{self.method} {self.path} {json.dumps(self.params, sort_keys=True, default=str)} {json.dumps(self.json, sort_keys=True, default=str)}"
+
+
+class ConnectorError(Exception):
+    """A connector call that failed, with the upstream's status and error body when it sent one"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, details: Any = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+        self.retry_after = retry_after
+
+
+class CallRejected(ConnectorError):
+    """A call that was not sent: out of time (no status), out of rate budget (429) or circuit open (503)"""
+
+
+class ResponseCache:
+    """Recent read responses by call, dropped after ttl_seconds.
+
+    Cached payloads are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 30):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, payload: Dict[str, Any]):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (payload, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class TransportMetrics:
+    """Request counts, outcomes and latency of one transport"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.circuit_rejected = 0
+        self.by_status: Counter = Counter()
+        self.total_seconds = 0.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, status: Any, seconds: float):
+        self.requests += 1
+        self.by_status[str(status)] += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+        self.total_seconds += seconds
+        self._latencies.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "circuit_rejected": self.circuit_rejected,
+            "by_status": dict(self.by_status),
+            "avg_ms": round(self.total_seconds * 1000 / self.requests, 1) if self.requests else None,
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+        }
+
+
+class AsyncTransport:
+    """Connection pool, rate budget, circuit breakers, response cache and metrics for one integration"""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, str]] = None,
+        limiter: Optional[RateBudget] = None,
+        breakers: Optional[BreakerRegistry] = None,
+        breaker_name: Optional[Callable[[str], str]] = None,
+        cache: Optional[ResponseCache] = None,
+        pool_size: int = 10,
+        timeout: float = 30,
+        rate_wait: float = 5,
+        decode: Callable[[bytes], Any] = json.loads,
+        http_transport: Optional[Any] = None,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.headers = headers or {}
+        # Sent with every call, e.g. API key authentication
+        self.params = params or {}
+        self.limiter = limiter
+        self.breakers = breakers
+        # Breaker of a call's path; one breaker for the whole integration by default
+        self.breaker_name = breaker_name or (lambda path: name)
+        self.cache = cache
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_wait = rate_wait
+        # Payload of a successful response body
+        self.decode = decode
+        # httpx transport to send through instead of the network, e.g. httpx.MockTransport
+        self.http_transport = http_transport
+        self.metrics = TransportMetrics()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._blocking_http: Optional[httpx.Client] = None
+        self._blocking_lock = threading.Lock()
+
+    def _client_options(self) -> Dict[str, Any]:
+        options = {
+            "base_url": self.base_url,
+            "headers": self.headers,
+            "limits": httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            "timeout": self.timeout,
+        }
+        if self.http_transport is not None:
+            options["transport"] = self.http_transport
+        return options
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pooled connections belong to the event loop that opened them
+            self._http = httpx.AsyncClient(**self._client_options())
+            self._loop = loop
+            self._inflight = {}
+        return self._http
+
+    def _blocking_client(self) -> httpx.Client:
+        with self._blocking_lock:
+            if self._blocking_http is None:
+                self._blocking_http = httpx.Client(**self._client_options())
+            return self._blocking_http
+
+    async def request(self, call: Call) -> Dict[str, Any]:
+        """JSON payload of a call; raises ConnectorError if it fails"""
+        if not call.read:
+            return await self._send(call)
+
+        key = call.key()
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        self._client()
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # The same read is already on its way; share its result
+            self.metrics.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The caller that sent it gave up before it finished; send it again
+                return await self.request(call)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            payload = await self._send(call)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so a read nobody else awaited doesn't log a warning
+            future.exception()
+            raise
+        else:
+            future.set_result(payload)
+            if self.cache is not None:
+                self.cache.put(key, payload)
+            return payload
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _send(self, call: Call) -> Dict[str, Any]:
+        client = self._client()
+        timeout = self._timeout()
+        if self.limiter is not None and not await self.limiter.acquire_async(min(timeout, self.rate_wait)):
+            raise self._rate_limited()
+        breaker = self._admit(call)
+        started = time.monotonic()
+        try:
+            response = await client.request(call.method, call.path, params=self._params(call), json=call.json, timeout=timeout)
+        except httpx.HTTPError as e:
+            raise self._transport_error(e, breaker, timeout, started)
+        return self._payload(call, response, breaker, started)
+
+    def send_blocking(self, call: Call) -> Dict[str, Any]:
+        """JSON payload of a call sent from a worker thread; raises ConnectorError if it fails.
+
+        Unlike request, the call is never cached or shared with other callers.
+        """
+        client = self._blocking_client()
+        timeout = self._timeout()
+        if self.limiter is not None and not self.limiter.acquire(min(timeout, self.rate_wait)):
+            raise self._rate_limited()
+        breaker = self._admit(call)
+        started = time.monotonic()
+        try:
+            response = client.request(call.method, call.path, params=self._params(call), json=call.json, timeout=timeout)
+        except httpx.HTTPError as e:
+            raise self._transport_error(e, breaker, timeout, started)
+        return self._payload(call, response, breaker, started)
+
+    # Steps shared by both ways of sending
+
+    def _timeout(self) -> float:
+        """Timeout of the next call, bounded by the request deadline"""
+        timeout = self.timeout
+        deadline = get_deadline()
+        if deadline is not None:
+            if deadline.expired:
+                raise CallRejected(f"Request cancelled: {deadline.cancel_reason or 'request deadline exceeded'}")
+            timeout = min(timeout, deadline.remaining())
+        return timeout
+
+    def _rate_limited(self) -> CallRejected:
+        self.metrics.rate_limited += 1
+        return CallRejected(f"{self.name} rate budget exhausted", status_code=429, retry_after=1)
+
+    def _admit(self, call: Call) -> Optional[CircuitBreaker]:
+        """The call's circuit breaker, once it lets the call through"""
+        breaker = self.breakers.get(self.breaker_name(call.path)) if self.breakers is not None else None
+        if breaker is not None:
+            try:
+                breaker.allow()
+            except CircuitOpen as e:
+                self.metrics.circuit_rejected += 1
+                raise CallRejected(str(e), status_code=503, retry_after=e.retry_after)
+        return breaker
+
+    def _params(self, call: Call) -> Optional[Dict[str, Any]]:
+        return {**(call.params or {}), **self.params} or None
+
+    def _transport_error(self, e: httpx.HTTPError, breaker: Optional[CircuitBreaker], timeout: float, started: float) -> ConnectorError:
+        self.metrics.record(type(e).__name__, time.monotonic() - started)
+        if breaker is not None:
+            if isinstance(e, httpx.TimeoutException) and timeout < self.timeout:
+                # Cut short by the request deadline, not a sign that the upstream is down
+                breaker.release()
+            else:
+                breaker.record_failure(str(e) or type(e).__name__)
+        return ConnectorError(f"{self.name} request failed: {e or type(e).__name__}")
+
+    def _payload(self, call: Call, response: httpx.Response, breaker: Optional[CircuitBreaker], started: float) -> Dict[str, Any]:
+        self.metrics.record(response.status_code, time.monotonic() - started)
+        if response.status_code >= 400:
+            if breaker is not None:
+                if response.status_code >= 500 or response.status_code == 429:
+                    breaker.record_failure(f"HTTP {response.status_code}")
+                else:
+                    # Client errors mean the upstream is up
+                    breaker.record_success()
+            try:
+                details = response.json()
+            except ValueError:
+                details = response.text or None
+            retry_after = response.headers.get("retry-after")
+            raise ConnectorError(
+                f"{self.name} returned HTTP {response.status_code} for {call.method} {call.path}",
+                status_code=response.status_code,
+                details=details,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        if breaker is not None:
+            breaker.record_success()
+        try:
+            return self.decode(response.content) if response.content else {}
+        except ValueError as e:
+            raise ConnectorError(f"Invalid JSON from {self.name}: {e}", status_code=response.status_code)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"pool_size": self.pool_size, **self.metrics.stats()}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.limiter is not None:
+            stats["rate_budget"] = self.limiter.stats()
+        return stats
+
+    async def aclose(self):
+        if self._http is not None and self._loop is asyncio.get_running_loop():
+            await self._http.aclose()
+        self._http = None
+        self._loop = None
+        with self._blocking_lock:
+            if self._blocking_http is not None:
+                self._blocking_http.close()
+            self._blocking_http = None
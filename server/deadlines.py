@@ -0,0 +1,185 @@
+# End-to-end request deadlines
+# Each request gets a deadline, set per endpoint or by the X-Request-Timeout header. The
+# deadline is visible to every stage through a context variable, splits its remaining
+# budget across intent analysis, HubSpot calls and agent steps, and is cancelled when
+# the client disconnects so no more LLM tokens or HubSpot quota are spent on it.
+
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import math
+import threading
+import time
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+# How often to poll for a disconnected client
+DISCONNECT_POLL_SECONDS = 0.25
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of time or is cancelled"""
+
+
+class Deadline:
+    """Time budget and cancellation flag for one request"""
+
+    def __init__(self, timeout_seconds: float, runner: Callable[..., Awaitable] = run_in_threadpool, parent: Optional["Deadline"] = None):
+        self.timeout_seconds = timeout_seconds
+        # Runs blocking stages off the event loop
+        self.runner = runner
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + timeout_seconds
+        self._cancel_reason: Optional[str] = None
+        # The request deadline of a stage deadline; cancelling it cancels the stage too
+        self.parent = parent
+        # Set from the event loop, read from worker threads
+        self._cancelled = threading.Event()
+        self._cancel_waiters = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        if self._cancel_reason is None and self.parent is not None:
+            return self.parent.cancel_reason
+        return self._cancel_reason
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or self.remaining() <= 0
+
+    def cancel(self, reason: str):
+        """Cancel outstanding work for this request"""
+        if self.cancelled:
+            return
+        self._cancel_reason = reason
+        self._cancelled.set()
+        for loop, event in self._cancel_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def budget(self, fraction: float = 1.0) -> float:
+        """Seconds a stage may use: a fraction of whatever time is left"""
+        return self.remaining() * fraction
+
+    def stage(self, fraction: float = 1.0) -> "Deadline":
+        """Deadline of one stage: its share of the budget, cancelled with the request"""
+        return Deadline(self.budget(fraction), self.runner, parent=self)
+
+    def check(self):
+        """Raise DeadlineExceeded if the request is out of time or cancelled"""
+        if self.cancelled:
+            raise DeadlineExceeded(self.cancel_reason)
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("request deadline exceeded")
+
+    async def wait(self, awaitable: Awaitable, fraction: float = 1.0) -> Any:
+        """Await a stage within its share of the budget, abandoning it on expiry or cancellation.
+
+        Abandoning cancels the awaitable, which does not stop a worker thread it is
+        waiting on; blocking stages should go through run, which lets them see that
+        they have been abandoned.
+        """
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        # An abandoned stage may still finish or fail later; nobody is waiting for it
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+        cancelled = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), cancelled)
+        self._cancel_waiters.append(waiter)
+        cancel_task = asyncio.ensure_future(cancelled.wait())
+        try:
+            done, _ = await asyncio.wait({task, cancel_task}, timeout=self.budget(fraction), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancel_task.cancel()
+            self._cancel_waiters.remove(waiter)
+
+        if task in done:
+            return task.result()
+        task.cancel()
+        raise DeadlineExceeded(self.cancel_reason or "request deadline exceeded")
+
+    async def run(self, fn: Callable, *args, fraction: float = 1.0, **kwargs) -> Any:
+        """Run a blocking stage in the thread pool within its share of the budget.
+
+        fn runs with a stage deadline as its current deadline (get_deadline()), which
+        expires with the stage's share and is cancelled when the stage is abandoned.
+        A thread cannot be stopped from outside, so fn must check the deadline before
+        each call it makes and bound the call's timeout by it, as make_hubspot_request
+        does; otherwise an abandoned stage keeps running in its thread.
+        """
+        self.check()
+        stage = self.stage(fraction)
+
+        def run_stage():
+            token = current_deadline.set(stage)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                current_deadline.reset(token)
+
+        try:
+            return await self.wait(self.runner(run_stage), fraction)
+        except (DeadlineExceeded, asyncio.CancelledError):
+            stage.cancel("stage abandoned")
+            raise
+
+
+# Deadline of the request being handled, visible to helpers called from any stage
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return current_deadline.get()
+
+
+async def _watch_disconnect(request: Request, deadline: Deadline):
+    while not deadline.expired:
+        if await request.is_disconnected():
+            print(f"Client disconnected from {request.url.path}; cancelling outstanding work")
+            deadline.cancel("client disconnected")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+def request_deadline_dependency(endpoint_timeouts: Dict[str, float], default_timeout: float, max_timeout: float,
+                                runner: Callable[..., Awaitable] = run_in_threadpool):
+    """FastAPI dependency creating the request's deadline and watching for client disconnects"""
+
+    async def request_deadline(request: Request):
+        timeout = endpoint_timeouts.get(request.url.path, default_timeout)
+        header = request.headers.get("x-request-timeout")
+        if header:
+            try:
+                requested = float(header)
+            except ValueError:
+                requested = None
+            # Zero, negative and non-finite values (nan, inf) keep the endpoint timeout
+            if requested is not None and math.isfinite(requested) and requested > 0:
+                timeout = min(requested, max_timeout)
+
+        deadline = Deadline(timeout, runner)
+        current_deadline.set(deadline)
+        watcher = asyncio.create_task(_watch_disconnect(request, deadline))
+        try:
+            yield deadline
+        finally:
+            watcher.cancel()
+
+    return request_deadline
+
+
+def parse_timeouts(spec: str) -> Dict[str, float]:
+    """Parse "path:seconds,..." into per-endpoint timeouts"""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        path, seconds = item.rsplit(":", 1)
+        timeouts[path] = float(seconds)
+    return timeouts
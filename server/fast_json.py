@@ -0,0 +1,215 @@
+# Fast JSON response path
+# HubSpot payloads that are returned untransformed keep their original bytes and are
+# spliced into the response envelope instead of being re-encoded. Responses are encoded
+# with orjson when it is installed (stdlib json otherwise), bypass pydantic validation of
+# the data payload, and are compressed with brotli or gzip when the client accepts it.
+
+from typing import Any, Dict, Optional
+import gzip
+import json
+import threading
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+
+# Optional faster encoder and brotli compression
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+# Brotli quality 4-5 compresses better than gzip at similar CPU cost
+BROTLI_QUALITY = 4
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a value as compact JSON bytes"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Types orjson doesn't know (e.g. pydantic models) go through FastAPI's encoder
+            return orjson.dumps(jsonable_encoder(value), option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(value), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(content: bytes) -> Any:
+    """Decode JSON bytes; raises ValueError on invalid JSON"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class RawPayload(dict):
+    """A decoded HubSpot response that remembers its original bytes.
+
+    It behaves like the dict callers already use; when it reaches the response
+    unmodified, the original bytes are written out instead of re-encoding it.
+    Any mutation drops the bytes so a changed payload is never sent stale.
+    """
+
+    __slots__ = ("raw",)
+
+    def __init__(self, value: Dict[str, Any], raw: Optional[bytes] = None):
+        super().__init__(value)
+        self.raw = raw
+
+    @classmethod
+    def from_bytes(cls, content: bytes) -> "RawPayload":
+        value = loads(content)
+        if not isinstance(value, dict):
+            raise ValueError("Expected a JSON object")
+        return cls(value, content)
+
+    def __setitem__(self, key, value):
+        self.raw = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.raw = None
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        self.raw = None
+        super().update(*args, **kwargs)
+
+    def pop(self, *args):
+        self.raw = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self.raw = None
+        return super().popitem()
+
+    def __ior__(self, other):
+        self.raw = None
+        return super().__ior__(other)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.raw = None
+        return super().setdefault(key, default)
+
+    def clear(self):
+        self.raw = None
+        super().clear()
+
+
+def encode_value(value: Any) -> bytes:
+    if isinstance(value, RawPayload) and value.raw is not None:
+        return value.raw
+    return dumps(value)
+
+
+def encode_envelope(envelope: Dict[str, Any]) -> bytes:
+    """Encode a response envelope, splicing raw payloads in as they are"""
+    parts = [dumps(str(key)) + b":" + encode_value(value) for key, value in envelope.items()]
+    return b"{" + b",".join(parts) + b"}"
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with the fast path; returning it skips response_model validation"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, dict):
+            return encode_envelope(content)
+        return dumps(content)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    if BROTLI_AVAILABLE and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """Compresses JSON responses with brotli or gzip according to Accept-Encoding"""
+
+    def __init__(self, minimum_size: int = MIN_COMPRESS_BYTES):
+        self.minimum_size = minimum_size
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.by_encoding: Dict[str, int] = {}
+
+    async def __call__(self, request: Request, call_next):
+        response = await call_next(request)
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        if (
+            encoding is None
+            or "content-encoding" in response.headers
+            or not response.headers.get("content-type", "").startswith("application/json")
+        ):
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        compressed = compress(body, encoding) if len(body) >= self.minimum_size else None
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed) if compressed is not None else len(body)
+            if compressed is not None:
+                self.compressed += 1
+                self.by_encoding[encoding] = self.by_encoding.get(encoding, 0) + 1
+
+        result = Response(compressed if compressed is not None else body, status_code=response.status_code)
+        # Keep every original header (including repeated ones) except the length, which changes
+        result.raw_headers = [(name, value) for name, value in response.raw_headers if name != b"content-length"]
+        result.headers["content-length"] = str(len(result.body))
+        result.headers["vary"] = "Accept-Encoding"
+        if compressed is not None:
+            result.headers["content-encoding"] = encoding
+            # The encoded bytes are a different representation, so they get their own strong ETag
+            etag = result.headers.get("etag")
+            if etag and etag.endswith('"'):
+                result.headers["etag"] = f'{etag[:-1]}-{encoding}"'
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "orjson": ORJSON_AVAILABLE,
+                "brotli": BROTLI_AVAILABLE,
+                "responses": self.responses,
+                "compressed": self.compressed,
+                "by_encoding": dict(self.by_encoding),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "compression_ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            }
@@ -0,0 +1,170 @@
+# Micro-batching of LLM intent classification
+# Classification requests that arrive within a short window are sent to the LLM as one
+# multi-query prompt, so the long instruction block is paid once per batch instead of
+# once per request. Results are demultiplexed back to the waiting callers. Only queries
+# of the same group (portal) share a prompt.
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import queue
+import re
+import threading
+import time
+
+IntentResult = Tuple[str, Dict[str, Any]]
+
+
+def extract_json(response_text: str, opening: str = "{", closing: str = "}") -> str:
+    """Pull the JSON document out of an LLM response, preferring fenced code blocks"""
+    json_match = re.search(r'```(?:json)?\s*(.+?)\s*```', response_text, re.DOTALL)
+    if json_match:
+        return json_match.group(1).strip()
+    start = response_text.find(opening)
+    end = response_text.rfind(closing)
+    if start == -1 or end < start:
+        return response_text
+    return response_text[start:end + 1]
+
+
+class _PendingIntent:
+    """A query waiting to be classified as part of a batch"""
+
+    def __init__(self, query: str, group: Optional[str] = None):
+        self.query = query
+        self.group = group
+        self.future: Future = Future()
+
+
+class IntentBatcher:
+    """Collects concurrent intent classification requests into multi-query LLM prompts"""
+
+    def __init__(
+        self,
+        invoke: Callable[[str], str],
+        instructions: str,
+        window_ms: float = 5,
+        max_batch_size: int = 8,
+        max_concurrent_batches: int = 4,
+    ):
+        self.invoke = invoke
+        self.instructions = instructions
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue: "queue.Queue[_PendingIntent]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="intent-batch")
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch = 0
+        # Queries that arrived alone and were classified with the single-query prompt
+        self.unbatched = 0
+        self.parse_failures = 0
+        self.item_fallbacks = 0
+        self._collector = threading.Thread(target=self._collect, name="intent-batcher", daemon=True)
+        self._collector.start()
+
+    def classify(self, query: str, timeout: Optional[float] = None, group: Optional[str] = None) -> Optional[IntentResult]:
+        """Classify a query as part of the next batch of its group.
+
+        Queries of different groups, e.g. different portals, never share a prompt.
+        Returns None when the batch response had no usable result for this query, in
+        which case the caller should fall back to a single-query classification.
+        """
+        pending = _PendingIntent(query, group)
+        self._queue.put(pending)
+        return pending.future.result(timeout=timeout)
+
+    def build_prompt(self, queries: List[str]) -> str:
+        """Build one structured prompt covering every query in the batch"""
+        numbered = "\n".join(f"{index}. {json.dumps(query)}" for index, query in enumerate(queries, start=1))
+        return f"""
+            Analyze each of these queries about HubSpot CRM data:
+            {numbered}
+            {self.instructions}
+            Format your response as a JSON array with one object per query, in the same order,
+            each with 'id' (the query number), 'intent' and 'intent_data' fields.
+            Example: [{{"id": 1, "intent": "lookup", "intent_data": {{"object_type": "contacts", "contact_name": "John Smith"}}}}]
+
+            JSON response:
+            """
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching metrics"""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+                "max_batch_size": self.max_observed_batch,
+                "unbatched": self.unbatched,
+                "parse_failures": self.parse_failures,
+                "item_fallbacks": self.item_fallbacks,
+                "queued": self._queue.qsize(),
+            }
+
+    def _collect(self):
+        """Gather requests arriving within the batching window and dispatch them, one batch per group"""
+        # group -> (dispatch time, batch)
+        open_batches: Dict[Optional[str], Tuple[float, List[_PendingIntent]]] = {}
+        while True:
+            timeout = None
+            if open_batches:
+                timeout = max(0.0, min(dispatch_at for dispatch_at, _ in open_batches.values()) - time.monotonic())
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                pending = None
+            if pending is not None:
+                _, batch = open_batches.setdefault(pending.group, (time.monotonic() + self.window, []))
+                batch.append(pending)
+
+            now = time.monotonic()
+            for group, (dispatch_at, batch) in list(open_batches.items()):
+                if len(batch) >= self.max_batch_size or dispatch_at <= now:
+                    del open_batches[group]
+                    self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[_PendingIntent]):
+        """Send one batch to the LLM and hand each caller its own result"""
+        if len(batch) == 1:
+            # Nothing to share; let the caller use the regular single-query prompt
+            with self._lock:
+                self.unbatched += 1
+            batch[0].future.set_result(None)
+            return
+
+        # Only multi-query prompts count as batches
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.max_observed_batch = max(self.max_observed_batch, len(batch))
+
+        results: Dict[int, IntentResult] = {}
+        try:
+            response_text = self.invoke(self.build_prompt([pending.query for pending in batch]))
+            parsed = json.loads(extract_json(response_text, "[", "]"))
+            if isinstance(parsed, dict):
+                parsed = parsed.get("results", [])
+            for position, item in enumerate(parsed, start=1):
+                if not isinstance(item, dict) or "intent" not in item:
+                    continue
+                item_id = item.get("id", position)
+                try:
+                    item_id = int(item_id)
+                except (TypeError, ValueError):
+                    item_id = position
+                intent_data = item.get("intent_data") or {}
+                if isinstance(intent_data, dict):
+                    results[item_id] = (item["intent"], intent_data)
+        except Exception as e:
+            print(f"Error parsing batched intent response for {len(batch)} queries: {e}")
+            with self._lock:
+                self.parse_failures += 1
+
+        for index, pending in enumerate(batch, start=1):
+            result = results.get(index)
+            if result is None:
+                with self._lock:
+                    self.item_fallbacks += 1
+            pending.future.set_result(result)
@@ -0,0 +1,376 @@
+# Asynchronous jobs for long-running queries and reports
+# Heavy work (large agent runs, exports that page through thousands of records) is
+# submitted as a job instead of holding an HTTP connection open until a proxy times out.
+# A bounded worker pool runs jobs at a controlled concurrency; each job reports progress
+# and emits partial results that clients can poll or stream. Jobs are persisted to local
+# files until their TTL expires, so finished results survive a restart.
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+
+from deadlines import Deadline, DeadlineExceeded, current_deadline
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = {SUCCEEDED, FAILED, CANCELLED}
+
+# Seconds between keep-alive lines on an idle job stream
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting for a worker"""
+
+
+class Job:
+    """A submitted unit of work with its progress, partial results and outcome"""
+
+    def __init__(self, job_id: str, kind: str, params: Dict[str, Any], tenant_id: str):
+        self.job_id = job_id
+        self.kind = kind
+        self.params = params
+        self.tenant_id = tenant_id
+        self.status = QUEUED
+        self.progress: Dict[str, Any] = {"done": 0, "total": None, "message": "Queued"}
+        # Partial results in the order the job emitted them
+        self.chunks: List[Any] = []
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self.deadline: Optional[Deadline] = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self, offset: int = 0) -> Dict[str, Any]:
+        """Status, progress, the partial results from offset on, and the outcome once finished"""
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "expires_at": self.expires_at,
+                "chunks": self.chunks[offset:],
+                "next_offset": len(self.chunks),
+                "result": self.result,
+                "error": self.error,
+            }
+
+    def summary(self) -> Dict[str, Any]:
+        snapshot = self.to_dict(offset=len(self.chunks))
+        del snapshot["chunks"], snapshot["result"]
+        return snapshot
+
+    def record(self) -> Dict[str, Any]:
+        """Everything needed to restore the job from disk"""
+        return dict(self.to_dict(), params=self.params, tenant_id=self.tenant_id)
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        job = cls(record["job_id"], record["kind"], record.get("params", {}), record["tenant_id"])
+        job.status = record["status"]
+        job.progress = record.get("progress", job.progress)
+        job.chunks = record.get("chunks", [])
+        job.result = record.get("result")
+        job.error = record.get("error")
+        job.created_at = record.get("created_at", job.created_at)
+        job.started_at = record.get("started_at")
+        job.finished_at = record.get("finished_at")
+        job.expires_at = record.get("expires_at")
+        return job
+
+    # Updates from the worker thread; listeners are asyncio events on the streaming side
+
+    def update(self, expected_status: Optional[str] = None, **changes) -> bool:
+        """Apply changes, only if the job is still in expected_status when one is given"""
+        with self._lock:
+            if expected_status is not None and self.status != expected_status:
+                return False
+            for name, value in changes.items():
+                setattr(self, name, value)
+            listeners = list(self._listeners)
+        for loop, event in listeners:
+            loop.call_soon_threadsafe(event.set)
+        return True
+
+    def append_chunk(self, chunk: Any):
+        with self._lock:
+            self.chunks.append(chunk)
+        self.update()
+
+    def listen(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unlisten(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+
+class JobContext:
+    """What a job handler uses to report progress, emit partial results and stop when cancelled"""
+
+    def __init__(self, job: Job):
+        self.job = job
+
+    @property
+    def deadline(self) -> Deadline:
+        return self.job.deadline
+
+    def report(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        self.job.update(progress={"done": done, "total": total, "message": message or self.job.progress.get("message")})
+
+    def emit(self, chunk: Any):
+        """Publish a partial result; it is visible to pollers and streams immediately"""
+        self.job.append_chunk(chunk)
+
+    def check(self):
+        """Raise DeadlineExceeded if the job was cancelled or ran out of time"""
+        self.deadline.check()
+
+
+class JobStore:
+    """One JSON file per job in a local directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job: Job):
+        path = self._path(job.job_id)
+        # Write and rename so a crash never leaves a half-written file behind
+        with open(path + ".tmp", "w") as f:
+            json.dump(job.record(), f, default=str)
+        os.replace(path + ".tmp", path)
+
+    def delete(self, job_id: str):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def load(self) -> List[Job]:
+        jobs = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    jobs.append(Job.from_record(json.load(f)))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping unreadable job file {name}: {e}")
+        return jobs
+
+
+Handler = Callable[[JobContext, Dict[str, Any]], Any]
+
+
+class JobManager:
+    """Runs submitted jobs on a bounded worker pool and keeps their results until they expire"""
+
+    def __init__(
+        self,
+        handlers: Dict[str, Handler],
+        store: Optional[JobStore] = None,
+        max_workers: int = 2,
+        max_queued: int = 100,
+        timeout_seconds: float = 900,
+        ttl_seconds: float = 86400,
+        prepare: Optional[Callable[[Job], None]] = None,
+        kind_timeouts: Optional[Dict[str, float]] = None,
+    ):
+        self.handlers = handlers
+        self.store = store
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.timeout_seconds = timeout_seconds
+        # Time limits for kinds that need more (or less) than timeout_seconds
+        self.kind_timeouts = kind_timeouts or {}
+        self.ttl = ttl_seconds
+        # Sets up the worker thread's context (e.g. the job's portal) before the handler runs
+        self.prepare = prepare
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed: Dict[str, int] = {SUCCEEDED: 0, FAILED: 0, CANCELLED: 0}
+        self.total_run_seconds = 0.0
+        if store is not None:
+            self._restore()
+
+    def _restore(self):
+        """Load persisted jobs; jobs that were still pending when the server stopped have failed"""
+        now = time.time()
+        for job in self.store.load():
+            if job.expires_at is not None and job.expires_at < now:
+                self.store.delete(job.job_id)
+                continue
+            if not job.finished:
+                job.status, job.error = FAILED, "The server restarted before the job finished"
+                job.finished_at, job.expires_at = now, now + self.ttl
+                self.store.save(job)
+            self._jobs[job.job_id] = job
+
+    # Submission and lookup
+
+    def submit(self, kind: str, params: Dict[str, Any], tenant_id: str) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}. Must be one of: {', '.join(self.handlers)}")
+        self.purge_expired()
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if queued >= self.max_queued:
+                raise JobQueueFull(f"{queued} jobs are already queued")
+            job = Job(secrets.token_urlsafe(12), kind, params, tenant_id)
+            self._jobs[job.job_id] = job
+            self.submitted += 1
+        self._save(job)
+        # Each job runs in a fresh context, so no request-scoped state leaks into it
+        self._executor.submit(contextvars.Context().run, self._run, job)
+        return job
+
+    def get(self, job_id: str, tenant_id: str) -> Optional[Job]:
+        """A portal's job; other portals' jobs are invisible"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.tenant_id != tenant_id:
+            return None
+        if job.expires_at is not None and job.expires_at < time.time():
+            self._forget(job)
+            return None
+        return job
+
+    def list_jobs(self, tenant_id: str) -> List[Job]:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.tenant_id == tenant_id]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job: Job):
+        """Cancel a queued or running job; a finished job is deleted instead"""
+        if job.finished:
+            self._forget(job)
+        elif not self._finish(job, CANCELLED, error="Cancelled before it started", expected_status=QUEUED):
+            # Started in the meantime; it stops at its next check
+            job.deadline.cancel("job cancelled")
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.expires_at is not None and job.expires_at < now]
+        for job in expired:
+            self._forget(job)
+
+    def _forget(self, job: Job):
+        with self._lock:
+            self._jobs.pop(job.job_id, None)
+        if self.store is not None:
+            self.store.delete(job.job_id)
+
+    def _save(self, job: Job):
+        if self.store is not None:
+            try:
+                self.store.save(job)
+            except OSError as e:
+                print(f"Failed to persist job {job.job_id}: {e}")
+
+    # Execution
+
+    def _run(self, job: Job):
+        deadline = Deadline(self.kind_timeouts.get(job.kind, self.timeout_seconds))
+        if not job.update(expected_status=QUEUED, status=RUNNING, deadline=deadline, started_at=time.time(), progress=dict(job.progress, message="Running")):
+            # Cancelled while it was waiting for a worker
+            return
+        current_deadline.set(deadline)
+        self._save(job)
+        try:
+            if self.prepare is not None:
+                self.prepare(job)
+            result = self.handlers[job.kind](JobContext(job), job.params)
+        except DeadlineExceeded as e:
+            if job.deadline.cancelled:
+                self._finish(job, CANCELLED, error=str(e))
+            else:
+                self._finish(job, FAILED, error=f"The job exceeded its {deadline.timeout_seconds:.0f}s time limit")
+        except Exception as e:
+            print(f"Job {job.job_id} ({job.kind}) failed: {e}")
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, SUCCEEDED, result=result)
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None, expected_status: Optional[str] = None) -> bool:
+        now = time.time()
+        if not job.update(expected_status, status=status, result=result, error=error, finished_at=now, expires_at=now + self.ttl):
+            return False
+        with self._lock:
+            self.completed[status] += 1
+            if job.started_at is not None:
+                self.total_run_seconds += now - job.started_at
+        self._save(job)
+        return True
+
+    # Streaming
+
+    async def events(self, job: Job, offset: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """Progress, each partial result from offset on, and finally the outcome, as they happen"""
+        loop = asyncio.get_running_loop()
+        last_progress = None
+        while True:
+            changed = asyncio.Event()
+            listener = (loop, changed)
+            # Listen before reading so no update between the read and the wait is missed
+            job.listen(listener)
+            try:
+                snapshot = job.to_dict(offset)
+                if (snapshot["status"], snapshot["progress"]) != last_progress:
+                    last_progress = (snapshot["status"], snapshot["progress"])
+                    yield {"event": "progress", "status": snapshot["status"], "progress": snapshot["progress"]}
+                for index, chunk in enumerate(snapshot["chunks"], start=offset):
+                    yield {"event": "chunk", "offset": index, "data": chunk}
+                offset = snapshot["next_offset"]
+                if snapshot["status"] in FINISHED:
+                    yield {"event": "done", "status": snapshot["status"], "result": snapshot["result"], "error": snapshot["error"]}
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield {"event": "keepalive"}
+            finally:
+                job.unlisten(listener)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            finished = sum(self.completed.values())
+            return {
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "submitted": self.submitted,
+                "by_status": by_status,
+                "completed": dict(self.completed),
+                "avg_run_seconds": round(self.total_run_seconds / finished, 2) if finished else None,
+            }
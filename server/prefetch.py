@@ -0,0 +1,284 @@
+# Cross-turn predictive prefetch for chat conversations
+# After an agent turn, the records it returned predict the next question: companies are
+# followed by "contacts/deals at <company>", contacts by "deals for <contact>". The
+# associated records of the top returned entities are fetched in the background, within a
+# per-turn call budget, and kept in the conversation's tool result cache so a follow-up
+# tool call that names one of those entities is answered without a HubSpot round trip.
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import re
+import threading
+import time
+
+from association_graph import AssociationGraph
+from tool_cache import ToolResultCache
+
+Fetch = Callable[..., Dict[str, Any]]
+
+# Follow-up record types predicted for each returned record type
+FOLLOW_UPS = {
+    "companies": ["contacts", "deals"],
+    "contacts": ["deals"],
+}
+
+# Tool name under which prefetched results are kept in the tool result cache
+PREFETCH_TOOL = "prefetch"
+
+# HubSpot batch read accepts at most this many ids per call
+BATCH_READ_LIMIT = 100
+
+# A tool query is answered from the prefetch only if, besides the entity's name, it has
+# a relation word and otherwise only filler, e.g. "contacts at Acme" or "deals for Jane
+# Doe". Anything else ("closed won deals at Acme over $50k", or a plain "Acme" text
+# search) goes through the normal search.
+RELATION_WORDS = {"at", "for", "of", "with", "from", "associated", "related", "linked", "belonging"}
+FILLER_WORDS = {
+    "the", "all", "any", "every", "its", "their", "to", "show", "list", "get", "find", "me", "us",
+    "contact", "contacts", "people", "person", "deal", "deals", "company", "companies", "records",
+}
+QUERY_WORD_PATTERN = re.compile(r"[^\s.,;:!?\"'()]+")
+
+
+class FollowUpPrefetcher:
+    """Warms the likely follow-up data of each conversation after every agent turn"""
+
+    def __init__(
+        self,
+        cache: ToolResultCache,
+        properties: Dict[str, List[str]],
+        top_n: int = 3,
+        max_calls_per_turn: int = 4,
+        ttl_seconds: float = 180,
+        max_workers: int = 2,
+        max_conversations: int = 1000,
+        enabled: bool = True,
+    ):
+        self.cache = cache
+        self.properties = properties
+        self.top_n = top_n
+        self.max_calls_per_turn = max_calls_per_turn
+        self.ttl = ttl_seconds
+        self.max_conversations = max_conversations
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="follow-up-prefetch")
+        self._lock = threading.Lock()
+        # conversation -> target type -> warmed entries ({name, args, warmed_at, used}), most recent last
+        self._warmed: "OrderedDict[str, Dict[str, List[Dict[str, Any]]]]" = OrderedDict()
+        self._running: Set[str] = set()
+        self.turns = 0
+        self.skipped_busy = 0
+        self.hubspot_calls = 0
+        self.warmed_entries = 0
+        self.used_entries = 0
+        self.lookups = 0
+        self.hits = 0
+        self.fetch_seconds = 0.0
+
+    # Prediction and warming
+
+    def after_turn(
+        self,
+        conversation_id: str,
+        returned: List[Tuple[str, Dict[str, Any]]],
+        fetch: Fetch,
+        graph: Optional[AssociationGraph],
+        formatters: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]],
+    ):
+        """Schedule warming for the entities returned in a turn, unless one is already running"""
+        if not self.enabled:
+            return
+        sources = self.predict(returned)
+        if not sources:
+            return
+        with self._lock:
+            if conversation_id in self._running:
+                self.skipped_busy += 1
+                return
+            self._running.add(conversation_id)
+            self.turns += 1
+
+        def run():
+            try:
+                self.warm(conversation_id, sources, fetch, graph, formatters)
+            except Exception as e:
+                print(f"Error prefetching follow-ups for conversation {conversation_id}: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(conversation_id)
+
+        self._executor.submit(run)
+
+    def predict(self, returned: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, List[Tuple[str, str]]]:
+        """The top returned entities per type that have follow-ups, as (id, name)"""
+        sources: Dict[str, List[Tuple[str, str]]] = {}
+        for object_type, record in returned:
+            if object_type not in FOLLOW_UPS or not record.get("id") or not record.get("name"):
+                continue
+            entities = sources.setdefault(object_type, [])
+            if len(entities) < self.top_n and all(entity_id != str(record["id"]) for entity_id, _ in entities):
+                entities.append((str(record["id"]), str(record["name"])))
+        return sources
+
+    def warm(
+        self,
+        conversation_id: str,
+        sources: Dict[str, List[Tuple[str, str]]],
+        fetch: Fetch,
+        graph: Optional[AssociationGraph],
+        formatters: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]],
+    ):
+        budget = [self.max_calls_per_turn]
+        started = time.monotonic()
+        for source_type, entities in sources.items():
+            for target_type in FOLLOW_UPS[source_type]:
+                if target_type not in formatters:
+                    continue
+                # Skip entities that are still warm from an earlier turn
+                pending = [
+                    (entity_id, name) for entity_id, name in entities
+                    if not self._is_warm(conversation_id, target_type, self._args(source_type, entity_id, target_type))
+                ]
+                if not pending:
+                    continue
+                associated = self._associated_ids(source_type, [entity_id for entity_id, _ in pending], target_type, fetch, graph, budget)
+                if associated is None:
+                    return
+                records = self._read_records(target_type, sorted({i for ids in associated.values() for i in ids}), fetch, budget)
+                if records is None:
+                    return
+                for entity_id, name in pending:
+                    ids = associated.get(entity_id, [])
+                    formatted = [formatters[target_type](records[i]) for i in ids if i in records]
+                    args = self._args(source_type, entity_id, target_type)
+                    self.cache.put(conversation_id, PREFETCH_TOOL, args, (formatted, len(ids)), ttl=self.ttl)
+                    self._remember(conversation_id, target_type, name, args)
+        with self._lock:
+            self.fetch_seconds += time.monotonic() - started
+
+    def _spend(self, budget: List[int]) -> bool:
+        if budget[0] <= 0:
+            return False
+        budget[0] -= 1
+        with self._lock:
+            self.hubspot_calls += 1
+        return True
+
+    def _associated_ids(
+        self,
+        source_type: str,
+        source_ids: List[str],
+        target_type: str,
+        fetch: Fetch,
+        graph: Optional[AssociationGraph],
+        budget: List[int],
+    ) -> Optional[Dict[str, List[str]]]:
+        """Associated target ids per source id, from the loaded graph or one v4 batch read"""
+        if graph is not None and graph.loaded_at is not None:
+            return graph.associated_ids(source_type, source_ids, target_type)
+
+        if not self._spend(budget):
+            return None
+        response = fetch(
+            f"/crm/v4/associations/{source_type}/{target_type}/batch/read",
+            method="POST",
+            data={"inputs": [{"id": source_id} for source_id in source_ids]},
+        )
+        if "error" in response:
+            return None
+        associated = {source_id: [] for source_id in source_ids}
+        for result in response.get("results", []):
+            source_id = str(result.get("from", {}).get("id"))
+            associated.setdefault(source_id, []).extend(str(to.get("toObjectId")) for to in result.get("to", []))
+        return associated
+
+    def _read_records(self, object_type: str, ids: List[str], fetch: Fetch, budget: List[int]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Full records by id through the batch read endpoint"""
+        records: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(ids), BATCH_READ_LIMIT):
+            if not self._spend(budget):
+                return records if records else None
+            response = fetch(
+                f"/crm/v3/objects/{object_type}/batch/read",
+                method="POST",
+                data={"properties": self.properties[object_type], "inputs": [{"id": i} for i in ids[start:start + BATCH_READ_LIMIT]]},
+            )
+            if "error" in response:
+                return None
+            for record in response.get("results", []):
+                records[str(record.get("id"))] = record
+        return records
+
+    @staticmethod
+    def _args(source_type: str, source_id: str, target_type: str) -> Dict[str, Any]:
+        return {"source": f"{source_type}:{source_id}", "target": target_type}
+
+    def _is_warm(self, conversation_id: str, target_type: str, args: Dict[str, Any]) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            entries = self._warmed.get(conversation_id, {}).get(target_type, ())
+            return any(entry["args"] == args and now - entry["warmed_at"] < self.ttl for entry in entries)
+
+    def _remember(self, conversation_id: str, target_type: str, name: str, args: Dict[str, Any]):
+        with self._lock:
+            targets = self._warmed.setdefault(conversation_id, {})
+            self._warmed.move_to_end(conversation_id)
+            entries = targets.setdefault(target_type, [])
+            entries[:] = [entry for entry in entries if entry["args"] != args]
+            entries.append({"name": name.lower(), "args": args, "warmed_at": time.monotonic(), "used": False})
+            self.warmed_entries += 1
+            while len(self._warmed) > self.max_conversations:
+                self._warmed.popitem(last=False)
+
+    # Lookup from the tools
+
+    def lookup(self, conversation_id: Optional[str], object_type: str, query: Optional[str]) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+        """Prefetched (records, total) for a tool query asking only for the records associated with a warmed entity"""
+        if not conversation_id or not query:
+            return None
+        with self._lock:
+            entries = list(self._warmed.get(conversation_id, {}).get(object_type, ()))
+        if not entries:
+            return None
+
+        lowered = query.lower()
+        with self._lock:
+            self.lookups += 1
+        for entry in reversed(entries):
+            name_pattern = rf'(?<!\w){re.escape(entry["name"])}(?!\w)'
+            if not re.search(name_pattern, lowered) or not self._only_references(re.sub(name_pattern, " ", lowered)):
+                continue
+            value = self.cache.get(conversation_id, PREFETCH_TOOL, entry["args"])
+            if value is None:
+                continue
+            with self._lock:
+                self.hits += 1
+                if not entry["used"]:
+                    entry["used"] = True
+                    self.used_entries += 1
+            return value
+        return None
+
+    @staticmethod
+    def _only_references(remainder: str) -> bool:
+        """Whether the rest of a query, without the entity name, adds no criteria of its own"""
+        words = QUERY_WORD_PATTERN.findall(remainder)
+        return any(word in RELATION_WORDS for word in words) and all(word in RELATION_WORDS or word in FILLER_WORDS for word in words)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "turns_prefetched": self.turns,
+                "skipped_busy": self.skipped_busy,
+                "hubspot_calls": self.hubspot_calls,
+                "warmed_entries": self.warmed_entries,
+                "used_entries": self.used_entries,
+                # Share of prefetched entities a follow-up actually asked about
+                "hit_rate": round(self.used_entries / self.warmed_entries, 3) if self.warmed_entries else None,
+                "lookups": self.lookups,
+                "lookup_hits": self.hits,
+                "lookup_hit_rate": round(self.hits / self.lookups, 3) if self.lookups else None,
+                "avg_warm_ms": round(self.fetch_seconds * 1000 / self.turns, 1) if self.turns else None,
+            }
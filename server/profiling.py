@@ -0,0 +1,255 @@
+# On-demand profiling for admins
+# A sampling profiler captures where the running worker spends its time for a few seconds
+# and returns collapsed stacks (flamegraph.pl / speedscope input). Per-request profiling,
+# opted into with the X-Profile header, runs the request's blocking stages (intent
+# analysis, HubSpot calls, the agent and its tools) under cProfile and attaches a
+# top-functions report to the response. Nothing is installed until it is asked for.
+
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import cProfile
+import json
+import os
+import pstats
+import secrets
+import sys
+import threading
+import time
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# Admin authentication
+
+def admin_dependency(admin_api_key: Optional[str]):
+    """FastAPI dependency allowing only requests with the admin key in X-Admin-Key"""
+
+    async def require_admin(request: Request):
+        if not is_admin(request, admin_api_key):
+            # Don't reveal the endpoints when admin access is not configured
+            raise HTTPException(status_code=404 if not admin_api_key else 403, detail="Not found" if not admin_api_key else "Forbidden")
+
+    return require_admin
+
+
+def is_admin(request: Request, admin_api_key: Optional[str]) -> bool:
+    provided = request.headers.get("x-admin-key")
+    return bool(admin_api_key and provided and secrets.compare_digest(provided, admin_api_key))
+
+
+# Sampling profiler
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread in this worker at a fixed interval"""
+
+    def __init__(self, max_seconds: float = 60):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def capture(self, seconds: float, interval: float = 0.005) -> Dict[str, Any]:
+        """Sample for the given time; returns stack counts keyed by collapsed stack"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already being captured")
+        try:
+            seconds = min(seconds, self.max_seconds)
+            me = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = Counter()
+            samples = 0
+            started = time.monotonic()
+            while time.monotonic() - started < seconds:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(thread_id) or f"thread-{thread_id}")
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+                time.sleep(interval)
+            return {
+                "seconds": round(time.monotonic() - started, 2),
+                "interval_ms": interval * 1000,
+                "samples": samples,
+                "stacks": stacks,
+            }
+        finally:
+            self._lock.release()
+
+
+def collapsed_stacks(profile: Dict[str, Any], include_idle: bool = False) -> str:
+    """Collapsed-stack text, one "frame;frame;frame count" line per distinct stack"""
+    lines = []
+    for stack, count in profile["stacks"].most_common():
+        if not include_idle and _is_idle(stack):
+            continue
+        lines.append(f"{stack} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def top_frames(profile: Dict[str, Any], limit: int = 30, include_idle: bool = False) -> List[Dict[str, Any]]:
+    """Leaf frames with the most samples, i.e. where the time is actually spent"""
+    self_counts = Counter()
+    total = 0
+    for stack, count in profile["stacks"].items():
+        if not include_idle and _is_idle(stack):
+            continue
+        self_counts[stack.rsplit(";", 1)[-1]] += count
+        total += count
+    return [
+        {"frame": frame, "samples": count, "percent": round(100 * count / total, 1)}
+        for frame, count in self_counts.most_common(limit)
+    ]
+
+
+# Leaf frames of threads that are blocked rather than using CPU
+_IDLE_LEAVES = ("wait (threading.py", "select (selectors.py", "_worker (thread.py", "get (queue.py", "sleep (", "run_forever (", "_run_once (")
+
+
+def _is_idle(stack: str) -> bool:
+    leaf = stack.rsplit(";", 1)[-1]
+    return leaf.startswith(_IDLE_LEAVES)
+
+
+# Per-request deterministic profiling
+
+class RequestProfile:
+    """cProfile results collected from one request's blocking stages"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages: List[Dict[str, Any]] = []
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def wrap(self, fn: Callable) -> Callable:
+        """Run fn under its own cProfile.Profile (profilers are per thread) and keep the stats"""
+
+        def profiled(*args, **kwargs):
+            profiler = cProfile.Profile()
+            started = time.monotonic()
+            profiler.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._add(getattr(fn, "__qualname__", repr(fn)), profiler, time.monotonic() - started)
+
+        return profiled
+
+    def _add(self, name: str, profiler: cProfile.Profile, seconds: float):
+        with self._lock:
+            self.stages.append({"stage": name, "ms": round(seconds * 1000, 1)})
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def report(self, limit: int = 25) -> Dict[str, Any]:
+        """Top functions by own time and by cumulative time across all profiled stages"""
+        with self._lock:
+            report = {"wall_ms": round((time.monotonic() - self.started) * 1000, 1), "stages": list(self.stages)}
+            if self._stats is None:
+                return dict(report, top_self=[], top_cumulative=[])
+            entries = []
+            for (filename, lineno, name), (_, calls, own, cumulative, _) in self._stats.stats.items():
+                entries.append({
+                    "function": f"{name} ({os.path.basename(filename)}:{lineno})",
+                    "calls": calls,
+                    "self_ms": round(own * 1000, 2),
+                    "cumulative_ms": round(cumulative * 1000, 2),
+                })
+            report["top_self"] = sorted(entries, key=lambda entry: -entry["self_ms"])[:limit]
+            report["top_cumulative"] = sorted(entries, key=lambda entry: -entry["cumulative_ms"])[:limit]
+            return report
+
+
+# Profile of the request being handled, None unless the request opted in
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+def profiled_runner(runner: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """Wrap a thread-pool runner so stages of profiled requests run under cProfile"""
+
+    async def run(fn: Callable, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is not None:
+            fn = profile.wrap(fn)
+        return await runner(fn, *args, **kwargs)
+
+    return run
+
+
+class RequestProfilingMiddleware:
+    """Profiles admin requests sent with X-Profile: 1 and adds the report to the JSON response.
+
+    A plain ASGI middleware: requests without the header go straight to the app, so
+    they pay for nothing more than a scan of their header names.
+    """
+
+    def __init__(self, app: ASGIApp, admin_api_key: Optional[str]):
+        self.app = app
+        self.admin_api_key = admin_api_key
+        self.profiled_requests = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or not any(name == b"x-profile" for name, _ in scope["headers"])
+            or not is_admin(Request(scope), self.admin_api_key)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+
+        async def capture(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            else:
+                await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            current_profile.reset(token)
+        self.profiled_requests += 1
+
+        body = b"".join(chunks)
+        report = profile.report()
+        headers = MutableHeaders(raw=list(start["headers"]))
+        try:
+            content = json.loads(body) if "content-encoding" not in headers else None
+        except ValueError:
+            content = None
+        if isinstance(content, dict):
+            content["profile"] = report
+            body = json.dumps(content).encode("utf-8")
+            if "etag" in headers:
+                # The report makes this body unlike any other response with the same tag
+                del headers["etag"]
+        headers["content-length"] = str(len(body))
+        headers["x-profile-wall-ms"] = str(report["wall_ms"])
+
+        await send({"type": "http.response.start", "status": start["status"], "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
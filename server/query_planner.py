@@ -0,0 +1,447 @@
+# Query planner for HubSpot CRM requests
+# Compiles (intent, object_type, filters, limit) into a concrete request plan so that
+# every endpoint and agent tool builds its HubSpot calls the same way.
+
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import re
+import threading
+
+SUPPORTED_OBJECT_TYPES = ["contacts", "companies", "deals"]
+
+# Hard cap on records per request, matching the limits used by the endpoints
+MAX_LIMIT = 100
+
+# HubSpot allows at most 5 filterGroups per search request
+MAX_FILTER_GROUPS = 5
+
+# Default properties to request for each object type
+DEFAULT_PROPERTIES = {
+    "contacts": ["firstname", "lastname", "email", "phone", "company"],
+    "companies": ["name", "domain", "industry", "website", "phone"],
+    "deals": ["dealname", "amount", "dealstage", "closedate", "pipeline"],
+}
+
+# HubSpot property types used to pick the search operator.
+# Free-text properties are matched with CONTAINS_TOKEN, everything else with EQ.
+PROPERTY_TYPES = {
+    "contacts": {
+        "firstname": "string",
+        "lastname": "string",
+        "email": "email",
+        "phone": "string",
+        "company": "string",
+    },
+    "companies": {
+        "name": "string",
+        "domain": "domain",
+        "industry": "enumeration",
+        "website": "string",
+        "phone": "string",
+    },
+    "deals": {
+        "dealname": "string",
+        "amount": "number",
+        "dealstage": "enumeration",
+        "pipeline": "enumeration",
+        "closedate": "datetime",
+    },
+}
+
+# Maps the filter keys produced by intent analysis onto HubSpot properties.
+# "__name__" is expanded into OR filterGroups over first/last/full name.
+FILTER_PROPERTIES = {
+    "contacts": {
+        "contact_name": "__name__",
+        "name": "__name__",
+        "email": "email",
+        "company": "company",
+        "company_name": "company",
+        "phone": "phone",
+    },
+    "companies": {
+        "company_name": "name",
+        "name": "name",
+        "industry": "industry",
+        "domain": "domain",
+    },
+    "deals": {
+        "deal_name": "dealname",
+        "name": "dealname",
+        "stage": "dealstage",
+        "dealstage": "dealstage",
+        "pipeline": "pipeline",
+        "min_amount": "amount",
+        "max_amount": "amount",
+    },
+}
+
+# Filter keys that compare with a range operator instead of equality
+RANGE_OPERATORS = {
+    "min_amount": "GTE",
+    "max_amount": "LTE",
+}
+
+# Keys the LLM uses for a free-text search term
+TEXT_KEYS = ["search_term", "keyword", "query"]
+
+# Keys of a "related" intent, answered by joins over the association graph
+RELATION_KEYS = ["related_to", "related_name", "via", "min_amount", "open_only"]
+
+# Natural-language deal stage names mapped to HubSpot's default internal stage ids
+DEAL_STAGE_MAP = {
+    "closed won": "closedwon",
+    "closed lost": "closedlost",
+    "negotiation": "negotiation",
+    "proposal": "proposal",
+}
+
+# Internal id formats of enumeration properties; other values are treated as free text
+ENUM_ID_PATTERNS = {
+    "industry": re.compile(r'^[A-Z0-9_]+$'),
+}
+DEFAULT_ENUM_ID_PATTERN = re.compile(r'^[a-z0-9_]+$')
+DOMAIN_PATTERN = re.compile(r'^[\w-]+(\.[\w-]+)+$')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[\w-]+(\.[\w-]+)+$')
+
+
+@dataclass
+class QueryPlan:
+    """A fully bound HubSpot request ready to be executed"""
+    intent: str
+    object_type: str
+    kind: str  # one of: list, search, batch_read, graph
+    endpoint: str
+    method: str
+    params: Optional[Dict[str, Any]] = None
+    body: Optional[Dict[str, Any]] = None
+    limit: int = 25
+    filters: Dict[str, Any] = field(default_factory=dict)
+    # True when the intent asked for filtering but no usable criteria were found
+    unfiltered: bool = False
+
+    def key(self) -> Tuple:
+        """Identity of the HubSpot request this plan will make, used to compare plans"""
+        return (self.method, self.endpoint, _freeze(self.params), _freeze(self.body))
+
+
+@dataclass
+class _CompiledPlan:
+    """The value-independent part of a plan, cached by query shape"""
+    kind: str
+    endpoint: str
+    method: str
+    # Each group is a list of (property, operator, filter_key) slots
+    groups: List[List[Tuple[str, str, str]]]
+    properties: Optional[List[str]]
+    uses_text: bool
+
+
+def _freeze(value: Any) -> Any:
+    """Convert nested dicts/lists into hashable tuples"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def choose_operator(object_type: str, prop: str, value: Any) -> str:
+    """Pick EQ or CONTAINS_TOKEN for a property based on its HubSpot type"""
+    prop_type = PROPERTY_TYPES.get(object_type, {}).get(prop, "string")
+    text = str(value)
+    if prop_type in ("number", "datetime", "bool"):
+        return "EQ"
+    if prop_type == "enumeration":
+        # Enumeration values are internal ids; free text only matches by token
+        pattern = ENUM_ID_PATTERNS.get(prop, DEFAULT_ENUM_ID_PATTERN)
+        return "EQ" if pattern.match(text) else "CONTAINS_TOKEN"
+    if prop_type == "email":
+        return "EQ" if EMAIL_PATTERN.match(text) else "CONTAINS_TOKEN"
+    if prop_type == "domain":
+        return "EQ" if DOMAIN_PATTERN.match(text) else "CONTAINS_TOKEN"
+    return "CONTAINS_TOKEN"
+
+
+def filters_from_text(object_type: str, text: str) -> Dict[str, Any]:
+    """Derive structured filters from a free-text tool query (emails, domains, deal stages)"""
+    filters = {}
+    lowered = text.lower()
+    if object_type == "contacts" and "@" in text:
+        filters["email"] = text.strip()
+    elif object_type == "companies" and any(tld in lowered for tld in (".com", ".org", ".net")):
+        filters["domain"] = text.strip()
+    elif object_type == "deals":
+        for key, value in DEAL_STAGE_MAP.items():
+            if key in lowered:
+                filters["stage"] = value
+                break
+    return filters
+
+
+class QueryPlanner:
+    """Compiles query intents into HubSpot request plans, caching plans by shape"""
+
+    def __init__(self, max_cache_size: int = 256):
+        self.max_cache_size = max_cache_size
+        self._cache: "OrderedDict[Tuple, _CompiledPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def plan(
+        self,
+        intent: str,
+        object_type: str,
+        filters: Optional[Dict[str, Any]] = None,
+        limit: int = 25,
+        properties: Optional[List[str]] = None,
+        text: Optional[str] = None,
+        ids: Optional[List[str]] = None,
+    ) -> QueryPlan:
+        """Build a request plan for the given intent and criteria"""
+        object_type = object_type.lower()
+        if object_type not in SUPPORTED_OBJECT_TYPES:
+            raise ValueError(f"Invalid object_type: {object_type}. Must be one of: {', '.join(SUPPORTED_OBJECT_TYPES)}")
+
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        usable = self._usable_filters(object_type, filters or {})
+        slots = self._slots(object_type, usable)
+
+        if ids:
+            kind = "batch_read"
+        elif slots or text or intent == "count":
+            kind = "search"
+        else:
+            kind = "list"
+
+        shape = (
+            kind,
+            object_type,
+            tuple(slots),
+            tuple(properties) if properties is not None else None,
+            bool(text),
+        )
+
+        with self._lock:
+            compiled = self._cache.get(shape)
+            if compiled is not None:
+                self._cache.move_to_end(shape)
+                self.hits += 1
+        if compiled is None:
+            compiled = self._compile(kind, object_type, slots, properties, bool(text))
+            with self._lock:
+                self.misses += 1
+                self._cache[shape] = compiled
+                if len(self._cache) > self.max_cache_size:
+                    self._cache.popitem(last=False)
+
+        plan = self._bind(compiled, intent, object_type, usable, limit, text, ids)
+        plan.unfiltered = intent in ("lookup", "filter", "search") and kind == "list"
+        return plan
+
+    def plan_from_intent(
+        self,
+        intent: str,
+        intent_data: Dict[str, Any],
+        default_object_type: str = "contacts",
+        default_limit: int = 25,
+        properties: Optional[List[str]] = None,
+    ) -> QueryPlan:
+        """Build a plan from the (intent, intent_data) pair produced by intent analysis"""
+        object_type = str(intent_data.get("object_type") or default_object_type).lower()
+        limit = intent_data.get("limit", default_limit)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = default_limit
+
+        if intent == "related" and intent_data.get("related_to"):
+            return self.plan_related(object_type, intent_data, limit)
+
+        text = None
+        for key in TEXT_KEYS:
+            if isinstance(intent_data.get(key), str) and intent_data[key].strip():
+                text = intent_data[key].strip()
+                break
+
+        return self.plan(intent, object_type, intent_data, limit, properties, text)
+
+    def plan_related(self, object_type: str, relation: Dict[str, Any], limit: int = 25) -> QueryPlan:
+        """Plan a relationship query answered from the association graph instead of the API"""
+        source_type = str(relation.get("related_to", "")).lower()
+        via = relation.get("via")
+        for candidate in (object_type, source_type) + ((str(via).lower(),) if via else ()):
+            if candidate not in SUPPORTED_OBJECT_TYPES:
+                raise ValueError(f"Invalid object_type: {candidate}. Must be one of: {', '.join(SUPPORTED_OBJECT_TYPES)}")
+        if source_type == object_type:
+            raise ValueError(f"Cannot relate {object_type} to themselves")
+
+        min_amount = relation.get("min_amount")
+        try:
+            min_amount = float(min_amount) if min_amount is not None else None
+        except (TypeError, ValueError):
+            min_amount = None
+
+        body = {
+            "target_type": object_type,
+            "source_type": source_type,
+            "source_name": relation.get("related_name") or None,
+            "via": str(via).lower() if via else None,
+            "min_amount": min_amount,
+            "open_only": bool(relation.get("open_only", False)),
+            "limit": max(1, min(int(limit), MAX_LIMIT)),
+        }
+        return QueryPlan(
+            intent="related",
+            object_type=object_type,
+            kind="graph",
+            endpoint="association_graph",
+            method="JOIN",
+            body=body,
+            limit=body["limit"],
+            filters={key: relation[key] for key in RELATION_KEYS if relation.get(key) is not None},
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Plan cache statistics"""
+        with self._lock:
+            return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def _usable_filters(self, object_type: str, filters: Dict[str, Any]) -> Dict[str, Any]:
+        """Keep only filters that map to a property of this object type"""
+        mapping = FILTER_PROPERTIES[object_type]
+        usable = {}
+        seen = set()
+        for key, value in filters.items():
+            if key not in mapping or value is None or isinstance(value, (dict, list)):
+                continue
+            if isinstance(value, str):
+                value = value.strip()
+                if not value:
+                    continue
+            prop = mapping[key]
+            # Aliases such as "name" and "company_name" map to the same property; keep the first
+            if prop in seen and key not in RANGE_OPERATORS:
+                continue
+            if prop == "dealstage":
+                value = DEAL_STAGE_MAP.get(str(value).lower(), value)
+            seen.add(prop)
+            usable[key] = value
+        return usable
+
+    def _slots(self, object_type: str, filters: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+        """Resolve each filter to a (property, operator, filter_key) slot"""
+        mapping = FILTER_PROPERTIES[object_type]
+        slots = []
+        for key in sorted(filters):
+            prop = mapping[key]
+            value = filters[key]
+            if prop == "__name__":
+                # Full names expand differently from single tokens, so they are a different shape
+                operator = "FULL" if len(str(value).split()) > 1 else "TOKEN"
+            elif key in RANGE_OPERATORS:
+                operator = RANGE_OPERATORS[key]
+            else:
+                operator = choose_operator(object_type, prop, value)
+            slots.append((prop, operator, key))
+        return slots
+
+    def _compile(
+        self,
+        kind: str,
+        object_type: str,
+        slots: List[Tuple[str, str, str]],
+        properties: Optional[List[str]],
+        uses_text: bool,
+    ) -> _CompiledPlan:
+        """Build the value-independent request template for a query shape"""
+        base = f"/crm/v3/objects/{object_type}"
+        if kind == "batch_read":
+            endpoint, method = f"{base}/batch/read", "POST"
+        elif kind == "search":
+            endpoint, method = f"{base}/search", "POST"
+        else:
+            endpoint, method = base, "GET"
+
+        # Shared AND filters go into every group; name filters fan out into OR groups
+        shared = [slot for slot in slots if slot[0] != "__name__"]
+        groups = [shared] if shared else []
+        for prop, operator, key in slots:
+            if prop != "__name__":
+                continue
+            if operator == "FULL":
+                variants = [
+                    [("firstname", "CONTAINS_TOKEN", f"{key}:first"), ("lastname", "CONTAINS_TOKEN", f"{key}:last")],
+                    [("firstname", "CONTAINS_TOKEN", key)],
+                    [("lastname", "CONTAINS_TOKEN", key)],
+                ]
+            else:
+                variants = [
+                    [("firstname", "CONTAINS_TOKEN", key)],
+                    [("lastname", "CONTAINS_TOKEN", key)],
+                ]
+            groups = [shared + variant for variant in variants][:MAX_FILTER_GROUPS]
+
+        if properties is None and not (kind == "list" and object_type == "contacts"):
+            # The contacts list endpoint is called without properties to match the working curl format
+            properties = DEFAULT_PROPERTIES[object_type]
+
+        return _CompiledPlan(kind, endpoint, method, groups, properties, uses_text)
+
+    def _bind(
+        self,
+        compiled: _CompiledPlan,
+        intent: str,
+        object_type: str,
+        filters: Dict[str, Any],
+        limit: int,
+        text: Optional[str],
+        ids: Optional[List[str]],
+    ) -> QueryPlan:
+        """Fill a compiled template with concrete values"""
+        values = dict(filters)
+        for key, value in filters.items():
+            parts = str(value).split()
+            if len(parts) > 1:
+                values[f"{key}:first"] = parts[0]
+                values[f"{key}:last"] = " ".join(parts[1:])
+
+        plan = QueryPlan(
+            intent=intent,
+            object_type=object_type,
+            kind=compiled.kind,
+            endpoint=compiled.endpoint,
+            method=compiled.method,
+            limit=limit,
+            filters=filters,
+        )
+
+        if compiled.kind == "list":
+            plan.params = {"limit": limit, "archived": "false"}
+            if compiled.properties:
+                plan.params["properties"] = ",".join(compiled.properties)
+        elif compiled.kind == "batch_read":
+            plan.body = {"inputs": [{"id": str(record_id)} for record_id in ids][:MAX_LIMIT]}
+            if compiled.properties:
+                plan.body["properties"] = list(compiled.properties)
+        else:
+            plan.body = {"limit": limit}
+            if compiled.uses_text:
+                plan.body["query"] = text
+            if compiled.groups:
+                plan.body["filterGroups"] = [
+                    {"filters": [
+                        {"propertyName": prop, "operator": operator, "value": values[key]}
+                        for prop, operator, key in group
+                    ]}
+                    for group in compiled.groups
+                ]
+            if compiled.properties:
+                plan.body["properties"] = list(compiled.properties)
+        return plan
+
+
+# Shared planner used by the endpoints and agent tools
+planner = QueryPlanner()
@@ -1,14 +1,38 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import Dict, Any, List, Optional, Tuple, Union
 import os
 from dotenv import load_dotenv
 import json
-import requests
-from requests.exceptions import RequestException
 import re
+import secrets
+import shutil
 import sys
+import time
+from functools import partial
+from dataclasses import replace
+from abc import abstractmethod
+
+from query_planner import planner, QueryPlan, filters_from_text, DEFAULT_PROPERTIES, MAX_LIMIT
+from speculation import SpeculativePrefetcher
+from prefetch import FollowUpPrefetcher
+from intent_batcher import IntentBatcher, extract_json
+from association_graph import AssociationGraph, GraphLoading
+from summaries import SummaryStore, SummaryScheduler, configure_summaries
+from admission import AdmissionController, ClientQuota, parse_limits
+from circuit_breaker import BreakerRegistry, CircuitOpen, LastKnownGood, hubspot_family
+from deadlines import Deadline, DeadlineExceeded, get_deadline, request_deadline_dependency, parse_timeouts
+from fast_json import FastJSONResponse, RawPayload, CompressionMiddleware, encode_envelope
+from conditional import ConditionalResponses, changes_since, compute_etag, entity_tag, etag_matches
+from profiling import SamplingProfiler, RequestProfilingMiddleware, admin_dependency, is_admin, profiled_runner, collapsed_stacks, top_frames
+from connectors import Call, CallRejected, ConnectorError, ConnectorRegistry, HubSpotConnector, ResponseCache, SearchFilter, UnknownConnector, HUBSPOT_API_BASE
+from jobs import CANCELLED, QUEUED, JobContext, JobManager, JobQueueFull, JobStore
+from bulk_upsert import BulkUpserter, ID_PROPERTIES, iter_rows
+from tenants import FairScheduler, PerTenant, Tenant, current_tenant, load_tenants, tenant_dependency
+from tool_cache import ToolResultCache, format_observation, verbose_observation, estimate_tokens
 
 # Try to import LangChain modules with error handling
 try:
@@ -20,6 +44,7 @@ try:
     from langchain.tools import BaseTool
     from langchain_core.tools import Tool
     from langchain.memory import ConversationBufferMemory
+    from langchain_core.callbacks import BaseCallbackHandler
     LANGCHAIN_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: LangChain import error: {e}")
@@ -30,15 +55,80 @@ load_dotenv()
 
 app = FastAPI(title="HubSpot Agent API Server")
 
-# Configure CORS
+# Admission control: per-endpoint concurrency caps with bounded wait queues and per-client quotas
+CLIENT_QUOTA_PER_MINUTE = float(os.getenv("CLIENT_QUOTA_PER_MINUTE", "120"))
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+admission_controller = AdmissionController(
+    parse_limits(os.getenv("ADMISSION_LIMITS", "/query:16:64:5,/query/more:16:64:5,/search:16:64:5,/chat:4:16:10")),
+    ClientQuota(CLIENT_QUOTA_PER_MINUTE, int(os.getenv("CLIENT_QUOTA_BURST", "30"))) if CLIENT_QUOTA_PER_MINUTE > 0 else None,
+    # Quotas follow authenticated callers; everyone else is counted by address
+    identify=lambda request: authenticated_client(request),
+    # Proxies whose X-Forwarded-For is trusted to name the client
+    trusted_proxies=[proxy.strip() for proxy in os.getenv("TRUSTED_PROXIES", "").split(",") if proxy.strip()],
+)
+app.middleware("http")(admission_controller)
+
+# Admin-only profiling; without ADMIN_API_KEY the endpoints are hidden and nothing is installed
+require_admin = admin_dependency(ADMIN_API_KEY)
+sampling_profiler = SamplingProfiler(max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "60")))
+if ADMIN_API_KEY:
+    # Requests sent with X-Profile: 1 and the admin key get a cProfile report of their blocking stages
+    app.add_middleware(RequestProfilingMiddleware, admin_api_key=ADMIN_API_KEY)
+
+# Brotli/gzip compression of JSON responses according to Accept-Encoding
+compression = CompressionMiddleware(minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024")))
+app.middleware("http")(compression)
+
+# Configure CORS; added last so it is the outermost middleware and its headers are also
+# on responses from the middleware above, e.g. admission 429s and 503s
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, replace with specific origins
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Polling clients read the ETag to send it back in If-None-Match; rejected ones read Retry-After
+    expose_headers=["ETag", "Retry-After"],
+)
+
+# Shared worker pool for blocking request stages, scheduled fairly across portals
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "32"))
+worker_scheduler = FairScheduler(
+    max_workers=WORKER_POOL_SIZE,
+    max_per_tenant=max(1, int(WORKER_POOL_SIZE * float(os.getenv("WORKER_POOL_TENANT_SHARE", "0.5")))),
+)
+
+# Per-request deadlines: per-endpoint defaults, overridable by the X-Request-Timeout header up to a maximum
+request_deadline = request_deadline_dependency(
+    parse_timeouts(os.getenv("REQUEST_DEADLINES", "/query:20,/query/more:20,/search:20,/chat:60")),
+    default_timeout=float(os.getenv("REQUEST_DEADLINE_DEFAULT", "30")),
+    max_timeout=float(os.getenv("REQUEST_DEADLINE_MAX", "120")),
+    runner=profiled_runner(worker_scheduler.run) if ADMIN_API_KEY else worker_scheduler.run,
+)
+
+# Circuit breakers per upstream (HubSpot endpoint family, LLM provider) and last-known-good HubSpot results
+circuit_breakers = BreakerRegistry(
+    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30")),
+    half_open_max_calls=int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1")),
+)
+last_known_good = LastKnownGood(
+    max_entries=int(os.getenv("STALE_CACHE_MAX_ENTRIES", "500")),
+    max_age_seconds=float(os.getenv("STALE_CACHE_MAX_AGE_SECONDS", "86400")),
 )
 
+# Longest a HubSpot call waits for its portal's rate budget before giving up
+HUBSPOT_RATE_WAIT_SECONDS = float(os.getenv("HUBSPOT_RATE_WAIT_SECONDS", "5"))
+
+# Upper bounds for a single upstream call when no request deadline applies
+HUBSPOT_REQUEST_TIMEOUT = float(os.getenv("HUBSPOT_REQUEST_TIMEOUT", "30"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+# Share of the remaining request budget given to each /query and /search stage
+INTENT_BUDGET_FRACTION = 0.5
+FETCH_BUDGET_FRACTION = 0.7
+AGENT_BUDGET_FRACTION = 0.9
+
 # Initialize HubSpot API configuration
 bearer_token = os.getenv("HUBSPOT_BEARER_TOKEN")
 api_key = os.getenv("HUBSPOT_API_KEY")
@@ -52,17 +142,54 @@ if (not bearer_token or bearer_token == "your_developer_ai_bearer_token_here") a
     print("WARNING: Neither HubSpot Bearer Token nor API Key is set correctly.")
     print("Please set valid HubSpot credentials in the .env file.")
 
-# HubSpot API base URL
-HUBSPOT_API_BASE = "https://api.hubapi.com"
+# HubSpot portals: the credentials above are the default portal, more can be added in HUBSPOT_PORTALS_FILE.
+# Each portal has its own credentials, connection pool and rate budget, selected by the X-Portal-Id header
+# and opened by the portal's access key in X-Portal-Key.
+tenant_registry = load_tenants(
+    os.getenv("HUBSPOT_PORTALS_FILE"),
+    bearer_token,
+    api_key,
+    default_tenant_id=os.getenv("HUBSPOT_DEFAULT_PORTAL", "default"),
+    requests_per_second=float(os.getenv("HUBSPOT_RATE_PER_SECOND", "10")),
+    burst=int(os.getenv("HUBSPOT_RATE_BURST", "100")),
+    pool_size=int(os.getenv("HUBSPOT_POOL_SIZE", "10")),
+    default_access_key=os.getenv("HUBSPOT_DEFAULT_PORTAL_KEY") or None,
+)
+resolve_tenant = tenant_dependency(tenant_registry)
 
-# Set up headers for API requests
-headers = {
-    "Content-Type": "application/json"
-}
+# Helper function naming the caller for client quotas, when it holds a key
+def authenticated_client(request: Request) -> Optional[str]:
+    """"admin" for the admin key, "portal:<id>" for a portal's access key, otherwise None"""
+    if is_admin(request, ADMIN_API_KEY):
+        return "admin"
+    tenant = tenant_registry.tenants.get(request.headers.get("x-portal-id") or tenant_registry.default_tenant_id)
+    if tenant is not None and tenant.access_key is not None and tenant.allows(request.headers.get("x-portal-key")):
+        return f"portal:{tenant.tenant_id}"
+    return None
+print(f"HubSpot portals configured: {', '.join(tenant_registry.tenants)}")
+
+# Connectors: async access to each integration through its own pooled transport, rate
+# budget, response cache and metrics; HubSpot shares the portal's budget and breakers
+connector_registry = ConnectorRegistry()
+connector_registry.register("hubspot", lambda tenant: HubSpotConnector.for_tenant(
+    tenant,
+    breakers=circuit_breakers,
+    cache=ResponseCache(
+        max_entries=int(os.getenv("CONNECTOR_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("CONNECTOR_CACHE_TTL_SECONDS", "30")),
+    ),
+    timeout=HUBSPOT_REQUEST_TIMEOUT,
+    rate_wait=HUBSPOT_RATE_WAIT_SECONDS,
+))
+# Most records a single /records call returns; larger reads are export jobs
+CONNECTOR_MAX_RECORDS = int(os.getenv("CONNECTOR_MAX_RECORDS", "1000"))
 
-# Add authorization header if bearer token is available
-if bearer_token and bearer_token != "your_developer_ai_bearer_token_here":
-    headers["Authorization"] = f"Bearer {bearer_token}"
+def get_tenant() -> Tenant:
+    """Portal of the current request, or the default portal outside a request"""
+    return current_tenant.get() or tenant_registry.default
+
+# Name of the configured LLM provider, used for its circuit breaker
+LLM_PROVIDER = None
 
 # Initialize LLM configuration if LangChain is available
 if LANGCHAIN_AVAILABLE:
@@ -85,8 +212,10 @@ if LANGCHAIN_AVAILABLE:
                 model=GROQ_MODEL,
                 api_key=GROQ_API_KEY,
                 temperature=0.7,
-                base_url="https://api.groq.com/openai/v1"
+                base_url="https://api.groq.com/openai/v1",
+                timeout=LLM_REQUEST_TIMEOUT
             )
+            LLM_PROVIDER = "groq"
             print(f"Groq LLM initialized successfully with model: {GROQ_MODEL}")
         except Exception as e:
             print(f"Error initializing Groq LLM: {e}")
@@ -100,8 +229,10 @@ if LANGCHAIN_AVAILABLE:
                 azure_deployment=AZURE_OPENAI_DEPLOYMENT_NAME,
                 azure_endpoint=AZURE_OPENAI_API_BASE,
                 api_key=AZURE_OPENAI_API_KEY,
-                temperature=0.7
+                temperature=0.7,
+                timeout=LLM_REQUEST_TIMEOUT
             )
+            LLM_PROVIDER = "azure_openai"
             print("Azure OpenAI LLM initialized successfully")
         except Exception as e:
             print(f"Error initializing Azure OpenAI LLM: {e}")
@@ -137,8 +268,7 @@ def generate_conversational_response(query: str, data: Dict[str, Any], object_ty
             """
             
             # Get the response from Azure OpenAI
-            response = llm.invoke(prompt)
-            conversational_response = response.content if hasattr(response, 'content') else str(response)
+            conversational_response = invoke_llm_text(prompt)
             
             return conversational_response.strip(), data
         except Exception as e:
@@ -150,40 +280,235 @@ def generate_conversational_response(query: str, data: Dict[str, Any], object_ty
 print(f"HubSpot API configuration initialized successfully. Using {'mock data' if USE_MOCK_DATA else 'live API'}.")
 print(f"LangChain integration is {'available' if LANGCHAIN_AVAILABLE else 'NOT available'}.")
 
+# Speculative prefetch of the HubSpot request predicted by the rule-based intent analysis
+speculator = SpeculativePrefetcher(
+    max_workers=int(os.getenv("SPECULATION_MAX_WORKERS", "8")),
+    min_hit_rate=float(os.getenv("SPECULATION_MIN_HIT_RATE", "0.3")),
+    enabled=os.getenv("SPECULATIVE_PREFETCH", "true").lower() == "true",
+)
+
+# Per-conversation memoization of agent tool results
+tool_cache = ToolResultCache(ttl_seconds=float(os.getenv("TOOL_CACHE_TTL_SECONDS", "60")))
+
+# Background warming of the follow-up data a chat turn's results predict
+prefetcher = FollowUpPrefetcher(
+    tool_cache,
+    DEFAULT_PROPERTIES,
+    top_n=int(os.getenv("PREFETCH_TOP_N", "3")),
+    max_calls_per_turn=int(os.getenv("PREFETCH_MAX_CALLS_PER_TURN", "4")),
+    ttl_seconds=float(os.getenv("PREFETCH_TTL_SECONDS", "180")),
+    enabled=os.getenv("CHAT_PREFETCH", "true").lower() == "true",
+)
+
+# Token budget for a single tool observation in the agent scratchpad
+TOOL_OBSERVATION_TOKEN_BUDGET = int(os.getenv("TOOL_OBSERVATION_TOKEN_BUDGET", "600"))
+
 # Helper function to make HubSpot API requests
-def make_hubspot_request(endpoint, method="GET", params=None, data=None):
-    """Make a request to the HubSpot API"""
-    url = f"{HUBSPOT_API_BASE}{endpoint}"
+def make_hubspot_request(endpoint, method="GET", params=None, data=None, allow_stale=True, tenant=None):
+    """Make a request to the HubSpot API for a portal (the current request's by default)
     
-    # Create a copy of params to avoid modifying the original
-    request_params = params.copy() if params else {}
+    Calls are sent by the portal's HubSpot connector transport, so they share its
+    connection pool, rate budget, circuit breakers (one per endpoint family) and
+    metrics with the connector endpoints. While HubSpot is failing, reads are
+    answered from the last good result, marked stale, and refreshed in the background.
+    """
+    tenant = tenant or get_tenant()
+    if method.upper() not in ("GET", "POST"):
+        raise ValueError(f"Unsupported HTTP method: {method}")
     
-    # Add API key to params if we're using API key authentication
-    if api_key and api_key != "your_hubspot_api_key_here" and "Authorization" not in headers:
-        request_params["hapikey"] = api_key
+    cache_key = hubspot_cache_key(endpoint, method, params, data)
+    if cache_key is not None:
+        cache_key = tenant.namespace(cache_key)
+    refresh = lambda: make_hubspot_request(endpoint, method, params, data, allow_stale=False, tenant=tenant)
     
+    transport = connector_registry.get("hubspot", tenant).transport
     try:
-        if method.upper() == "GET":
-            response = requests.get(url, headers=headers, params=request_params)
-        elif method.upper() == "POST":
-            response = requests.post(url, headers=headers, params=request_params, json=data)
-        else:
-            raise ValueError(f"Unsupported HTTP method: {method}")
-        
-        # Print response status for debugging
-        print(f"HubSpot API response status: {response.status_code}")
-        
-        if response.status_code == 401:
+        # The transport checks the request deadline, waits briefly for rate budget and fails fast while the circuit is open
+        payload = transport.send_blocking(Call(method.upper(), endpoint, params=params, json=data, read=cache_key is not None))
+    except CallRejected as e:
+        if e.status_code is None:
+            # Out of time or cancelled; don't spend HubSpot quota on it
+            return {"results": [], "total": 0, "error": str(e)}
+        print(f"Skipping HubSpot request to {endpoint}: {e}")
+        stale = serve_stale(cache_key, str(e), refresh) if allow_stale else None
+        if stale is not None:
+            return stale
+        error = {"results": [], "total": 0, "error": str(e)}
+        if e.status_code == 503:
+            error["degraded"] = True
+        return error
+    except ConnectorError as e:
+        if e.status_code == 401:
             print("Authentication failed. Check your HubSpot API key or Bearer Token.")
             # Return empty results instead of failing
             return {"results": [], "total": 0, "message": "Authentication failed"}
-            
-        response.raise_for_status()  # Raise exception for other 4XX/5XX responses
-        return response.json()
-    except RequestException as e:
         print(f"Error making request to HubSpot API: {e}")
+        if allow_stale and (e.status_code is None or e.status_code >= 500 or e.status_code == 429):
+            stale = serve_stale(cache_key, str(e), refresh)
+            if stale is not None:
+                return stale
         # Return empty results with error message
-        return {"results": [], "total": 0, "error": str(e)}
+        error = {"results": [], "total": 0, "error": str(e)}
+        if e.status_code is not None:
+            # HubSpot explains client errors (e.g. which inputs of a batch are invalid) in the body
+            error["status_code"] = e.status_code
+            if e.details is not None:
+                error["details"] = e.details
+        return error
+    
+    if cache_key is not None:
+        last_known_good.put(cache_key, payload)
+    return payload
+
+# Helper function to key HubSpot reads in the last-known-good cache
+def hubspot_cache_key(endpoint: str, method: str, params: Optional[Dict[str, Any]], data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Cache key for a read request; None for requests that change data"""
+    is_read = method.upper() == "GET" or endpoint.endswith("/search") or endpoint.endswith("/batch/read")
+    if not is_read:
+        return None
+    return f"{method.upper()} {endpoint} {json.dumps(params, sort_keys=True, default=str)} {json.dumps(data, sort_keys=True, default=str)}"
+
+# Helper function to tell the user that results came from the last-known-good cache
+def stale_note(response_dict: Dict[str, Any]) -> str:
+    if not response_dict.get("stale"):
+        return ""
+    return f"\n(HubSpot is currently unavailable, so these results are from {response_dict['stale_age_seconds'] / 60:.0f} minutes ago.)"
+
+# Helper function to answer from the last-known-good cache while HubSpot is failing
+def serve_stale(cache_key: Optional[str], reason: str, refresh) -> Optional[Dict[str, Any]]:
+    """The last good result marked stale, scheduling a background refresh; None if there is none"""
+    if cache_key is None:
+        return None
+    cached = last_known_good.get(cache_key)
+    if cached is None:
+        return None
+    value, age = cached
+    last_known_good.revalidate(cache_key, refresh)
+    print(f"Serving {age:.0f}s old HubSpot result while degraded: {reason}")
+    return dict(value, stale=True, stale_age_seconds=round(age, 1), degraded_reason=reason)
+
+# Helper function to execute a compiled query plan
+def execute_plan(plan: QueryPlan) -> Dict[str, Any]:
+    """Run the HubSpot request described by a query plan"""
+    if plan.kind == "graph":
+        # Relationship queries are answered by joins over the in-memory association graph
+        try:
+            return association_graphs.get(get_tenant()).related(**plan.body)
+        except GraphLoading as e:
+            return {"results": [], "total": 0, "error": str(e), "graph_loading": True}
+    return make_hubspot_request(plan.endpoint, method=plan.method, params=plan.params, data=plan.body)
+
+# Filter keys that name the record a lookup is looking for, in order of preference
+LOOKUP_TARGET_KEYS = ["contact_name", "company_name", "deal_name", "name", "email", "domain"]
+
+# Helper function to describe the result of a plan in a user-facing message
+def describe_plan_result(query: str, plan: QueryPlan, response_dict: Dict[str, Any]) -> str:
+    """Build the response message for a plan; list and search results are summarized by the LLM"""
+    object_type = plan.object_type
+    result_count = len(response_dict.get("results", []))
+    
+    if plan.intent == "lookup" and plan.kind == "search" and plan.filters:
+        # Name the thing we looked up, e.g. "Yes, I found 1 company matching 'acme'."
+        target_keys = [key for key in LOOKUP_TARGET_KEYS if key in plan.filters] or list(plan.filters)
+        target = plan.filters[target_keys[0]]
+        singular = {"contacts": "contact", "companies": "company", "deals": "deal"}[object_type]
+        if result_count > 0:
+            return f"Yes, I found {result_count} {singular if result_count == 1 else object_type} matching '{target}'."
+        return f"No, I couldn't find any {object_type} matching '{target}'."
+    
+    if plan.kind == "graph":
+        if response_dict.get("graph_loading"):
+            return "I'm still loading the relationships between your companies, contacts and deals. Please ask again in a minute."
+        relation = plan.body
+        total = response_dict.get("total", result_count)
+        worth = f" worth at least {relation['min_amount']:,.0f}" if relation["min_amount"] is not None else ""
+        if relation["source_type"] == "deals":
+            # e.g. "Found 3 companies with open deals worth at least 50,000."
+            return f"Found {total} {object_type} with {'open ' if relation['open_only'] else ''}deals{worth}."
+        via = f" via {relation['via']}" if relation["via"] else ""
+        matching = f" matching '{relation['source_name']}'" if relation["source_name"] else ""
+        deal_criteria = f" ({'open, ' if relation['open_only'] else ''}{worth.strip()})" if object_type == "deals" and (worth or relation["open_only"]) else ""
+        return f"Found {total} {object_type}{deal_criteria} related to {relation['source_type']}{matching}{via}."
+    
+    if plan.intent == "filter" and plan.kind == "search":
+        return f"Found {result_count} {object_type} matching your filter criteria."
+    
+    if plan.intent == "count" and plan.kind == "search":
+        total = response_dict.get("total", result_count)
+        return f"There are {total} {object_type} matching your query."
+    
+    conversational_response, _ = generate_conversational_response(query, response_dict, object_type)
+    if plan.unfiltered:
+        conversational_response = f"I couldn't identify specific criteria to filter by, so here are the latest {object_type}. {conversational_response}"
+    return conversational_response
+
+# In-memory company/contact/deal association graph per portal for relationship queries, loaded in the background at startup
+association_graphs = PerTenant(lambda tenant: AssociationGraph(
+    partial(make_hubspot_request, tenant=tenant),
+    refresh_seconds=float(os.getenv("ASSOCIATION_GRAPH_REFRESH_SECONDS", "300")),
+    full_reload_seconds=float(os.getenv("ASSOCIATION_GRAPH_FULL_RELOAD_SECONDS", "3600")),
+    max_records=int(os.getenv("ASSOCIATION_GRAPH_MAX_RECORDS", "50000")),
+    archived_pages_per_refresh=int(os.getenv("ASSOCIATION_GRAPH_ARCHIVED_PAGES_PER_REFRESH", "5")),
+))
+
+# Precomputed dashboard summaries per portal, refreshed in the background while the app runs
+summary_stores = {
+    tenant.tenant_id: SummaryStore(configure_summaries(
+        partial(make_hubspot_request, tenant=tenant),
+        os.getenv("DASHBOARD_SUMMARIES", "pipeline_by_stage:300,new_contacts_last_7_days:600,top_industries:3600"),
+        jitter=float(os.getenv("DASHBOARD_SUMMARY_JITTER", "0.1")),
+        max_records=int(os.getenv("DASHBOARD_SUMMARY_MAX_RECORDS", "10000")),
+    ))
+    for tenant in tenant_registry
+    if tenant.has_credentials or tenant is tenant_registry.default
+}
+# The default portal's store only lists the summaries for the tool description when it has no credentials
+summary_schedulers = [
+    SummaryScheduler(summary_stores[tenant.tenant_id])
+    for tenant in tenant_registry
+    if tenant.has_credentials
+]
+
+@app.on_event("startup")
+async def start_background_tasks():
+    for scheduler in summary_schedulers:
+        scheduler.start()
+    for tenant in tenant_registry:
+        if tenant.has_credentials:
+            association_graphs.get(tenant).start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for scheduler in summary_schedulers:
+        await scheduler.stop()
+    await connector_registry.close()
+
+# Helper function to answer a question from a precomputed summary
+def answer_from_summary(query: str) -> Optional[Dict[str, Any]]:
+    """Return a /query response from a matching dashboard summary, if one has been computed"""
+    summary_store = summary_stores.get(get_tenant().tenant_id)
+    if summary_store is None:
+        return None
+    definition = summary_store.match(query)
+    if definition is None:
+        return None
+    summary = summary_store.get(definition.name)
+    if summary is None:
+        return None
+    
+    response_message = summary["text"]
+    if summary["stale"]:
+        response_message += f"\n(This summary is {summary['age_seconds'] / 60:.0f} minutes old and may be out of date.)"
+    return {
+        "response": response_message,
+        "data": dict(
+            summary["value"],
+            summary=definition.name,
+            computed_at=summary["computed_at"],
+            age_seconds=summary["age_seconds"],
+            stale=summary["stale"],
+        )
+    }
 
 # Since we're not using mock data anymore, we don't need these functions
 # We'll handle API errors directly in the make_hubspot_request function
@@ -195,9 +520,15 @@ class QueryRequest(BaseModel):
     limit: int = 25  # Increased default limit
     properties: Optional[List[str]] = None
 
+class QueryPageRequest(QueryRequest):
+    # paging.next.after of the page before
+    after: str
+
 class QueryResponse(BaseModel):
     response: str
     data: Optional[Dict[str, Any]] = None
+    # Set when the request deadline cut a stage short and the response is incomplete
+    partial: Optional[bool] = None
     
 class ChatRequest(BaseModel):
     message: str
@@ -207,73 +538,68 @@ class ChatResponse(BaseModel):
     response: str
     data: Optional[Dict[str, Any]] = None
     conversation_id: str
+    # Tool calls, HubSpot calls and observation tokens for this agent turn
+    turn_stats: Optional[Dict[str, Any]] = None
+    # Set when the agent ran out of time and the response is built from what it found so far
+    partial: Optional[bool] = None
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Simple HubSpot API Server"}
 
-# Helper function to analyze query intent using the configured LLM
-def analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
-    """Analyze the intent of a natural language query and extract relevant parameters using the configured LLM (Groq or Azure OpenAI)"""
-    # Default values
-    intent = "list"
-    intent_data = {}
-    
-    # First try using Azure OpenAI if available
-    if LANGCHAIN_AVAILABLE and 'llm' in globals():
-        try:
-            # Simple direct approach using the LLM
-            prompt = f"""
-            Analyze this query about HubSpot CRM data: "{query}"
-            
+# Instruction block shared by the single-query and batched intent prompts
+INTENT_INSTRUCTIONS = """
             Determine the user's intent from these options:
             - list: List records (default)
             - lookup: Check if a specific record exists
             - search: Search for records matching criteria
             - count: Count records matching criteria
             - filter: Filter records by specific criteria
+            - related: Find records associated with other records (e.g. deals for contacts at a company)
             
             Also extract these parameters when relevant:
             - object_type: The type of object (contacts, companies, deals)
             - Any search criteria (name, email, industry, etc.)
             - limit: Number of records to return
-            
-            Format your response as a JSON object with 'intent' and 'intent_data' fields.
-            Example: {{"intent": "lookup", "intent_data": {{"object_type": "contacts", "contact_name": "John Smith"}}}}
-            
-            JSON response:
+            - For related: related_to (the object type the records are associated with), related_name,
+              via (an intermediate object type, if any), min_amount and open_only (deal criteria)
             """
-            
-            # Call the LLM directly with a simple string prompt
-            response = llm.invoke(prompt)
-            response_text = response.content if hasattr(response, 'content') else str(response)
-            
-            # Extract JSON from the response
-            try:
-                # Look for JSON in code blocks first
-                json_match = re.search(r'```(?:json)?\s*(.+?)\s*```', response_text, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1).strip()
-                else:
-                    # Otherwise clean the text and try to extract JSON
-                    json_str = re.sub(r'^[^{]*', '', response_text)
-                    json_str = re.sub(r'[^}]*$', '', json_str)
-                
-                # Parse the JSON
-                result = json.loads(json_str)
-                
-                # Extract intent and intent_data
-                if 'intent' in result:
-                    intent = result['intent']
-                if 'intent_data' in result:
-                    intent_data = result['intent_data']
-                
-                print(f"Azure OpenAI intent analysis: {intent}, {json.dumps(intent_data)}")
-            except Exception as e:
-                print(f"Error parsing Azure OpenAI response: {e}")
-                print(f"Raw response: {response_text}")
-                # Fall back to basic intent detection
-                intent, intent_data = fallback_analyze_query_intent(query)
+
+# Helper function to get the text of an LLM completion
+def invoke_llm_text(prompt: str) -> str:
+    """Call the configured LLM with a string prompt and return the response text"""
+    deadline = get_deadline()
+    if deadline is not None:
+        deadline.check()
+    # Fails fast with CircuitOpen while the provider is having an incident
+    response = circuit_breakers.get(f"llm:{LLM_PROVIDER}").call(llm.invoke, prompt)
+    return response.content if hasattr(response, 'content') else str(response)
+
+# Batches concurrent intent classifications into one multi-query prompt
+intent_batcher = None
+if LANGCHAIN_AVAILABLE and os.getenv("INTENT_BATCHING", "true").lower() == "true":
+    intent_batcher = IntentBatcher(
+        invoke_llm_text,
+        INTENT_INSTRUCTIONS,
+        window_ms=float(os.getenv("INTENT_BATCH_WINDOW_MS", "5")),
+        max_batch_size=int(os.getenv("INTENT_BATCH_MAX_SIZE", "8")),
+    )
+
+# Helper function to analyze query intent using the configured LLM
+def analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
+    """Analyze the intent of a natural language query and extract relevant parameters using the configured LLM (Groq or Azure OpenAI)"""
+    # First try using Azure OpenAI if available
+    if LANGCHAIN_AVAILABLE and 'llm' in globals():
+        try:
+            # Concurrent queries of a portal are classified together; a missing batch result falls back to a single prompt
+            deadline = get_deadline()
+            timeout = deadline.remaining() if deadline is not None else LLM_REQUEST_TIMEOUT
+            result = intent_batcher.classify(query, timeout=timeout, group=get_tenant().tenant_id) if intent_batcher is not None else None
+            if result is not None:
+                intent, intent_data = result
+                print(f"Batched intent analysis: {intent}, {json.dumps(intent_data)}")
+            else:
+                intent, intent_data = analyze_single_query_intent(query)
         except Exception as e:
             print(f"Error using Azure OpenAI for intent analysis: {e}")
             # Fall back to basic intent detection
@@ -289,6 +615,86 @@ def analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
     
     return intent, intent_data
 
+def analyze_single_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
+    """Classify one query with its own LLM prompt"""
+    # Default values
+    intent = "list"
+    intent_data = {}
+    
+    # Simple direct approach using the LLM
+    prompt = f"""
+            Analyze this query about HubSpot CRM data: "{query}"
+            {INTENT_INSTRUCTIONS}
+            Format your response as a JSON object with 'intent' and 'intent_data' fields.
+            Example: {{"intent": "lookup", "intent_data": {{"object_type": "contacts", "contact_name": "John Smith"}}}}
+            
+            JSON response:
+            """
+    
+    # Call the LLM directly with a simple string prompt
+    response_text = invoke_llm_text(prompt)
+    
+    # Extract JSON from the response
+    try:
+        # Parse the JSON, looking in code blocks first
+        result = json.loads(extract_json(response_text))
+        
+        # Extract intent and intent_data
+        if 'intent' in result:
+            intent = result['intent']
+        if 'intent_data' in result:
+            intent_data = result['intent_data']
+        
+        print(f"Azure OpenAI intent analysis: {intent}, {json.dumps(intent_data)}")
+    except Exception as e:
+        print(f"Error parsing Azure OpenAI response: {e}")
+        print(f"Raw response: {response_text}")
+        # Fall back to basic intent detection
+        intent, intent_data = fallback_analyze_query_intent(query)
+    
+    return intent, intent_data
+
+# Patterns for relationship questions answered by the association graph
+RELATION_VIA_PATTERN = re.compile(r'\b(contacts|deals)\s+(?:for|of)\s+(contacts|deals)\s+at\s+([\w\s&.-]+)')
+RELATION_AT_PATTERN = re.compile(r'\b(contacts|deals)\s+(?:at|for|of)\s+(?:the\s+)?company\s+([\w\s&.-]+)|\b(contacts|deals)\s+at\s+([\w\s&.-]+)')
+RELATION_DEALS_PATTERN = re.compile(r'\b(companies|contacts)\s+(?:with|that have|have|having)\s+(open\s+)?deals(?:\s+(?:over|above|greater than|of at least|worth over)\s+\$?([\d,.]+)\s*(k|m)?)?')
+
+def match_relation(query: str) -> Optional[Dict[str, Any]]:
+    """Rule-based detection of relationship questions in a lower-cased query"""
+    via_match = RELATION_VIA_PATTERN.search(query)
+    if via_match and via_match.group(1) != via_match.group(2):
+        return {
+            "object_type": via_match.group(1),
+            "related_to": "companies",
+            "via": via_match.group(2),
+            "related_name": via_match.group(3).strip(" .?"),
+        }
+    
+    at_match = RELATION_AT_PATTERN.search(query)
+    if at_match:
+        object_type = at_match.group(1) or at_match.group(3)
+        name = at_match.group(2) or at_match.group(4)
+        return {
+            "object_type": object_type,
+            "related_to": "companies",
+            "related_name": name.strip(" .?"),
+        }
+    
+    deals_match = RELATION_DEALS_PATTERN.search(query)
+    if deals_match:
+        relation = {
+            "object_type": deals_match.group(1),
+            "related_to": "deals",
+            "open_only": bool(deals_match.group(2)),
+        }
+        if deals_match.group(3):
+            amount = float(deals_match.group(3).replace(",", "").rstrip("."))
+            multiplier = {"k": 1000, "m": 1000000}.get(deals_match.group(4), 1)
+            relation["min_amount"] = amount * multiplier
+        return relation
+    
+    return None
+
 # Fallback function for intent analysis when Azure OpenAI is not available
 def fallback_analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
     """Basic rule-based fallback for analyzing query intent"""
@@ -298,6 +704,10 @@ def fallback_analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
     # Default intent
     intent = "list"
     
+    # Relationship questions, e.g. "deals for contacts at acme" or "companies with open deals over $50k"
+    relation = match_relation(query)
+    counting = any(term in query for term in ["how many", "count", "total number"])
+    
     # Check for existence/lookup intent
     if any(pattern in query for pattern in ["is there", "do we have", "do you have", "exists", "named", "called"]):
         intent = "lookup"
@@ -314,12 +724,17 @@ def fallback_analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
             intent_data["contact_name"] = contact_match.group(1).strip()
             intent_data["object_type"] = "contacts"
     
+    # Counts stay counts, e.g. "how many contacts at acme"
+    elif relation and not counting:
+        intent = "related"
+        intent_data.update(relation)
+    
     # Check for search intent
     elif any(term in query for term in ["find", "search", "look for", "where", "who has"]):
         intent = "search"
     
     # Check for count intent
-    elif any(term in query for term in ["how many", "count", "total number"]):
+    elif counting:
         intent = "count"
     
     # Check for filter intent
@@ -351,152 +766,158 @@ def fallback_analyze_query_intent(query: str) -> Tuple[str, Dict[str, Any]]:
     
     return intent, intent_data
 
+# Helper functions to compile the request plan for /query and /search
+def plan_query(request: QueryRequest, intent: str, intent_data: Dict[str, Any]) -> QueryPlan:
+    """Plan for /query; object_type and limit from intent_data override the request values"""
+    return planner.plan_from_intent(intent, intent_data, request.object_type, request.limit, request.properties)
+
+def plan_search(request: QueryRequest, intent: str, intent_data: Dict[str, Any]) -> QueryPlan:
+    """Plan for /search; structured filters when intent analysis found any, otherwise a full-text search"""
+    plan = planner.plan_from_intent("search", intent_data, request.object_type, request.limit, request.properties)
+    if plan.kind == "list":
+        plan = planner.plan("search", plan.object_type, None, plan.limit, request.properties, text=request.query)
+    return plan
+
+async def analyze_and_fetch(request: QueryRequest, build_plan, deadline: Deadline) -> Tuple[QueryPlan, Dict[str, Any]]:
+    """Analyze the query intent and fetch the planned HubSpot data.
+    
+    While the LLM analyzes the intent, the request predicted by the rule-based analysis
+    is fetched speculatively and reused if the LLM arrives at the same plan. Intent
+    analysis gets part of the request's time budget; if it runs out, the rule-based
+    analysis is used so there is still time left to fetch the data.
+    """
+    speculation = None
+    if LANGCHAIN_AVAILABLE and 'llm' in globals():
+        guess_intent, guess_data = fallback_analyze_query_intent(request.query)
+        try:
+            speculation = speculator.start(build_plan(request, guess_intent, guess_data), execute_plan)
+        except ValueError:
+            speculation = None
+    
+    try:
+        intent, intent_data = await deadline.run(analyze_query_intent, request.query, fraction=INTENT_BUDGET_FRACTION)
+    except DeadlineExceeded:
+        if deadline.cancelled:
+            await speculator.resolve(speculation, None, time.monotonic())
+            raise
+        print(f"Intent analysis ran out of time; using rule-based analysis for: {request.query}")
+        intent, intent_data = fallback_analyze_query_intent(request.query)
+    intent_finished_at = time.monotonic()
+    
+    try:
+        plan = build_plan(request, intent, intent_data)
+    except ValueError:
+        await speculator.resolve(speculation, None, intent_finished_at)
+        raise
+    
+    response_dict = await deadline.wait(speculator.resolve(speculation, plan, intent_finished_at), FETCH_BUDGET_FRACTION)
+    if response_dict is None:
+        print(f"Executing {plan.kind} plan: {plan.method} {HUBSPOT_API_BASE}{plan.endpoint}")
+        response_dict = await deadline.run(execute_plan, plan, fraction=FETCH_BUDGET_FRACTION)
+    else:
+        print(f"Using speculative result for {plan.kind} plan: {plan.method} {HUBSPOT_API_BASE}{plan.endpoint}")
+    return plan, response_dict
+
+# Conditional requests: ETags from record versions, 304s and reused bodies for unchanged data
+conditional_responses = ConditionalResponses(
+    max_entries=int(os.getenv("CONDITIONAL_CACHE_MAX_ENTRIES", "1000")),
+    fresh_seconds=float(os.getenv("CONDITIONAL_FRESH_SECONDS", "5")),
+    max_age_seconds=float(os.getenv("CONDITIONAL_MAX_AGE_SECONDS", "600")),
+)
+
+async def fetch_or_revalidate(request: QueryRequest, http_request: Request, key: str, build_plan, deadline: Deadline) -> Union[Response, Tuple[QueryPlan, Dict[str, Any], Optional[str]]]:
+    """Fetch the data for a request, or answer it from its last validated response.
+    
+    Returns a finished response (304, or the stored body) when the records are unchanged,
+    otherwise (plan, response_dict, etag) for the endpoint to describe. A request seen
+    before reuses its plan, so only the HubSpot fetch runs again.
+    """
+    if_none_match = http_request.headers.get("if-none-match")
+    entry = conditional_responses.get(key)
+    if entry is not None and conditional_responses.is_fresh(entry) and etag_matches(if_none_match, entry.etag):
+        return conditional_responses.not_modified_response(entry.etag, fresh=True)
+    
+    if entry is not None:
+        print(f"Revalidating {entry.plan.kind} plan: {entry.plan.method} {HUBSPOT_API_BASE}{entry.plan.endpoint}")
+        plan = entry.plan
+        response_dict = await deadline.run(execute_plan, plan, fraction=FETCH_BUDGET_FRACTION)
+    else:
+        plan, response_dict = await analyze_and_fetch(request, build_plan, deadline)
+    
+    etag = compute_etag(key, response_dict)
+    if entry is not None and etag == entry.etag:
+        conditional_responses.validated(entry)
+        if etag_matches(if_none_match, etag):
+            return conditional_responses.not_modified_response(etag)
+        return conditional_responses.reuse_response(entry)
+    if etag_matches(if_none_match, etag):
+        return conditional_responses.not_modified_response(etag)
+    return plan, response_dict, etag
+
+def validated_response(key: str, plan: QueryPlan, etag: Optional[str], content: Dict[str, Any]) -> FastJSONResponse:
+    """Encode a data response, tagging and storing it when its records can be validated"""
+    response = FastJSONResponse(content)
+    if etag is not None:
+        conditional_responses.put(key, etag, plan, response.body)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Helper function for the response when a request runs out of time before any data is fetched
+def deadline_response(deadline: Deadline) -> Dict[str, Any]:
+    reason = deadline.cancel_reason or "request deadline exceeded"
+    print(f"Request stopped after {deadline.timeout_seconds - deadline.remaining():.1f}s: {reason}")
+    return {
+        "response": "The request took too long and was stopped before any data could be fetched. Please try a narrower query.",
+        "data": None,
+        "partial": True
+    }
+
 @app.post("/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
+async def process_query(request: QueryRequest, http_request: Request, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
     try:
-        # Analyze the intent of the query
-        intent, intent_data = analyze_query_intent(request.query)
-        
-        # Override object_type if specified in intent_data
-        object_type = intent_data.get("object_type", request.object_type.lower())
+        key = conditional_responses.key(tenant.tenant_id, "/query", request.dict())
         
-        # Use intent-based limit if available, otherwise use the request limit
-        if "limit" in intent_data:
-            limit = min(intent_data["limit"], 100)  # Cap at 100 for safety
-        else:
-            limit = min(request.limit, 100)  # Cap at 100 for safety
-        
-        # Set default properties based on object type
-        properties = request.properties
-        if properties is None:
-            if object_type == "contacts":
-                properties = ["firstname", "lastname", "email", "phone", "company"]
-            elif object_type == "companies":
-                properties = ["name", "domain", "industry", "website", "phone"]
-            elif object_type == "deals":
-                properties = ["dealname", "amount", "dealstage", "closedate", "pipeline"]
+        # Questions covered by a precomputed dashboard summary are answered instantly
+        summary_response = answer_from_summary(request.query)
+        if summary_response is not None:
+            # Like stale HubSpot results, a stale summary is not tagged, so clients see its out-of-date note
+            if summary_response["data"]["stale"]:
+                return FastJSONResponse(summary_response)
+            etag = entity_tag(key, summary_response["data"]["summary"], summary_response["data"]["computed_at"])
+            if etag_matches(http_request.headers.get("if-none-match"), etag):
+                return conditional_responses.not_modified_response(etag)
+            return FastJSONResponse(summary_response, headers={"ETag": etag, "Cache-Control": "no-cache"})
         
-        # Validate object type
-        if object_type not in ["contacts", "companies", "deals"]:
+        # Analyze the intent of the query and fetch the matching HubSpot data, unless it is unchanged
+        try:
+            result = await fetch_or_revalidate(request, http_request, key, plan_query, deadline)
+        except ValueError as e:
             return {
-                "response": f"Invalid object_type: {object_type}. Must be one of: contacts, companies, deals",
+                "response": str(e),
                 "data": None
             }
+        except DeadlineExceeded:
+            return deadline_response(deadline)
+        if isinstance(result, Response):
+            return result
+        plan, response_dict, etag = result
         
-        # Handle lookup intent (e.g., "is there a company named acme?")
-        if intent == "lookup":
-            search_data = {
-                "filterGroups": [{
-                    "filters": []
-                }],
-                "limit": limit
-            }
-            
-            # Add filters based on intent data
-            filters = []
-            if "company_name" in intent_data and object_type == "companies":
-                company_name = intent_data["company_name"]
-                filters.append({
-                    "propertyName": "name",
-                    "operator": "CONTAINS_TOKEN",
-                    "value": company_name
-                })
-            elif "contact_name" in intent_data and object_type == "contacts":
-                contact_name = intent_data["contact_name"]
-                # Try to match against first or last name
-                filters.append({
-                    "propertyName": "firstname",
-                    "operator": "CONTAINS_TOKEN",
-                    "value": contact_name
-                })
-                
-            if filters:
-                search_data["filterGroups"][0]["filters"] = filters
-                endpoint = f"/crm/v3/objects/{object_type}/search"
-                response_dict = make_hubspot_request(endpoint, method="POST", data=search_data)
-                
-                result_count = len(response_dict.get('results', []))
-                if result_count > 0:
-                    if object_type == "companies":
-                        company_name = intent_data.get("company_name", "the company")
-                        response_message = f"Yes, I found {result_count} {'company' if result_count == 1 else 'companies'} matching '{company_name}'."
-                    else:
-                        contact_name = intent_data.get("contact_name", "the contact")
-                        response_message = f"Yes, I found {result_count} {'contact' if result_count == 1 else 'contacts'} matching '{contact_name}'."
-                else:
-                    if object_type == "companies":
-                        company_name = intent_data.get("company_name", "the company")
-                        response_message = f"No, I couldn't find any companies matching '{company_name}'."
-                    else:
-                        contact_name = intent_data.get("contact_name", "the contact")
-                        response_message = f"No, I couldn't find any contacts matching '{contact_name}'."
-                
-                return {
-                    "response": response_message,
-                    "data": response_dict
-                }
-        
-        # Handle filter intent
-        elif intent == "filter" and intent_data:
-            # If we have filter conditions, we'll use the search endpoint instead
-            search_data = {
-                "filterGroups": [{
-                    "filters": []
-                }],
-                "limit": limit
-            }
-            
-            # Add filters based on intent data
-            filters = []
-            if "industry" in intent_data and object_type == "companies":
-                filters.append({
-                    "propertyName": "industry",
-                    "operator": "CONTAINS_TOKEN",
-                    "value": intent_data["industry"]
-                })
-            if "email" in intent_data and object_type == "contacts":
-                filters.append({
-                    "propertyName": "email",
-                    "operator": "CONTAINS_TOKEN",
-                    "value": intent_data["email"]
-                })
-                
-            if filters:
-                search_data["filterGroups"][0]["filters"] = filters
-                endpoint = f"/crm/v3/objects/{object_type}/search"
-                response_dict = make_hubspot_request(endpoint, method="POST", data=search_data)
-                
-                result_count = len(response_dict.get('results', []))
-                response_message = f"Found {result_count} {object_type} matching your filter criteria."
-                
-                return {
-                    "response": response_message,
-                    "data": response_dict
-                }
-        
-        # Build query parameters
-        params = {
-            "limit": limit,
-            "archived": "false"
-        }
-        
-        # For contacts, only add properties if explicitly requested
-        # This matches the working curl command format
-        if object_type != "contacts" and properties:
-            params["properties"] = ",".join(properties)
-        
-        # Make API request to HubSpot
-        endpoint = f"/crm/v3/objects/{object_type}"
-        print(f"Making request to: {HUBSPOT_API_BASE}{endpoint} with params: {params}")
-        response_dict = make_hubspot_request(endpoint, params=params)
-        
-        # Generate a conversational response using Azure OpenAI
-        conversational_response, formatted_data = generate_conversational_response(request.query, response_dict, object_type)
+        # Return the data without the LLM summary if there is no time left to write one
+        try:
+            response_message = await deadline.run(describe_plan_result, request.query, plan, response_dict)
+        except DeadlineExceeded:
+            return FastJSONResponse({
+                "response": f"Found {len(response_dict.get('results', []))} {plan.object_type}.",
+                "data": response_dict,
+                "partial": True
+            })
         
-        return {
-            "response": conversational_response,
-            "data": formatted_data
-        }
+        # The HubSpot payload is passed through as-is, without pydantic validation or re-encoding
+        return validated_response(key, plan, etag, {
+            "response": response_message + stale_note(response_dict),
+            "data": response_dict
+        })
     except Exception as e:
         print(f"Error processing query: {e}")
         return {
@@ -504,47 +925,68 @@ async def process_query(request: QueryRequest):
             "data": None
         }
 
+def page_plan(plan: QueryPlan, after: str) -> QueryPlan:
+    """The page of a list or search plan that starts at a paging cursor"""
+    if plan.kind == "list":
+        return replace(plan, params=dict(plan.params, after=after))
+    return replace(plan, body=dict(plan.body, after=after))
+
+@app.post("/query/more")
+async def query_more(request: QueryPageRequest, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
+    """The next page of a /query result, fetched with the plan stored for the query.
+    
+    Only HubSpot is called: intent analysis and the LLM summary are not run again.
+    """
+    key = conditional_responses.key(tenant.tenant_id, "/query", request.dict(exclude={"after"}))
+    plan = conditional_responses.plan(key)
+    if plan is None:
+        raise HTTPException(status_code=410, detail="The query is no longer stored; run it again")
+    if plan.kind not in ("list", "search"):
+        raise HTTPException(status_code=400, detail=f"Results of {plan.kind} queries have no further pages")
+    page = page_plan(plan, request.after)
+    try:
+        # A stale page would repeat or skip records
+        response_dict = await deadline.run(make_hubspot_request, page.endpoint, method=page.method, params=page.params, data=page.body, allow_stale=False)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    if "error" in response_dict:
+        raise HTTPException(status_code=502, detail=response_dict["error"])
+    return FastJSONResponse(response_dict)
+
 @app.post("/search", response_model=QueryResponse)
-async def search_hubspot(request: QueryRequest):
+async def search_hubspot(request: QueryRequest, http_request: Request, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
     try:
-        # Analyze the intent of the query
-        intent, intent_data = analyze_query_intent(request.query)
-        
-        # Override object_type if specified in intent_data
-        object_type = intent_data.get("object_type", request.object_type.lower())
-        
-        # Use intent-based limit if available, otherwise use the request limit
-        if "limit" in intent_data:
-            limit = min(intent_data["limit"], 100)  # Cap at 100 for safety
-        else:
-            limit = min(request.limit, 100)  # Cap at 100 for safety
-            
-        search_query = request.query.lower()
-        
-        # Validate object type
-        if object_type not in ["contacts", "companies", "deals"]:
+        # Analyze the intent of the query and run the search, unless the results are unchanged
+        key = conditional_responses.key(tenant.tenant_id, "/search", request.dict())
+        try:
+            result = await fetch_or_revalidate(request, http_request, key, plan_search, deadline)
+        except ValueError as e:
             return {
-                "response": f"Invalid object_type: {object_type}. Must be one of: contacts, companies, deals",
+                "response": str(e),
                 "data": None
             }
-        
-        # Prepare search request data
-        search_data = {
-            "query": request.query,
-            "limit": limit
-        }
-        
-        # Make API request to HubSpot search endpoint
-        endpoint = f"/crm/v3/objects/{object_type}/search"
-        response_dict = make_hubspot_request(endpoint, method="POST", data=search_data)
+        except DeadlineExceeded:
+            return deadline_response(deadline)
+        if isinstance(result, Response):
+            return result
+        plan, response_dict, etag = result
         
         # Generate a conversational response using Azure OpenAI
-        conversational_response, formatted_data = generate_conversational_response(request.query, response_dict, object_type)
+        try:
+            conversational_response, formatted_data = await deadline.run(
+                generate_conversational_response, request.query, response_dict, plan.object_type
+            )
+        except DeadlineExceeded:
+            return FastJSONResponse({
+                "response": f"Found {len(response_dict.get('results', []))} {plan.object_type}.",
+                "data": response_dict,
+                "partial": True
+            })
         
-        return {
-            "response": conversational_response,
+        return validated_response(key, plan, etag, {
+            "response": conversational_response + stale_note(response_dict),
             "data": formatted_data
-        }
+        })
     except Exception as e:
         print(f"Error searching HubSpot: {e}")
         return {
@@ -552,198 +994,405 @@ async def search_hubspot(request: QueryRequest):
             "data": None
         }
 
+@app.get("/changes")
+async def list_changes(object_type: str = "contacts", since: Optional[str] = None, limit: int = 100, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
+    """Records modified since a sync token, oldest first, with the token for the next call.
+    
+    Start without a token to sync everything, then pass next_token back as since;
+    keep calling while has_more is true.
+    """
+    if object_type not in DEFAULT_PROPERTIES:
+        raise HTTPException(status_code=400, detail=f"Unsupported object type: {object_type}")
+    try:
+        return await deadline.run(changes_since, make_hubspot_request, object_type, since, DEFAULT_PROPERTIES[object_type], limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail=deadline.cancel_reason or "Request deadline exceeded")
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=f"HubSpot request failed: {e}")
+
+# Records through the connectors
+class RecordFilter(BaseModel):
+    property: str
+    operator: str = "eq"  # eq, neq, lt, lte, gt, gte or contains
+    value: Any = None
+
+class RecordSearchRequest(BaseModel):
+    query: Optional[str] = None
+    filters: List[RecordFilter] = []
+    properties: Optional[List[str]] = None
+    limit: int = 10
+    after: Optional[str] = None
+    # Page through results until this many records (at most CONNECTOR_MAX_RECORDS)
+    max_records: Optional[int] = None
+
+class BatchReadRequest(BaseModel):
+    ids: List[str]
+    properties: Optional[List[str]] = None
+
+async def connector_call(deadline: Deadline, connector_name: str, operation):
+    """Run a connector operation within the request deadline, mapping its failures to HTTP errors"""
+    try:
+        return await deadline.wait(operation)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail=deadline.cancel_reason or "Request deadline exceeded")
+    except ConnectorError as e:
+        headers = {"Retry-After": str(int(e.retry_after) + 1)} if e.retry_after else None
+        if isinstance(e, CallRejected):
+            # Not sent: out of time, our own rate budget or an open circuit, not an upstream response
+            raise HTTPException(status_code=e.status_code or 504, detail=str(e), headers=headers)
+        raise HTTPException(status_code=502, detail={"error": f"{connector_name} request failed: {e}", "status_code": e.status_code, "details": e.details}, headers=headers)
+
+def get_connector(connector_name: str, tenant: Tenant):
+    try:
+        return connector_registry.get(connector_name, tenant)
+    except UnknownConnector:
+        raise HTTPException(status_code=404, detail=f"Unknown connector: {connector_name}. Must be one of: {', '.join(connector_registry.names())}")
+
+def check_max_records(max_records: Optional[int]):
+    if max_records is not None and max_records < 1:
+        raise HTTPException(status_code=400, detail="max_records must be at least 1")
+
+async def collect_pages(pages, max_records: int) -> Dict[str, Any]:
+    results, total, after = [], None, None
+    async for page in pages:
+        results.extend(page.results)
+        total, after = page.total if page.total is not None else total, page.after
+    return {"results": results, "total": total, "next_after": after if len(results) >= max_records else None}
+
+@app.get("/connectors")
+async def list_connectors(tenant: Tenant = Depends(resolve_tenant)):
+    """Registered integrations and the object types each can read"""
+    return {"connectors": [connector_registry.get(name, tenant).describe() for name in connector_registry.names()]}
+
+@app.get("/records/{connector_name}/{object_type}")
+async def list_records(
+    connector_name: str,
+    object_type: str,
+    limit: int = 10,
+    after: Optional[str] = None,
+    properties: Optional[str] = None,
+    max_records: Optional[int] = None,
+    tenant: Tenant = Depends(resolve_tenant),
+    deadline: Deadline = Depends(request_deadline),
+):
+    """A page of records (properties comma-separated), or up to max_records across pages"""
+    check_max_records(max_records)
+    connector = get_connector(connector_name, tenant)
+    property_list = [p.strip() for p in properties.split(",") if p.strip()] if properties else None
+    if max_records is None:
+        page = await connector_call(deadline, connector_name, connector.list(object_type, property_list, limit, after))
+        return FastJSONResponse({"results": page.results, "total": page.total, "next_after": page.after})
+    max_records = min(max_records, CONNECTOR_MAX_RECORDS)
+    pages = connector.paginate(object_type, properties=property_list, page_size=connector.page_size(limit), max_records=max_records, after=after)
+    return FastJSONResponse(await connector_call(deadline, connector_name, collect_pages(pages, max_records)))
+
+@app.post("/records/{connector_name}/{object_type}/search")
+async def search_records(connector_name: str, object_type: str, request: RecordSearchRequest, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
+    """Records matching a text query and/or property filters"""
+    check_max_records(request.max_records)
+    connector = get_connector(connector_name, tenant)
+    filters = [SearchFilter(f.property, f.operator, f.value) for f in request.filters]
+    if request.max_records is None:
+        page = await connector_call(deadline, connector_name, connector.search(object_type, request.query, filters, request.properties, request.limit, request.after))
+        return FastJSONResponse({"results": page.results, "total": page.total, "next_after": page.after})
+    max_records = min(request.max_records, CONNECTOR_MAX_RECORDS)
+    pages = connector.paginate(object_type, request.query, filters, request.properties, connector.page_size(request.limit), max_records, request.after)
+    return FastJSONResponse(await connector_call(deadline, connector_name, collect_pages(pages, max_records)))
+
+@app.post("/records/{connector_name}/{object_type}/batch_read")
+async def batch_read_records(connector_name: str, object_type: str, request: BatchReadRequest, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
+    """Records by id, in the order given; ids that do not exist are left out"""
+    if len(request.ids) > CONNECTOR_MAX_RECORDS:
+        raise HTTPException(status_code=400, detail=f"At most {CONNECTOR_MAX_RECORDS} ids can be read at once")
+    connector = get_connector(connector_name, tenant)
+    results = await connector_call(deadline, connector_name, connector.batch_read(object_type, request.ids, request.properties))
+    return FastJSONResponse({"results": results})
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # Degraded while any upstream circuit is open or probing; stale results may be served
+    return {
+        "status": "degraded" if circuit_breakers.any_open() else "healthy",
+        "circuits": circuit_breakers.status(),
+        "last_known_good": last_known_good.stats()
+    }
+
+@app.get("/summaries")
+async def list_summaries(tenant: Tenant = Depends(resolve_tenant)):
+    """Refresh status and staleness of the portal's precomputed dashboard summaries"""
+    summary_store = summary_stores.get(tenant.tenant_id)
+    return summary_store.status() if summary_store is not None else {}
+
+@app.get("/metrics")
+async def metrics():
+    """Internal performance counters for tuning"""
+    return {
+        "query_planner": planner.stats(),
+        "speculation": speculator.stats(),
+        "intent_batching": intent_batcher.stats() if intent_batcher is not None else None,
+        "tool_cache": tool_cache.stats(),
+        "chat_prefetch": prefetcher.stats(),
+        "association_graph": {tenant_id: graph.stats() for tenant_id, graph in association_graphs.items()},
+        "summaries": {tenant_id: store.status() for tenant_id, store in summary_stores.items()},
+        "admission": admission_controller.stats(),
+        "tenants": tenant_registry.stats(),
+        "worker_pool": worker_scheduler.stats(),
+        "compression": compression.stats(),
+        "conditional_requests": conditional_responses.stats(),
+        "jobs": job_manager.stats(),
+        "connectors": connector_registry.stats(),
+    }
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def capture_profile(seconds: float = 10, interval_ms: float = 5, format: str = "collapsed", include_idle: bool = False):
+    """Sample this worker's stacks; collapsed stacks for flamegraph.pl/speedscope, or the top frames as JSON"""
+    if sampling_profiler.busy:
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    try:
+        profile = await run_in_threadpool(sampling_profiler.capture, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "json":
+        return {
+            "seconds": profile["seconds"],
+            "samples": profile["samples"],
+            "interval_ms": profile["interval_ms"],
+            "top_frames": top_frames(profile, include_idle=include_idle),
+        }
+    return PlainTextResponse(collapsed_stacks(profile, include_idle))
 
 # LangChain Agent Setup
 if LANGCHAIN_AVAILABLE:
     # Define HubSpot tools with enhanced capabilities
-    class HubSpotContactsTool(BaseTool):
-        name: str = "get_hubspot_contacts"
-        description: str = "Get contacts from HubSpot. Useful for finding contact information. You can search for specific contacts by name, email, or other properties."
+    class HubSpotObjectTool(BaseTool):
+        """Shared execution for the HubSpot object tools.
+        
+        Results are memoized per conversation and returned to the agent as compact,
+        token-budgeted observations instead of indented JSON.
+        """
+        object_type: str = ""
+        observation_fields: List[str] = []
+        conversation_id: Optional[str] = None
+        
+        @abstractmethod
+        def format_record(self, record: Dict[str, Any]) -> Dict[str, Any]:
+            """The fields of a HubSpot record shown to the agent"""
         
         def _run(self, limit: int = 25, query: str = None, properties: List[str] = None):
             try:
-                # Analyze query intent if provided
-                if query:
-                    # Use search endpoint with enhanced capabilities
-                    search_data = {"query": query, "limit": limit}
-                    
-                    # Check if we need to add specific filters
-                    if "@" in query:
-                        # Likely looking for a specific email
-                        search_data["filterGroups"] = [{
-                            "filters": [{
-                                "propertyName": "email",
-                                "operator": "CONTAINS_TOKEN",
-                                "value": query
-                            }]
-                        }]
-                    
-                    endpoint = "/crm/v3/objects/contacts/search"
-                    response = make_hubspot_request(endpoint, method="POST", data=search_data)
+                args = {"limit": limit, "query": query, "properties": properties}
+                turn = tool_cache.turn(self.conversation_id)
+                if turn is not None:
+                    turn.tool_calls += 1
+                
+                cached = tool_cache.get(self.conversation_id, self.name, args) if self.conversation_id else None
+                # Follow-up questions about entities from the previous turn are usually prefetched
+                prefetched = prefetcher.lookup(self.conversation_id, self.object_type, query) if cached is None and properties is None else None
+                if cached is not None:
+                    records, total = cached
+                    if turn is not None:
+                        turn.cache_hits += 1
+                elif prefetched is not None:
+                    records, total = prefetched
+                    records = records[:limit]
+                    if turn is not None:
+                        turn.cache_hits += 1
+                        turn.prefetch_hits += 1
                 else:
-                    # Use list endpoint with minimal parameters to match working curl command
-                    params = {"limit": limit, "archived": "false"}
+                    # Free-text queries use the search endpoint with filters derived from the text
+                    if query:
+                        plan = planner.plan("search", self.object_type, filters_from_text(self.object_type, query), limit, properties, text=query)
+                    else:
+                        plan = planner.plan("list", self.object_type, None, limit, properties)
+                        print(f"{self.__class__.__name__} making request to: {HUBSPOT_API_BASE}{plan.endpoint} with params: {plan.params}")
+                    response = execute_plan(plan)
+                    if turn is not None:
+                        turn.hubspot_calls += 1
                     
-                    # Don't add properties parameter for contacts as it may cause issues
-                    # This matches the working curl command format
-                    endpoint = "/crm/v3/objects/contacts"
-                    print(f"HubSpotContactsTool making request to: {HUBSPOT_API_BASE}{endpoint} with params: {params}")
-                    response = make_hubspot_request(endpoint, params=params)
+                    records = [self.format_record(record) for record in response.get("results", [])]
+                    total = response.get("total", len(records))
+                    # Failed requests are not memoized so the next call retries
+                    if self.conversation_id and "error" not in response:
+                        tool_cache.put(self.conversation_id, self.name, args, (records, total))
                 
-                # Format the response for better readability
-                results = response.get("results", [])
-                if results:
-                    formatted_results = []
-                    for contact in results:
-                        props = contact.get("properties", {})
-                        formatted_contact = {
-                            "id": contact.get("id"),
-                            "name": f"{props.get('firstname', '')} {props.get('lastname', '')}".strip(),
-                            "email": props.get("email", ""),
-                            "phone": props.get("phone", ""),
-                            "company": props.get("company", "")
-                        }
-                        formatted_results.append(formatted_contact)
-                    
-                    return json.dumps({"count": len(formatted_results), "contacts": formatted_results}, indent=2)
-                else:
-                    return json.dumps({"count": 0, "contacts": [], "message": "No contacts found"}, indent=2)
+                observation = format_observation(self.object_type, records, self.observation_fields, TOOL_OBSERVATION_TOKEN_BUDGET, total)
+                if turn is not None:
+                    turn.observations.append(observation)
+                    turn.returned.extend((self.object_type, record) for record in records)
+                    turn.observation_tokens += estimate_tokens(observation)
+                    turn.verbose_observation_tokens += estimate_tokens(verbose_observation(self.object_type, records))
+                return observation
             except Exception as e:
-                return f"Error retrieving contacts: {str(e)}"
+                return f"Error retrieving {self.object_type}: {str(e)}"
     
-    class HubSpotCompaniesTool(BaseTool):
+    class HubSpotContactsTool(HubSpotObjectTool):
+        name: str = "get_hubspot_contacts"
+        description: str = "Get contacts from HubSpot. Useful for finding contact information. You can search for specific contacts by name, email, or other properties."
+        object_type: str = "contacts"
+        observation_fields: List[str] = ["id", "name", "email", "phone", "company"]
+        
+        def format_record(self, contact: Dict[str, Any]) -> Dict[str, Any]:
+            props = contact.get("properties", {})
+            return {
+                "id": contact.get("id"),
+                "name": f"{props.get('firstname') or ''} {props.get('lastname') or ''}".strip(),
+                "email": props.get("email", ""),
+                "phone": props.get("phone", ""),
+                "company": props.get("company", "")
+            }
+    
+    class HubSpotCompaniesTool(HubSpotObjectTool):
         name: str = "get_hubspot_companies"
         description: str = "Get companies from HubSpot. Useful for finding company information. You can search for specific companies by name, domain, industry, or other properties."
+        object_type: str = "companies"
+        observation_fields: List[str] = ["id", "name", "domain", "industry", "website"]
         
-        def _run(self, limit: int = 25, query: str = None, properties: List[str] = None):
-            try:
-                # Analyze query intent if provided
-                if query:
-                    # Use search endpoint with enhanced capabilities
-                    search_data = {"query": query, "limit": limit}
-                    
-                    # Check if we need to add specific filters
-                    if ".com" in query or ".org" in query or ".net" in query:
-                        # Likely looking for a specific domain
-                        search_data["filterGroups"] = [{
-                            "filters": [{
-                                "propertyName": "domain",
-                                "operator": "CONTAINS_TOKEN",
-                                "value": query
-                            }]
-                        }]
-                    
-                    endpoint = "/crm/v3/objects/companies/search"
-                    response = make_hubspot_request(endpoint, method="POST", data=search_data)
-                else:
-                    # Use list endpoint with properties
-                    params = {"limit": limit, "archived": "false"}
-                    
-                    # Set default properties if not specified
-                    if not properties:
-                        properties = ["name", "domain", "industry", "website", "phone"]
-                    
-                    params["properties"] = ",".join(properties)
-                    endpoint = "/crm/v3/objects/companies"
-                    response = make_hubspot_request(endpoint, params=params)
-                
-                # Format the response for better readability
-                results = response.get("results", [])
-                if results:
-                    formatted_results = []
-                    for company in results:
-                        props = company.get("properties", {})
-                        formatted_company = {
-                            "id": company.get("id"),
-                            "name": props.get("name", ""),
-                            "domain": props.get("domain", ""),
-                            "industry": props.get("industry", ""),
-                            "website": props.get("website", "")
-                        }
-                        formatted_results.append(formatted_company)
-                    
-                    return json.dumps({"count": len(formatted_results), "companies": formatted_results}, indent=2)
-                else:
-                    return json.dumps({"count": 0, "companies": [], "message": "No companies found"}, indent=2)
-            except Exception as e:
-                return f"Error retrieving companies: {str(e)}"
+        def format_record(self, company: Dict[str, Any]) -> Dict[str, Any]:
+            props = company.get("properties", {})
+            return {
+                "id": company.get("id"),
+                "name": props.get("name", ""),
+                "domain": props.get("domain", ""),
+                "industry": props.get("industry", ""),
+                "website": props.get("website", "")
+            }
     
-    class HubSpotDealsTool(BaseTool):
+    class HubSpotDealsTool(HubSpotObjectTool):
         name: str = "get_hubspot_deals"
         description: str = "Get deals from HubSpot. Useful for finding deal information. You can search for specific deals by name, amount, stage, or other properties."
+        object_type: str = "deals"
+        observation_fields: List[str] = ["id", "name", "amount", "stage", "close_date"]
         
-        def _run(self, limit: int = 25, query: str = None, properties: List[str] = None):
+        def format_record(self, deal: Dict[str, Any]) -> Dict[str, Any]:
+            props = deal.get("properties", {})
+            return {
+                "id": deal.get("id"),
+                "name": props.get("dealname", ""),
+                "amount": props.get("amount", ""),
+                "stage": props.get("dealstage", ""),
+                "close_date": props.get("closedate", "")
+            }
+    
+    class HubSpotRelationshipsTool(BaseTool):
+        name: str = "get_hubspot_relationships"
+        description: str = (
+            "Find HubSpot records associated with other records, answered instantly from the association graph. "
+            "target_type is what to return (contacts, companies or deals); source_type is what they are associated with; "
+            "source_name optionally matches source records by name; via is an optional intermediate type. "
+            "min_amount and open_only filter deals on either end. "
+            "Examples: deals for contacts at Acme -> target_type=deals, source_type=companies, via=contacts, source_name=Acme. "
+            "Companies with open deals over $50k -> target_type=companies, source_type=deals, open_only=true, min_amount=50000."
+        )
+        conversation_id: Optional[str] = None
+        
+        def _run(self, target_type: str, source_type: str, source_name: str = None, via: str = None,
+                 min_amount: float = None, open_only: bool = False, limit: int = 25):
             try:
-                # Analyze query intent if provided
-                if query:
-                    # Use search endpoint with enhanced capabilities
-                    search_data = {"query": query, "limit": limit}
-                    
-                    # Check if we need to add specific filters
-                    if any(stage in query.lower() for stage in ["closed", "won", "lost", "negotiation", "proposal"]):
-                        # Likely looking for deals in a specific stage
-                        stage_map = {
-                            "closed won": "closed_won",
-                            "closed lost": "closed_lost",
-                            "negotiation": "negotiation",
-                            "proposal": "proposal"
-                        }
-                        
-                        for key, value in stage_map.items():
-                            if key in query.lower():
-                                search_data["filterGroups"] = [{
-                                    "filters": [{
-                                        "propertyName": "dealstage",
-                                        "operator": "EQ",
-                                        "value": value
-                                    }]
-                                }]
-                                break
-                    
-                    endpoint = "/crm/v3/objects/deals/search"
-                    response = make_hubspot_request(endpoint, method="POST", data=search_data)
-                else:
-                    # Use list endpoint with properties
-                    params = {"limit": limit, "archived": "false"}
-                    
-                    # Set default properties if not specified
-                    if not properties:
-                        properties = ["dealname", "amount", "dealstage", "closedate", "pipeline"]
-                    
-                    params["properties"] = ",".join(properties)
-                    endpoint = "/crm/v3/objects/deals"
-                    response = make_hubspot_request(endpoint, params=params)
+                turn = tool_cache.turn(self.conversation_id)
+                if turn is not None:
+                    turn.tool_calls += 1
                 
-                # Format the response for better readability
-                results = response.get("results", [])
-                if results:
-                    formatted_results = []
-                    for deal in results:
-                        props = deal.get("properties", {})
-                        formatted_deal = {
-                            "id": deal.get("id"),
-                            "name": props.get("dealname", ""),
-                            "amount": props.get("amount", ""),
-                            "stage": props.get("dealstage", ""),
-                            "close_date": props.get("closedate", "")
-                        }
-                        formatted_results.append(formatted_deal)
-                    
-                    return json.dumps({"count": len(formatted_results), "deals": formatted_results}, indent=2)
-                else:
-                    return json.dumps({"count": 0, "deals": [], "message": "No deals found"}, indent=2)
+                plan = planner.plan_related(target_type, {
+                    "related_to": source_type,
+                    "related_name": source_name,
+                    "via": via,
+                    "min_amount": min_amount,
+                    "open_only": open_only,
+                }, limit)
+                response = execute_plan(plan)
+                
+                records = []
+                for record in response.get("results", []):
+                    props = record.get("properties", {})
+                    if plan.object_type == "contacts":
+                        name, detail = f"{props.get('firstname') or ''} {props.get('lastname') or ''}".strip(), props.get("email")
+                    elif plan.object_type == "companies":
+                        name, detail = props.get("name"), props.get("domain")
+                    else:
+                        name, detail = props.get("dealname"), f"{props.get('amount') or '-'} / {props.get('dealstage') or '-'}"
+                    records.append({"id": record.get("id"), "name": name, "detail": detail})
+                
+                observation = format_observation(plan.object_type, records, ["id", "name", "detail"], TOOL_OBSERVATION_TOKEN_BUDGET, response.get("total"))
+                if turn is not None:
+                    turn.observations.append(observation)
+                    turn.returned.extend((plan.object_type, record) for record in records)
+                    turn.observation_tokens += estimate_tokens(observation)
+                    turn.verbose_observation_tokens += estimate_tokens(verbose_observation(plan.object_type, records))
+                return observation
             except Exception as e:
-                return f"Error retrieving deals: {str(e)}"
+                return f"Error retrieving relationships: {str(e)}"
+    
+    class HubSpotDashboardSummaryTool(BaseTool):
+        name: str = "get_dashboard_summary"
+        description: str = (
+            "Get a precomputed HubSpot dashboard summary instantly. Prefer this over other tools for these questions. "
+            "Available summaries: " + "; ".join(f"{name} ({definition.description})" for name, definition in summary_stores[tenant_registry.default_tenant_id].definitions.items())
+        )
+        
+        def _run(self, name: str):
+            summary_store = summary_stores.get(get_tenant().tenant_id)
+            summary = summary_store.get(name.strip()) if summary_store is not None else None
+            if summary is None:
+                return f"Summary '{name}' is not available yet. Use the other HubSpot tools instead."
+            freshness = " (stale)" if summary["stale"] else ""
+            return f"{summary['text']}\nComputed {summary['age_seconds']:.0f} seconds ago{freshness}."
+    
+    class DeadlineCallbackHandler(BaseCallbackHandler):
+        """Stops the agent before the next LLM call or tool run once the request is out of time or cancelled"""
+        raise_error: bool = True
+        
+        def __init__(self, deadline: Deadline):
+            self.deadline = deadline
+        
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.deadline.check()
+        
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.deadline.check()
+        
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.deadline.check()
+    
+    class LLMBreakerCallbackHandler(BaseCallbackHandler):
+        """Routes the agent's LLM calls through the provider's circuit breaker"""
+        raise_error: bool = True
+        
+        def __init__(self):
+            self.breaker = circuit_breakers.get(f"llm:{LLM_PROVIDER}")
+        
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.breaker.allow()
+        
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.breaker.allow()
+        
+        def on_llm_end(self, response, **kwargs):
+            self.breaker.record_success()
+        
+        def on_llm_error(self, error, **kwargs):
+            self.breaker.record_failure(str(error))
+    
+    # Helper function to create tool instances bound to a conversation's result cache
+    def create_tools(conversation_id: Optional[str] = None) -> List[BaseTool]:
+        """Create the agent tools, memoizing results for the given conversation"""
+        return [
+            HubSpotContactsTool(conversation_id=conversation_id),
+            HubSpotCompaniesTool(conversation_id=conversation_id),
+            HubSpotDealsTool(conversation_id=conversation_id),
+            HubSpotRelationshipsTool(conversation_id=conversation_id),
+            HubSpotDashboardSummaryTool()
+        ]
     
     # Create tools
-    tools = [
-        HubSpotContactsTool(),
-        HubSpotCompaniesTool(),
-        HubSpotDealsTool()
-    ]
+    tools = create_tools()
+    
+    # Record formatters of the object tools, applied to prefetched follow-up records
+    follow_up_formatters = {tool.object_type: tool.format_record for tool in tools if isinstance(tool, HubSpotObjectTool)}
     
     # Create system message with more detailed instructions
     system_message_content = """
@@ -753,6 +1402,7 @@ if LANGCHAIN_AVAILABLE:
     1. Contacts - Information about individuals in the CRM
     2. Companies - Business entities in the CRM
     3. Deals - Sales opportunities and their stages
+    4. Relationships - Contacts, companies and deals associated with each other
     
     When responding to user queries:
     - Understand the user's intent and use the appropriate tool to retrieve relevant information
@@ -767,6 +1417,7 @@ if LANGCHAIN_AVAILABLE:
     - "Show me deals in the negotiation stage"
     - "Is there a company named Fusion in our database?"
     - "Get me contact information for anyone with a gmail address"
+    - "Show me deals for contacts at Acme" (use the relationships tool instead of chaining several lookups)
     
     Remember to analyze the query intent and use the most appropriate tool with the right parameters.
     """
@@ -790,6 +1441,41 @@ if LANGCHAIN_AVAILABLE:
     
     # Dictionary to store conversation memories for different users
     conversation_memories = {}
+    
+    # Helper function to create an agent executor for a conversation
+    def create_agent_executor(scoped_conversation_id: str, max_execution_time: float) -> AgentExecutor:
+        """Agent executor with the conversation's memory and tool result cache"""
+        if scoped_conversation_id not in conversation_memories:
+            conversation_memories[scoped_conversation_id] = ConversationBufferMemory(return_messages=True)
+            print(f"Created new conversation memory for conversation {scoped_conversation_id}")
+        return AgentExecutor(
+            agent=agent,
+            tools=create_tools(scoped_conversation_id),
+            memory=conversation_memories[scoped_conversation_id],
+            verbose=True,
+            max_execution_time=max_execution_time
+        )
+
+# Helper function to format a single HubSpot record as a bullet line
+def format_record_line(object_type: str, record: Dict[str, Any]) -> str:
+    """Format a contact, company or deal as a one-line summary"""
+    props = record.get("properties", {})
+    if object_type == "contacts":
+        name = f"{props.get('firstname', '')} {props.get('lastname', '')}".strip()
+        email = props.get("email", "No email")
+        company = props.get("company", "")
+        phone = props.get("phone", "No phone")
+        return f"- {name} ({email}, {company}, {phone})"
+    if object_type == "companies":
+        name = props.get("name", "Unknown")
+        domain = props.get("domain", "No domain")
+        industry = props.get("industry", "Unknown industry")
+        return f"- {name} (Domain: {domain}, Industry: {industry})"
+    name = props.get("dealname", "Unnamed deal")
+    amount = props.get("amount", "Unknown amount")
+    stage = props.get("dealstage", "Unknown stage")
+    close_date = props.get("closedate", "No close date")
+    return f"- {name} (Amount: {amount}, Stage: {stage}, Close date: {close_date})"
 
 def natural_language_search(query: str) -> str:
     """Process a natural language query and search HubSpot for relevant information"""
@@ -797,184 +1483,47 @@ def natural_language_search(query: str) -> str:
         # Analyze the intent of the query
         intent, intent_data = analyze_query_intent(query)
         
-        # Set default response
-        response = "I couldn't understand what you're looking for. Please try to be more specific."
-        
-        if intent == "lookup" and "company_name" in intent_data:
-            # Looking up a specific company
-            company_name = intent_data["company_name"]
-            endpoint = "/crm/v3/objects/companies/search"
-            data = {
-                "filterGroups": [{
-                    "filters": [{
-                        "propertyName": "name",
-                        "operator": "CONTAINS_TOKEN",
-                        "value": company_name
-                    }]
-                }],
-                "properties": ["name", "domain", "industry", "website", "phone"],
-                "limit": 5
-            }
-            result = make_hubspot_request(endpoint, method="POST", data=data)
-            
-            if result.get("total", 0) > 0:
-                companies = result.get("results", [])
-                response = f"I found {len(companies)} companies matching '{company_name}':\n"
-                for company in companies:
-                    props = company.get("properties", {})
-                    name = props.get('name', 'Unknown')
-                    domain = props.get('domain', 'No domain')
-                    industry = props.get('industry', 'Unknown industry')
-                    response += f"- {name} (Domain: {domain}, Industry: {industry})\n"
+        # Work out which object type the query is about
+        object_type = intent_data.get("object_type")
+        if not object_type:
+            if "company_name" in intent_data:
+                object_type = "companies"
+            elif "contact_name" in intent_data:
+                object_type = "contacts"
             else:
-                response = f"I couldn't find any company matching '{company_name}'."
+                return "I couldn't understand what you're looking for. Please try to be more specific."
         
-        elif intent == "lookup" and "contact_name" in intent_data:
-            # Looking up a specific contact
-            contact_name = intent_data["contact_name"]
-            endpoint = "/crm/v3/objects/contacts/search"
-            data = {
-                "filterGroups": [{
-                    "filters": [{
-                        "propertyName": "firstname",
-                        "operator": "CONTAINS_TOKEN",
-                        "value": contact_name
-                    }]
-                }],
-                "properties": ["firstname", "lastname", "email", "phone", "company"],
-                "limit": 5
-            }
-            result = make_hubspot_request(endpoint, method="POST", data=data)
-            
-            if result.get("total", 0) > 0:
-                contacts = result.get("results", [])
-                response = f"I found {len(contacts)} contacts matching '{contact_name}':\n"
-                for contact in contacts:
-                    props = contact.get("properties", {})
-                    name = f"{props.get('firstname', '')} {props.get('lastname', '')}".strip()
-                    email = props.get("email", "No email")
-                    company = props.get("company", "")
-                    phone = props.get("phone", "No phone")
-                    response += f"- {name} ({email}, {company}, {phone})\n"
-            else:
-                response = f"I couldn't find any contacts matching '{contact_name}'."
+        limit = intent_data.get("limit", 5)
+        plan = planner.plan_from_intent(intent, intent_data, object_type, limit, DEFAULT_PROPERTIES.get(str(object_type).lower()))
+        result = execute_plan(plan)
         
-        elif intent == "list" and intent_data.get("object_type") == "deals":
-            # List deals, possibly filtered by stage
-            endpoint = "/crm/v3/objects/deals"
-            params = {
-                "limit": intent_data.get("limit", 5),
-                "properties": "dealname,amount,dealstage,closedate"
-            }
-            
-            # Add stage filter if specified
-            if "stage" in intent_data:
-                stage = intent_data["stage"]
-                endpoint = "/crm/v3/objects/deals/search"
-                params = {}
-                data = {
-                    "filterGroups": [{
-                        "filters": [{
-                            "propertyName": "dealstage",
-                            "operator": "EQ",
-                            "value": stage
-                        }]
-                    }],
-                    "properties": ["dealname", "amount", "dealstage", "closedate"],
-                    "limit": intent_data.get("limit", 5)
-                }
-                result = make_hubspot_request(endpoint, method="POST", data=data)
-            else:
-                result = make_hubspot_request(endpoint, params=params)
-            
-            if result.get("total", 0) > 0 or len(result.get("results", [])) > 0:
-                deals = result.get("results", [])
-                response = f"I found {len(deals)} deals:\n"
-                for deal in deals:
-                    props = deal.get("properties", {})
-                    name = props.get("dealname", "Unnamed deal")
-                    amount = props.get("amount", "Unknown amount")
-                    stage = props.get("dealstage", "Unknown stage")
-                    close_date = props.get("closedate", "No close date")
-                    response += f"- {name} (Amount: {amount}, Stage: {stage}, Close date: {close_date})\n"
-            else:
-                response = "I couldn't find any deals matching your criteria."
+        records = result.get("results", [])
+        if not records:
+            target_keys = [key for key in LOOKUP_TARGET_KEYS if key in plan.filters]
+            if target_keys:
+                return f"I couldn't find any {plan.object_type} matching '{plan.filters[target_keys[0]]}'."
+            return f"I couldn't find any {plan.object_type} matching your criteria."
         
-        elif intent == "list" and intent_data.get("object_type") in ["contacts", "companies"]:
-            # List contacts or companies, possibly filtered
-            object_type = intent_data.get("object_type")
-            endpoint = f"/crm/v3/objects/{object_type}"
-            params = {
-                "limit": intent_data.get("limit", 5)
-            }
-            
-            # Set properties based on object type
-            if object_type == "contacts":
-                params["properties"] = "firstname,lastname,email,phone,company"
-            else:  # companies
-                params["properties"] = "name,domain,industry,website,phone"
-            
-            # Add filters if specified
-            filters = []
-            if "industry" in intent_data and object_type == "companies":
-                filters.append({
-                    "propertyName": "industry",
-                    "operator": "CONTAINS_TOKEN",
-                    "value": intent_data["industry"]
-                })
-            
-            if "email" in intent_data and object_type == "contacts":
-                filters.append({
-                    "propertyName": "email",
-                    "operator": "CONTAINS_TOKEN",
-                    "value": intent_data["email"]
-                })
-            
-            if filters:
-                endpoint = f"/crm/v3/objects/{object_type}/search"
-                params = {}
-                data = {
-                    "filterGroups": [{
-                        "filters": filters
-                    }],
-                    "limit": intent_data.get("limit", 5)
-                }
-                
-                # Set properties based on object type
-                if object_type == "contacts":
-                    data["properties"] = ["firstname", "lastname", "email", "phone", "company"]
-                else:  # companies
-                    data["properties"] = ["name", "domain", "industry", "website", "phone"]
-                
-                result = make_hubspot_request(endpoint, method="POST", data=data)
-            else:
-                result = make_hubspot_request(endpoint, params=params)
-            
-            if result.get("total", 0) > 0 or len(result.get("results", [])) > 0:
-                items = result.get("results", [])
-                response = f"I found {len(items)} {object_type}:\n"
-                
-                for item in items:
-                    props = item.get("properties", {})
-                    if object_type == "contacts":
-                        name = f"{props.get('firstname', '')} {props.get('lastname', '')}".strip()
-                        email = props.get("email", "No email")
-                        company = props.get("company", "")
-                        response += f"- {name} ({email}, {company})\n"
-                    else:  # companies
-                        name = props.get("name", "Unknown")
-                        industry = props.get("industry", "Unknown industry")
-                        domain = props.get("domain", "No domain")
-                        response += f"- {name} (Industry: {industry}, Domain: {domain})\n"
-            else:
-                response = f"I couldn't find any {object_type} matching your criteria."
+        target_keys = [key for key in LOOKUP_TARGET_KEYS if key in plan.filters]
+        if target_keys:
+            response = f"I found {len(records)} {plan.object_type} matching '{plan.filters[target_keys[0]]}':\n"
+        else:
+            response = f"I found {len(records)} {plan.object_type}:\n"
+        for record in records:
+            response += format_record_line(plan.object_type, record) + "\n"
         
         return response
     except Exception as e:
         return f"Error processing your query: {str(e)}"
 
+# Helper function to answer from the tool results gathered before the agent ran out of time
+def partial_agent_response(observations: List[str]) -> str:
+    if not observations:
+        return "I ran out of time before I could look anything up. Please try a simpler question."
+    return "I ran out of time before finishing, but here's what I found so far:\n\n" + "\n\n".join(observations)
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest):
+async def chat_with_agent(request: ChatRequest, tenant: Tenant = Depends(resolve_tenant), deadline: Deadline = Depends(request_deadline)):
     """Chat with the LangChain agent to query HubSpot data conversationally"""
     conversation_id = request.conversation_id or f"conv_{len(conversation_memories) + 1}"
     
@@ -986,24 +1535,38 @@ async def chat_with_agent(request: ChatRequest):
         }
     
     try:
-        # Get or create conversation memory for this user
-        if conversation_id not in conversation_memories:
-            conversation_memories[conversation_id] = ConversationBufferMemory(return_messages=True)
-            print(f"Created new conversation memory for conversation {conversation_id}")
-        
-        # Create a new agent executor with this conversation's memory
-        user_agent_executor = AgentExecutor(
-            agent=agent,
-            tools=tools,
-            memory=conversation_memories[conversation_id],
-            verbose=True
-        )
+        # Create an agent executor with this conversation's memory and tool result cache
+        # Conversations and their tool results are kept separate per portal
+        scoped_conversation_id = tenant.namespace(conversation_id)
+        user_agent_executor = create_agent_executor(scoped_conversation_id, deadline.budget(AGENT_BUDGET_FRACTION))
         
         # Log the incoming message for debugging
         print(f"Processing message from conversation {conversation_id}: {request.message}")
         
-        # Run the agent with the user's message
-        response = user_agent_executor.run(request.message)
+        # Run the agent with the user's message, stopping between steps once the deadline passes
+        turn = tool_cache.begin_turn(scoped_conversation_id)
+        partial = None
+        try:
+            response = await deadline.run(user_agent_executor.run, request.message, callbacks=[DeadlineCallbackHandler(deadline), LLMBreakerCallbackHandler()])
+            if response.startswith("Agent stopped due to"):
+                response, partial = partial_agent_response(turn.observations), True
+        except DeadlineExceeded:
+            if deadline.cancelled:
+                print(f"Conversation {conversation_id} cancelled: {deadline.cancel_reason}")
+            response, partial = partial_agent_response(turn.observations), True
+        finally:
+            turn_stats = tool_cache.end_turn(scoped_conversation_id)
+        print(f"Turn tool usage for conversation {conversation_id}: {json.dumps(turn_stats)}")
+        
+        # Warm the data the next question is likely to ask about while the user reads this answer
+        if not partial:
+            prefetcher.after_turn(
+                scoped_conversation_id,
+                turn.returned,
+                lambda endpoint, **kwargs: make_hubspot_request(endpoint, tenant=tenant, **kwargs),
+                association_graphs.get(tenant),
+                follow_up_formatters,
+            )
         
         # Log the response for debugging
         print(f"Agent response: {response[:100]}..." if len(response) > 100 else f"Agent response: {response}")
@@ -1023,6 +1586,16 @@ async def chat_with_agent(request: ChatRequest):
         return {
             "response": response,
             "data": data,
+            "conversation_id": conversation_id,
+            "turn_stats": turn_stats,
+            "partial": partial
+        }
+    except CircuitOpen as e:
+        # The LLM provider is down; answer with the rule-based search instead of retrying the agent
+        print(f"Skipping LangChain agent: {e}")
+        return {
+            "response": f"The AI assistant is temporarily unavailable, so I'm using a simpler search to answer your question: {natural_language_search(request.message)}",
+            "data": None,
             "conversation_id": conversation_id
         }
     except Exception as e:
@@ -1061,6 +1634,272 @@ async def chat_with_agent(request: ChatRequest):
                 "conversation_id": conversation_id
             }
 
+# Asynchronous jobs: long-running queries, agent runs and exports on a bounded worker pool
+JOB_EXPORT_MAX_RECORDS = int(os.getenv("JOB_EXPORT_MAX_RECORDS", "10000"))
+
+class JobRequest(BaseModel):
+    kind: str = "query"  # query, search, chat or export
+    query: Optional[str] = None
+    object_type: str = "contacts"
+    limit: int = 25
+    properties: Optional[List[str]] = None
+    # chat: the conversation to continue; a new one is started without it
+    conversation_id: Optional[str] = None
+    # export: stop after this many records
+    max_records: Optional[int] = None
+
+def run_query_job(ctx: JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """A /query or /search request; the HubSpot data is published before the LLM summary"""
+    request = QueryRequest(query=params["query"], object_type=params["object_type"], limit=params["limit"], properties=params["properties"])
+    search = ctx.job.kind == "search"
+    
+    ctx.report(0, 3, "Analyzing the query")
+    intent, intent_data = analyze_query_intent(request.query)
+    plan = (plan_search if search else plan_query)(request, intent, intent_data)
+    ctx.check()
+    
+    ctx.report(1, 3, f"Fetching {plan.object_type}")
+    response_dict = execute_plan(plan)
+    ctx.emit(response_dict)
+    ctx.check()
+    
+    ctx.report(2, 3, "Summarizing")
+    if search:
+        message, data = generate_conversational_response(request.query, response_dict, plan.object_type)
+    else:
+        message, data = describe_plan_result(request.query, plan, response_dict), response_dict
+    ctx.report(3, 3, "Done")
+    return {"response": message + stale_note(response_dict), "data": data}
+
+def run_export_job(ctx: JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Page through every record matching the query (all records without one), publishing each page"""
+    max_records = max(1, min(params.get("max_records") or JOB_EXPORT_MAX_RECORDS, JOB_EXPORT_MAX_RECORDS))
+    if params.get("query"):
+        ctx.report(0, None, "Analyzing the query")
+        intent, intent_data = analyze_query_intent(params["query"])
+        plan = planner.plan_from_intent(intent, dict(intent_data, limit=MAX_LIMIT), params["object_type"], MAX_LIMIT, params.get("properties"))
+    else:
+        plan = planner.plan("list", params["object_type"], None, MAX_LIMIT, params.get("properties"))
+    paged = plan.kind in ("list", "search")
+    
+    exported, total, page = 0, None, plan
+    while True:
+        ctx.check()
+        if paged:
+            # Every page must be current; a stale page would leave gaps in the export
+            response = make_hubspot_request(page.endpoint, method=page.method, params=page.params, data=page.body, allow_stale=False)
+        else:
+            response = execute_plan(page)
+        if "error" in response:
+            raise RuntimeError(f"HubSpot request failed after {exported} records: {response['error']}")
+        
+        records = response.get("results", [])[:max_records - exported]
+        exported += len(records)
+        total = response.get("total", total)
+        if records:
+            ctx.emit(records)
+        ctx.report(exported, min(total, max_records) if total is not None else None, f"Exported {exported} {plan.object_type}")
+        
+        after = response.get("paging", {}).get("next", {}).get("after")
+        if not paged or not after or exported >= max_records:
+            break
+        page = page_plan(plan, after)
+    return {"object_type": plan.object_type, "exported": exported, "total": total, "truncated": bool(paged and after)}
+
+# Bulk upserts: uploaded CSV/NDJSON files written through HubSpot's batch upsert endpoints
+BULK_MAX_UPLOAD_BYTES = int(os.getenv("BULK_MAX_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+
+def run_bulk_upsert_job(ctx: JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Upsert an uploaded file in batches, publishing rejected rows as they are found"""
+    reported = [0]
+    
+    def on_error(row: int, record_id: Optional[str], message: str):
+        if reported[0] < BULK_MAX_REPORTED_ERRORS:
+            reported[0] += 1
+            ctx.emit({"row": row, "id": record_id, "error": message})
+    
+    def on_progress(stats: Dict[str, Any]):
+        ctx.report(stats["committed_row"], None, f"Committed through row {stats['committed_row']}: {stats['upserted']} upserted, {stats['row_errors']} rejected")
+    
+    upserter = BulkUpserter(
+        make_hubspot_request,
+        params["object_type"],
+        id_property=params.get("id_property"),
+        concurrency=BULK_CONCURRENCY,
+        on_error=on_error,
+        on_progress=on_progress,
+        check=ctx.check,
+    )
+    try:
+        with open(params["upload"], newline="", encoding="utf-8-sig") as lines:
+            stats = upserter.run(iter_rows(lines, params["format"]), resume_from_row=params.get("resume_from_row") or 0)
+    finally:
+        # Rerun from committed_row by uploading the file again with resume_from_row
+        os.remove(params["upload"])
+    return dict(stats, errors_reported=reported[0], errors_truncated=stats["row_errors"] > reported[0])
+
+job_handlers = {"query": run_query_job, "search": run_query_job, "export": run_export_job, "bulk_upsert": run_bulk_upsert_job}
+
+if LANGCHAIN_AVAILABLE:
+    class JobProgressCallbackHandler(BaseCallbackHandler):
+        """Reports each agent tool call as job progress and publishes its observation"""
+        
+        def __init__(self, ctx: JobContext):
+            self.ctx = ctx
+            self.steps = 0
+            self.tool = None
+        
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.steps += 1
+            self.tool = (serialized or {}).get("name")
+            self.ctx.report(self.steps, None, f"Running {self.tool}")
+        
+        def on_tool_end(self, output, **kwargs):
+            self.ctx.emit({"tool": self.tool, "observation": str(output)})
+    
+    def run_chat_job(ctx: JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+        """An agent turn limited by the job's time limit instead of the request deadline"""
+        conversation_id = params.get("conversation_id") or f"job_{ctx.job.job_id}"
+        scoped_conversation_id = get_tenant().namespace(conversation_id)
+        executor = create_agent_executor(scoped_conversation_id, ctx.deadline.budget(AGENT_BUDGET_FRACTION))
+        
+        turn = tool_cache.begin_turn(scoped_conversation_id)
+        partial = None
+        try:
+            response = executor.run(params["query"], callbacks=[DeadlineCallbackHandler(ctx.deadline), LLMBreakerCallbackHandler(), JobProgressCallbackHandler(ctx)])
+            if response.startswith("Agent stopped due to"):
+                response, partial = partial_agent_response(turn.observations), True
+        except DeadlineExceeded:
+            if ctx.deadline.cancelled:
+                raise
+            response, partial = partial_agent_response(turn.observations), True
+        finally:
+            turn_stats = tool_cache.end_turn(scoped_conversation_id)
+        return {"response": response, "conversation_id": conversation_id, "turn_stats": turn_stats, "partial": partial}
+    
+    job_handlers["chat"] = run_chat_job
+
+job_manager = JobManager(
+    job_handlers,
+    JobStore(os.getenv("JOB_RESULTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_results"))),
+    max_workers=int(os.getenv("JOB_WORKERS", "2")),
+    max_queued=int(os.getenv("JOB_MAX_QUEUED", "100")),
+    timeout_seconds=float(os.getenv("JOB_TIMEOUT_SECONDS", "900")),
+    ttl_seconds=float(os.getenv("JOB_RESULT_TTL_SECONDS", "86400")),
+    kind_timeouts={"bulk_upsert": float(os.getenv("BULK_JOB_TIMEOUT_SECONDS", "7200"))},
+    # Jobs run in worker threads with the portal they were submitted for
+    prepare=lambda job: current_tenant.set(tenant_registry.get(job.tenant_id)),
+)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest, response: Response, tenant: Tenant = Depends(resolve_tenant)):
+    """Submit a long-running query, search, agent run (chat) or export; poll or stream it from /jobs/{job_id}"""
+    if request.kind == "bulk_upsert":
+        raise HTTPException(status_code=400, detail="Bulk upserts take a file; POST it to /bulk/{object_type}")
+    if request.kind != "export" and not (request.query or "").strip():
+        raise HTTPException(status_code=400, detail=f"A query is required for {request.kind} jobs")
+    try:
+        job = job_manager.submit(request.kind, request.dict(exclude={"kind"}), tenant.tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Too many jobs waiting: {e}", headers={"Retry-After": "30"})
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+    return job.summary()
+
+@app.get("/jobs")
+async def list_jobs(tenant: Tenant = Depends(resolve_tenant)):
+    """The portal's jobs, newest first"""
+    return {"jobs": [job.summary() for job in job_manager.list_jobs(tenant.tenant_id)]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, offset: int = 0, tenant: Tenant = Depends(resolve_tenant)):
+    """Status and progress of a job, its partial results from offset on, and the result once finished"""
+    job = job_manager.get(job_id, tenant.tenant_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return FastJSONResponse(job.to_dict(max(0, offset)))
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, offset: int = 0, tenant: Tenant = Depends(resolve_tenant)):
+    """Newline-delimited JSON events: progress, each partial result as it is published, then the outcome"""
+    job = job_manager.get(job_id, tenant.tenant_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def lines():
+        async for event in job_manager.events(job, max(0, offset)):
+            yield encode_envelope(event) + b"\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, tenant: Tenant = Depends(resolve_tenant)):
+    """Cancel a queued or running job, or delete a finished one and its stored result"""
+    job = job_manager.get(job_id, tenant.tenant_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    queued = job.status == QUEUED
+    job_manager.cancel(job)
+    if queued and job.kind == "bulk_upsert" and job.status == CANCELLED and job.started_at is None:
+        # The job never ran, so its upload was never read (or removed)
+        os.remove(job.params["upload"])
+    return job.summary()
+
+# Uploads waiting for their bulk upsert job; jobs interrupted by a restart are failed, so none survive one
+BULK_UPLOAD_DIR = os.path.join(job_manager.store.directory, "uploads")
+shutil.rmtree(BULK_UPLOAD_DIR, ignore_errors=True)
+os.makedirs(BULK_UPLOAD_DIR, exist_ok=True)
+
+# Writes need proof of access: the portal's own access key, or the admin key for a portal open to everyone
+async def require_write_access(request: Request, tenant: Tenant = Depends(resolve_tenant)) -> Tenant:
+    if tenant.open_access and not is_admin(request, ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="Writing to HubSpot requires the portal's access key (X-Portal-Key) or the admin key (X-Admin-Key)")
+    return tenant
+
+@app.post("/bulk/{object_type}", status_code=202)
+async def bulk_upsert(
+    object_type: str,
+    http_request: Request,
+    response: Response,
+    format: Optional[str] = None,
+    id_property: Optional[str] = None,
+    resume_from_row: int = 0,
+    tenant: Tenant = Depends(require_write_access),
+):
+    """Upsert the CSV or NDJSON request body as a job; rejected rows are its partial results"""
+    if object_type not in HubSpotConnector.object_types:
+        raise HTTPException(status_code=400, detail=f"Unsupported object type: {object_type}. Must be one of: {', '.join(HubSpotConnector.object_types)}")
+    if not (id_property or ID_PROPERTIES.get(object_type)):
+        raise HTTPException(status_code=400, detail=f"{object_type} have no natural unique property; pass id_property")
+    content_type = http_request.headers.get("content-type", "")
+    input_format = format or ("csv" if "csv" in content_type else "ndjson")
+    if input_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    
+    # Stream the body to disk; the file is read back row by row by the job
+    upload = os.path.join(BULK_UPLOAD_DIR, f"{secrets.token_urlsafe(12)}.{input_format}")
+    size = 0
+    try:
+        with open(upload, "wb") as f:
+            async for chunk in http_request.stream():
+                size += len(chunk)
+                if size > BULK_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Uploads are limited to {BULK_MAX_UPLOAD_BYTES} bytes; use bulk_upsert.py for larger files")
+                await run_in_threadpool(f.write, chunk)
+        params = {"object_type": object_type, "format": input_format, "id_property": id_property, "resume_from_row": max(0, resume_from_row), "upload": upload, "bytes": size}
+        job = job_manager.submit("bulk_upsert", params, tenant.tenant_id)
+    except JobQueueFull as e:
+        os.remove(upload)
+        raise HTTPException(status_code=429, detail=f"Too many jobs waiting: {e}", headers={"Retry-After": "30"})
+    except BaseException:
+        os.remove(upload)
+        raise
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+    return job.summary()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("simple_server:app", host="0.0.0.0", port=8000, reload=True)
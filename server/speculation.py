@@ -0,0 +1,134 @@
+# Speculative HubSpot prefetch
+# Starts the HubSpot request predicted by the rule-based intent analysis while the LLM
+# intent analysis is still running. The result is used if the LLM arrives at the same
+# request plan and discarded otherwise.
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import contextvars
+import threading
+import time
+
+from query_planner import QueryPlan
+
+# Number of outcomes recorded for an intent before its hit rate is used to gate speculation
+WARMUP_SAMPLES = 20
+
+
+class Speculation:
+    """A speculative HubSpot request that is in flight"""
+
+    def __init__(self, plan: QueryPlan, future: Future, started_at: float):
+        self.plan = plan
+        self.future = future
+        self.started_at = started_at
+        self.finished_at: Optional[float] = None
+
+
+class SpeculativePrefetcher:
+    """Runs predicted HubSpot requests in parallel with LLM intent analysis"""
+
+    def __init__(self, max_workers: int = 8, min_hit_rate: float = 0.3, probe_every: int = 10, enabled: bool = True):
+        self.enabled = enabled
+        self.min_hit_rate = min_hit_rate
+        self.probe_every = probe_every
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.wasted_requests = 0
+        self.saved_seconds = 0.0
+        # Per-intent [hits, misses, skipped-since-last-probe] used to gate speculation
+        self._by_intent: Dict[str, list] = {}
+
+    def should_speculate(self, plan: QueryPlan) -> bool:
+        """Skip intents whose guesses are rarely confirmed, probing occasionally to recover"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            hits, misses, skipped = self._by_intent.setdefault(plan.intent, [0, 0, 0])
+            samples = hits + misses
+            if samples < WARMUP_SAMPLES or hits / samples >= self.min_hit_rate:
+                return True
+            if skipped + 1 >= self.probe_every:
+                self._by_intent[plan.intent][2] = 0
+                return True
+            self._by_intent[plan.intent][2] = skipped + 1
+            self.skipped += 1
+            return False
+
+    def start(self, plan: QueryPlan, fetch: Callable[[QueryPlan], Dict[str, Any]]) -> Optional[Speculation]:
+        """Kick off the HubSpot request for a guessed plan"""
+        if not self.should_speculate(plan):
+            return None
+
+        speculation = Speculation(plan, None, time.monotonic())
+
+        def run() -> Dict[str, Any]:
+            try:
+                return fetch(plan)
+            finally:
+                speculation.finished_at = time.monotonic()
+
+        # Run in the caller's context so the request deadline applies to the speculative call
+        speculation.future = self._executor.submit(contextvars.copy_context().run, run)
+        with self._lock:
+            self.attempts += 1
+        return speculation
+
+    async def resolve(
+        self,
+        speculation: Optional[Speculation],
+        plan: Optional[QueryPlan],
+        intent_finished_at: float,
+    ) -> Optional[Dict[str, Any]]:
+        """Return the speculative result if it matches the confirmed plan, otherwise None"""
+        if speculation is None:
+            return None
+
+        hit = plan is not None and speculation.plan.key() == plan.key()
+        with self._lock:
+            counts = self._by_intent.setdefault(speculation.plan.intent, [0, 0, 0])
+            if hit:
+                self.hits += 1
+                counts[0] += 1
+            else:
+                self.misses += 1
+                counts[1] += 1
+
+        if not hit:
+            # Drop the request if it has not started yet; a running one is simply ignored
+            if not speculation.future.cancel():
+                with self._lock:
+                    self.wasted_requests += 1
+            return None
+
+        result = await asyncio.wrap_future(speculation.future)
+        # Latency saved is the part of the fetch that overlapped with intent analysis
+        overlap = min(speculation.finished_at or intent_finished_at, intent_finished_at) - speculation.started_at
+        with self._lock:
+            self.saved_seconds += max(0.0, overlap)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate and saved-latency metrics"""
+        with self._lock:
+            decided = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": round(self.hits / decided, 3) if decided else None,
+                "wasted_requests": self.wasted_requests,
+                "saved_seconds_total": round(self.saved_seconds, 3),
+                "saved_ms_per_hit": round(self.saved_seconds * 1000 / self.hits, 1) if self.hits else None,
+                "by_intent": {
+                    intent: {"hits": counts[0], "misses": counts[1]}
+                    for intent, counts in self._by_intent.items()
+                },
+            }
@@ -0,0 +1,288 @@
+# Precomputed dashboard summaries
+# A background scheduler periodically computes a configurable set of named summaries
+# from HubSpot (pipeline totals by stage, new contacts in the last 7 days, top industries) so
+# the questions that dominate traffic are answered without an LLM or live API round trip.
+
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import asyncio
+import random
+import re
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+Fetch = Callable[..., Dict[str, Any]]
+
+# A summary is reported as stale once it is older than this many refresh intervals
+STALE_AFTER_INTERVALS = 2
+
+
+class SummaryDefinition:
+    """A named summary, the questions it answers and how often to recompute it.
+
+    jitter is the fraction of the interval by which each refresh is moved at random.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        patterns: List[str],
+        compute: Callable[[], Dict[str, Any]],
+        describe: Callable[[Dict[str, Any]], str],
+        interval_seconds: float = 300,
+        jitter: float = 0.1,
+    ):
+        self.name = name
+        self.description = description
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.compute = compute
+        self.describe = describe
+        self.interval_seconds = interval_seconds
+        self.jitter = jitter
+
+    def matches(self, query: str) -> bool:
+        lowered = " ".join(query.lower().split()).rstrip("?.! ")
+        return any(pattern.search(lowered) for pattern in self.patterns)
+
+    def next_delay(self) -> float:
+        """Refresh interval with random jitter so summaries don't all hit HubSpot at once"""
+        spread = self.interval_seconds * self.jitter
+        return max(1.0, self.interval_seconds + random.uniform(-spread, spread))
+
+
+class SummaryStore:
+    """Latest computed value of each summary, with staleness reporting"""
+
+    def __init__(self, definitions: Iterable[SummaryDefinition]):
+        self.definitions: Dict[str, SummaryDefinition] = {definition.name: definition for definition in definitions}
+        self._results: Dict[str, Dict[str, Any]] = {}
+
+    def match(self, query: str) -> Optional[SummaryDefinition]:
+        """The summary that answers this question, if any"""
+        for definition in self.definitions.values():
+            if definition.matches(query):
+                return definition
+        return None
+
+    def record(self, name: str, value: Optional[Dict[str, Any]], duration: float, error: Optional[str] = None):
+        previous = self._results.get(name, {})
+        if value is None:
+            # Keep serving the last good value; only the error is updated
+            self._results[name] = dict(previous, error=error, last_error_at=time.time())
+            return
+        self._results[name] = {
+            "value": value,
+            "computed_at": time.time(),
+            "compute_seconds": round(duration, 3),
+            "error": None,
+        }
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """The summary value with its age and staleness, or None if never computed"""
+        definition = self.definitions.get(name)
+        result = self._results.get(name)
+        if definition is None or result is None or "value" not in result:
+            return None
+        age = time.time() - result["computed_at"]
+        return dict(
+            result,
+            name=name,
+            age_seconds=round(age, 1),
+            stale=age > definition.interval_seconds * STALE_AFTER_INTERVALS,
+            text=definition.describe(result["value"]),
+        )
+
+    def status(self) -> Dict[str, Any]:
+        """Refresh status of every summary, for monitoring"""
+        status = {}
+        for name, definition in self.definitions.items():
+            result = self._results.get(name, {})
+            current = self.get(name)
+            status[name] = {
+                "description": definition.description,
+                "interval_seconds": definition.interval_seconds,
+                "available": current is not None,
+                "age_seconds": current["age_seconds"] if current else None,
+                "stale": current["stale"] if current else None,
+                "compute_seconds": result.get("compute_seconds"),
+                "error": result.get("error"),
+            }
+        return status
+
+
+class SummaryScheduler:
+    """Runs one asyncio refresh loop per summary inside the FastAPI app"""
+
+    def __init__(self, store: SummaryStore):
+        self.store = store
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for definition in self.store.definitions.values():
+            self._tasks.append(asyncio.create_task(self._run(definition), name=f"summary:{definition.name}"))
+        print(f"Started dashboard summary scheduler for: {', '.join(self.store.definitions) or 'no summaries'}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def refresh(self, definition: SummaryDefinition):
+        started = time.monotonic()
+        try:
+            value = await run_in_threadpool(definition.compute)
+            self.store.record(definition.name, value, time.monotonic() - started)
+        except Exception as e:
+            print(f"Error computing summary {definition.name}: {e}")
+            self.store.record(definition.name, None, time.monotonic() - started, str(e))
+
+    async def _run(self, definition: SummaryDefinition):
+        # Spread the first refreshes over the jitter window as well
+        await asyncio.sleep(random.uniform(0, definition.interval_seconds * definition.jitter))
+        while True:
+            await self.refresh(definition)
+            await asyncio.sleep(definition.next_delay())
+
+
+# Built-in summaries
+
+def _page_all(fetch: Fetch, object_type: str, properties: List[str], max_records: int) -> Iterable[Dict[str, Any]]:
+    """Iterate over records of an object type through the list endpoint"""
+    params = {"limit": 100, "archived": "false", "properties": ",".join(properties)}
+    seen = 0
+    while True:
+        response = fetch(f"/crm/v3/objects/{object_type}", params=params)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        for record in response.get("results", []):
+            yield record
+            seen += 1
+        after = response.get("paging", {}).get("next", {}).get("after")
+        if not after or seen >= max_records:
+            return
+        params = dict(params, after=after)
+
+
+def pipeline_by_stage(fetch: Fetch, max_records: int) -> Dict[str, Any]:
+    stages: Dict[str, Dict[str, float]] = {}
+    for deal in _page_all(fetch, "deals", ["amount", "dealstage"], max_records):
+        props = deal.get("properties", {})
+        stage = props.get("dealstage") or "unknown"
+        try:
+            amount = float(props.get("amount") or 0)
+        except (TypeError, ValueError):
+            amount = 0.0
+        totals = stages.setdefault(stage, {"count": 0, "amount": 0.0})
+        totals["count"] += 1
+        totals["amount"] += amount
+    return {
+        "stages": stages,
+        "total_count": sum(totals["count"] for totals in stages.values()),
+        "total_amount": sum(totals["amount"] for totals in stages.values()),
+    }
+
+
+def describe_pipeline(value: Dict[str, Any]) -> str:
+    lines = [f"Pipeline: {value['total_count']} deals worth {value['total_amount']:,.0f} in total."]
+    for stage, totals in sorted(value["stages"].items(), key=lambda item: -item[1]["amount"]):
+        lines.append(f"- {stage}: {totals['count']} deals, {totals['amount']:,.0f}")
+    return "\n".join(lines)
+
+
+def new_contacts_last_7_days(fetch: Fetch) -> Dict[str, Any]:
+    since_ms = int((time.time() - 7 * 24 * 3600) * 1000)
+    response = fetch("/crm/v3/objects/contacts/search", method="POST", data={
+        "filterGroups": [{"filters": [{"propertyName": "createdate", "operator": "GTE", "value": str(since_ms)}]}],
+        "properties": ["firstname", "lastname", "email", "createdate"],
+        "sorts": [{"propertyName": "createdate", "direction": "DESCENDING"}],
+        "limit": 10,
+    })
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return {"count": response.get("total", 0), "latest": response.get("results", []), "since_ms": since_ms}
+
+
+def describe_new_contacts(value: Dict[str, Any]) -> str:
+    return f"{value['count']} new contacts were added in the last 7 days."
+
+
+def top_industries(fetch: Fetch, max_records: int, top_n: int = 10) -> Dict[str, Any]:
+    industries = Counter()
+    for company in _page_all(fetch, "companies", ["industry"], max_records):
+        industries[company.get("properties", {}).get("industry") or "Unknown"] += 1
+    return {"industries": industries.most_common(top_n), "companies": sum(industries.values())}
+
+
+def describe_top_industries(value: Dict[str, Any]) -> str:
+    lines = [f"Top industries across {value['companies']} companies:"]
+    for industry, count in value["industries"]:
+        lines.append(f"- {industry}: {count}")
+    return "\n".join(lines)
+
+
+# Optional lead-in of a question, e.g. "show me the" or "what are our"
+QUESTION_PREFIX = r"^(?:(?:show|give|tell)(?: me)?\s+|what(?:'s| is| are)\s+|list\s+)?(?:the\s+|our\s+)?"
+
+
+def unscoped(*bodies: str) -> List[str]:
+    """Patterns matching only the whole question, so scoped variants ("... at Acme", "... this month") go to a live query"""
+    return [f"{QUESTION_PREFIX}(?:{body})$" for body in bodies]
+
+
+def default_summaries(fetch: Fetch, max_records: int = 10000) -> Dict[str, SummaryDefinition]:
+    """The built-in summaries, keyed by name"""
+    return {
+        "pipeline_by_stage": SummaryDefinition(
+            "pipeline_by_stage",
+            "Deal count and amount per pipeline stage",
+            unscoped(r'(?:total )?pipeline(?: totals?)?(?: (?:summary|overview|by stage|value))?', r'deals? (?:totals? )?by stage'),
+            lambda: pipeline_by_stage(fetch, max_records),
+            describe_pipeline,
+        ),
+        "new_contacts_last_7_days": SummaryDefinition(
+            "new_contacts_last_7_days",
+            "Contacts created in the last 7 days",
+            unscoped(
+                r'how many new contacts(?: (?:were|have been) (?:added|created))?(?: (?:in|over) the (?:last|past) (?:7|seven) days)?',
+                r'(?:new contacts|contacts (?:created|added)) (?:in|over) the (?:last|past) (?:7|seven) days',
+            ),
+            lambda: new_contacts_last_7_days(fetch),
+            describe_new_contacts,
+        ),
+        "top_industries": SummaryDefinition(
+            "top_industries",
+            "Most common company industries",
+            unscoped(r'(?:top|most common) industr(?:y|ies)', r'industr(?:y|ies) breakdown', r'companies by industry'),
+            lambda: top_industries(fetch, max_records),
+            describe_top_industries,
+        ),
+    }
+
+
+# Former names of built-in summaries, still accepted in the spec
+SUMMARY_ALIASES = {"new_contacts_this_week": "new_contacts_last_7_days"}
+
+
+def configure_summaries(fetch: Fetch, spec: str, jitter: float = 0.1, max_records: int = 10000) -> List[SummaryDefinition]:
+    """Select summaries from a "name:interval_seconds[:jitter],..." spec, e.g. "pipeline_by_stage:300:0.2,top_industries:3600".
+
+    Summaries listed without a jitter use the given default.
+    """
+    available = default_summaries(fetch, max_records)
+    selected = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, settings = item.partition(":")
+        name = SUMMARY_ALIASES.get(name.strip(), name.strip())
+        definition = available.get(name)
+        if definition is None:
+            print(f"WARNING: Unknown dashboard summary '{name}'. Available: {', '.join(available)}")
+            continue
+        interval, _, summary_jitter = settings.partition(":")
+        if interval:
+            definition.interval_seconds = float(interval)
+        definition.jitter = float(summary_jitter) if summary_jitter else jitter
+        selected.append(definition)
+    return selected
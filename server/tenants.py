@@ -0,0 +1,400 @@
+# Multi-portal (tenant) support
+# Each request resolves a HubSpot portal from the X-Portal-Id header and must prove access
+# to it with that portal's key in X-Portal-Key. A portal has its own credentials, HubSpot
+# rate budget, and cache and conversation namespaces. Blocking work from all portals
+# shares one worker pool that hands out free slots round-robin across portals, so a
+# heavy portal cannot starve the others.
+
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Generic, Iterable, Optional, TypeVar
+import asyncio
+import json
+import os
+import secrets
+import threading
+import time
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+DEFAULT_TENANT_ID = "default"
+
+# Placeholder values from .env.example that mean "not configured"
+_PLACEHOLDER_CREDENTIALS = {"your_developer_ai_bearer_token_here", "your_hubspot_api_key_here"}
+
+
+class RateBudget:
+    """Token bucket for a portal's HubSpot API calls, shared by its worker threads"""
+
+    def __init__(self, requests_per_second: float, burst: int):
+        self.rate = requests_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+
+    def acquire(self, timeout: float) -> bool:
+        """Take one token, waiting up to timeout seconds; False if the budget stays exhausted"""
+        started = time.monotonic()
+        waited = False
+        while True:
+            wait = self._take(started, waited, timeout)
+            if wait is None or wait == 0:
+                return wait == 0
+            waited = True
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout: float) -> bool:
+        """acquire() for the event loop: waits without blocking it, drawing on the same tokens"""
+        started = time.monotonic()
+        waited = False
+        while True:
+            wait = self._take(started, waited, timeout)
+            if wait is None or wait == 0:
+                return wait == 0
+            waited = True
+            await asyncio.sleep(wait)
+
+    def _take(self, started: float, waited: bool, timeout: float) -> Optional[float]:
+        """0 once a token is taken, else the seconds until the next one; None past the timeout"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.acquired += 1
+                if waited:
+                    self.throttled += 1
+                    self.total_wait_seconds += now - started
+                return 0
+            wait = (1 - self._tokens) / self.rate if self.rate else timeout
+            if now - started + wait > timeout:
+                self.rejected += 1
+                return None
+            return wait
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests_per_second": self.rate,
+                "burst": self.burst,
+                "available": round(min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate), 1),
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "avg_throttle_ms": round(self.total_wait_seconds * 1000 / self.throttled, 1) if self.throttled else None,
+            }
+
+
+class Tenant:
+    """A HubSpot portal with its own credentials, connection pool and rate budget"""
+
+    def __init__(
+        self,
+        tenant_id: str,
+        bearer_token: Optional[str] = None,
+        api_key: Optional[str] = None,
+        requests_per_second: float = 10,
+        burst: int = 100,
+        pool_size: int = 10,
+        access_key: Optional[str] = None,
+        open_access: bool = False,
+    ):
+        self.tenant_id = tenant_id
+        # Key callers present in X-Portal-Key; without one the portal is closed unless open_access
+        self.access_key = access_key or None
+        self.open_access = open_access and self.access_key is None
+        self.bearer_token = bearer_token if bearer_token not in _PLACEHOLDER_CREDENTIALS else None
+        self.api_key = api_key if api_key not in _PLACEHOLDER_CREDENTIALS else None
+        self.rate_budget = RateBudget(requests_per_second, burst)
+        self.pool_size = pool_size
+
+        # Sent with every HubSpot call by the portal's connector transport, which keeps
+        # up to pool_size keep-alive connections
+        self.headers = {"Content-Type": "application/json"}
+        if self.bearer_token:
+            self.headers["Authorization"] = f"Bearer {self.bearer_token}"
+
+    @property
+    def has_credentials(self) -> bool:
+        return bool(self.bearer_token or self.api_key)
+
+    def allows(self, access_key: Optional[str]) -> bool:
+        """Whether a request presenting this access key may use the portal"""
+        if self.access_key is None:
+            return self.open_access
+        return bool(access_key) and secrets.compare_digest(access_key, self.access_key)
+
+    def auth_params(self) -> Dict[str, str]:
+        """Query parameters for API key authentication, when no bearer token is set"""
+        if self.api_key and "Authorization" not in self.headers:
+            return {"hapikey": self.api_key}
+        return {}
+
+    def namespace(self, key: str) -> str:
+        """Scope a cache or conversation key to this portal"""
+        return f"{self.tenant_id}:{key}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "has_credentials": self.has_credentials,
+            "open_access": self.open_access,
+            "pool_size": self.pool_size,
+            "rate_budget": self.rate_budget.stats(),
+        }
+
+
+class UnknownTenant(Exception):
+    """Raised when a request names a portal that is not configured"""
+
+
+class TenantAccessDenied(Exception):
+    """Raised when a request does not present the access key of the portal it names"""
+
+
+class TenantRegistry:
+    """Configured portals, looked up by id"""
+
+    def __init__(self, tenants: Iterable[Tenant], default_tenant_id: str = DEFAULT_TENANT_ID):
+        self.tenants: Dict[str, Tenant] = {tenant.tenant_id: tenant for tenant in tenants}
+        self.default_tenant_id = default_tenant_id
+
+    @property
+    def default(self) -> Tenant:
+        return self.tenants[self.default_tenant_id]
+
+    def get(self, tenant_id: Optional[str]) -> Tenant:
+        if not tenant_id:
+            return self.default
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None:
+            raise UnknownTenant(tenant_id)
+        return tenant
+
+    def authenticate(self, tenant_id: Optional[str], access_key: Optional[str]) -> Tenant:
+        """The named (or default) portal, if the access key opens it"""
+        tenant = self.get(tenant_id)
+        if not tenant.allows(access_key):
+            raise TenantAccessDenied(tenant.tenant_id)
+        return tenant
+
+    def __iter__(self):
+        return iter(self.tenants.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {tenant_id: tenant.stats() for tenant_id, tenant in self.tenants.items()}
+
+
+def load_tenants(
+    portals_file: Optional[str],
+    default_bearer_token: Optional[str],
+    default_api_key: Optional[str],
+    default_tenant_id: str = DEFAULT_TENANT_ID,
+    requests_per_second: float = 10,
+    burst: int = 100,
+    pool_size: int = 10,
+    default_access_key: Optional[str] = None,
+) -> TenantRegistry:
+    """Build the registry from a portals JSON file plus the single-portal environment credentials.
+
+    The file maps portal ids to settings; credentials and the portal's access key can be
+    given directly or by the name of an environment variable holding them:
+        {"acme": {"bearer_token_env": "ACME_HUBSPOT_TOKEN", "access_key_env": "ACME_PORTAL_KEY", "requests_per_second": 5}}
+    Portals from the file without an access key refuse every request. The environment
+    portal is open to all callers unless default_access_key is set.
+    """
+    tenants = [Tenant(
+        DEFAULT_TENANT_ID, default_bearer_token, default_api_key, requests_per_second, burst, pool_size,
+        access_key=default_access_key, open_access=True,
+    )]
+    if portals_file:
+        with open(portals_file) as f:
+            portals = json.load(f)
+        for tenant_id, config in portals.items():
+            bearer_token = config.get("bearer_token") or os.getenv(config.get("bearer_token_env", ""))
+            api_key = config.get("api_key") or os.getenv(config.get("api_key_env", ""))
+            access_key = config.get("access_key") or os.getenv(config.get("access_key_env", ""))
+            if not access_key:
+                print(f"WARNING: Portal '{tenant_id}' has no access key; requests for it will be refused")
+            tenants = [tenant for tenant in tenants if tenant.tenant_id != tenant_id]
+            tenants.append(Tenant(
+                tenant_id,
+                bearer_token,
+                api_key,
+                float(config.get("requests_per_second", requests_per_second)),
+                int(config.get("burst", burst)),
+                int(config.get("pool_size", pool_size)),
+                access_key=access_key,
+            ))
+    registry = TenantRegistry(tenants, default_tenant_id)
+    if default_tenant_id not in registry.tenants:
+        raise ValueError(f"Default portal '{default_tenant_id}' is not configured")
+    return registry
+
+
+# Portal of the request being handled, visible to helpers called from any stage
+current_tenant: ContextVar[Optional[Tenant]] = ContextVar("current_tenant", default=None)
+
+
+def tenant_dependency(registry: TenantRegistry):
+    """FastAPI dependency resolving the request's portal from the X-Portal-Id header.
+
+    Answers 404 for unknown portals and 403 when X-Portal-Key is not the portal's access key.
+    """
+
+    async def resolve_tenant(request: Request) -> Tenant:
+        try:
+            tenant = registry.authenticate(request.headers.get("x-portal-id"), request.headers.get("x-portal-key"))
+        except UnknownTenant as e:
+            raise HTTPException(status_code=404, detail=f"Unknown portal: {e}")
+        except TenantAccessDenied as e:
+            raise HTTPException(status_code=403, detail=f"Access to portal {e} denied")
+        current_tenant.set(tenant)
+        return tenant
+
+    return resolve_tenant
+
+
+T = TypeVar("T")
+
+
+class PerTenant(Generic[T]):
+    """Lazily created per-portal instances of a component (graph, summary store, ...)"""
+
+    def __init__(self, factory: Callable[[Tenant], T]):
+        self.factory = factory
+        self._instances: Dict[str, T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant: Tenant) -> T:
+        with self._lock:
+            instance = self._instances.get(tenant.tenant_id)
+            if instance is None:
+                instance = self._instances[tenant.tenant_id] = self.factory(tenant)
+            return instance
+
+    def items(self):
+        with self._lock:
+            return list(self._instances.items())
+
+
+class FairScheduler:
+    """Shared worker pool for blocking work, handing free slots to portals in turn.
+
+    Each portal may hold at most max_per_tenant slots, and when slots free up the
+    waiting portals are served round-robin, one task each, rather than first come first
+    served.
+    """
+
+    def __init__(self, max_workers: int, max_per_tenant: Optional[int] = None):
+        self.max_workers = max_workers
+        self.max_per_tenant = max_per_tenant or max_workers
+        self._running: Dict[str, int] = {}
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._total_running = 0
+        self.completed: Dict[str, int] = {}
+        self.total_wait_seconds: Dict[str, float] = {}
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking function for the current portal once it gets a slot"""
+        tenant = current_tenant.get()
+        tenant_id = tenant.tenant_id if tenant is not None else DEFAULT_TENANT_ID
+        started = time.monotonic()
+        await self._acquire(tenant_id)
+        self.total_wait_seconds[tenant_id] = self.total_wait_seconds.get(tenant_id, 0.0) + time.monotonic() - started
+        try:
+            work = asyncio.ensure_future(run_in_threadpool(fn, *args, **kwargs))
+        except BaseException:
+            self._release(tenant_id)
+            raise
+        # A thread cannot be stopped, so the slot is held until it returns, even if the
+        # caller is cancelled and stops waiting for it
+        work.add_done_callback(lambda done: self._finished(tenant_id, done))
+        return await asyncio.shield(work)
+
+    def _finished(self, tenant_id: str, work: asyncio.Future):
+        self._release(tenant_id)
+        # Retrieved here so work nobody waits for any more doesn't log a warning
+        work.cancelled() or work.exception()
+
+    def _can_start(self, tenant_id: str) -> bool:
+        return self._total_running < self.max_workers and self._running.get(tenant_id, 0) < self.max_per_tenant
+
+    async def _acquire(self, tenant_id: str):
+        if not self._waiting and self._can_start(tenant_id):
+            self._start(tenant_id)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(tenant_id, deque()).append(waiter)
+        # Other portals may be waiting only because they are at their own cap
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as the caller gave up
+                self._release(tenant_id)
+            else:
+                queue = self._waiting.get(tenant_id)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiting[tenant_id]
+            raise
+
+    def _start(self, tenant_id: str):
+        self._running[tenant_id] = self._running.get(tenant_id, 0) + 1
+        self._total_running += 1
+
+    def _release(self, tenant_id: str):
+        self._running[tenant_id] -= 1
+        self._total_running -= 1
+        self.completed[tenant_id] = self.completed.get(tenant_id, 0) + 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Give free slots to waiting portals in round-robin order"""
+        progressed = True
+        while self._waiting and self._total_running < self.max_workers and progressed:
+            progressed = False
+            for tenant_id in list(self._waiting):
+                if self._total_running >= self.max_workers:
+                    break
+                if not self._can_start(tenant_id):
+                    continue
+                queue = self._waiting.pop(tenant_id)
+                waiter = queue.popleft()
+                if queue:
+                    # Back of the line until every other waiting portal has had a turn
+                    self._waiting[tenant_id] = queue
+                if waiter.done():
+                    # Cancelled while waiting
+                    progressed = True
+                    continue
+                self._start(tenant_id)
+                waiter.set_result(None)
+                progressed = True
+
+    def stats(self) -> Dict[str, Any]:
+        tenants = set(self._running) | set(self._waiting) | set(self.completed)
+        return {
+            "max_workers": self.max_workers,
+            "max_per_tenant": self.max_per_tenant,
+            "running": self._total_running,
+            "waiting": sum(len(queue) for queue in self._waiting.values()),
+            "by_tenant": {
+                tenant_id: {
+                    "running": self._running.get(tenant_id, 0),
+                    "waiting": len(self._waiting.get(tenant_id, ())),
+                    "completed": self.completed.get(tenant_id, 0),
+                    "avg_wait_ms": round(self.total_wait_seconds.get(tenant_id, 0.0) * 1000 / self.completed[tenant_id], 1) if self.completed.get(tenant_id) else None,
+                }
+                for tenant_id in sorted(tenants)
+            },
+        }
@@ -0,0 +1,7 @@
+# Shared test setup: the server modules are imported the way simple_server imports
+# them, as top-level modules from the server directory.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
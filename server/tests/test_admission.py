@@ -0,0 +1,90 @@
+# Admission control: 503 when an endpoint's queue is full or the wait runs out, 429 over a client's quota
+
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from admission import AdmissionController, ClientQuota, EndpointLimiter
+
+
+def make_app(limiter, quota=None):
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.post("/query")
+    async def query():
+        await release.wait()
+        return {"response": "ok"}
+
+    @app.post("/other")
+    async def other():
+        return {"response": "ok"}
+
+    app.middleware("http")(AdmissionController({"/query": limiter}, quota=quota))
+    return app, release
+
+
+async def post(client, path="/query"):
+    return await client.post(path, json={})
+
+
+def run_requests(limiter, count, quota=None):
+    async def scenario():
+        app, release = make_app(limiter, quota)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            tasks = [asyncio.create_task(post(client)) for _ in range(count)]
+            # Let every request reach the limiter before the admitted ones finish
+            await asyncio.sleep(0.05)
+            release.set()
+            return await asyncio.gather(*tasks)
+
+    return asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_with_503_and_retry_after():
+    limiter = EndpointLimiter("/query", max_concurrent=1, max_queue=1, max_wait_seconds=5)
+    responses = run_requests(limiter, 3)
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 503]
+    rejected = next(response for response in responses if response.status_code == 503)
+    assert "queue is full" in rejected.json()["response"]
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert limiter.stats()["rejected_queue_full"] == 1
+
+
+def test_wait_deadline_is_rejected_with_503():
+    limiter = EndpointLimiter("/query", max_concurrent=1, max_queue=5, max_wait_seconds=0.01)
+    responses = run_requests(limiter, 2)
+
+    assert sorted(response.status_code for response in responses) == [200, 503]
+    assert limiter.stats()["rejected_timeout"] == 1
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_client_over_quota_is_rejected_with_429():
+    limiter = EndpointLimiter("/query", max_concurrent=10, max_queue=10, max_wait_seconds=5)
+    quota = ClientQuota(requests_per_minute=6, burst=2)
+    responses = run_requests(limiter, 3, quota)
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 429]
+    rejected = next(response for response in responses if response.status_code == 429)
+    # One token comes back every 10 seconds
+    assert rejected.headers["Retry-After"] == "10"
+    assert quota.stats()["rejected"] == 1
+
+
+def test_other_endpoints_are_not_limited():
+    limiter = EndpointLimiter("/query", max_concurrent=1, max_queue=0, max_wait_seconds=0.01)
+
+    async def scenario():
+        app, _ = make_app(limiter)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(post(client, "/other") for _ in range(3)))
+
+    assert [response.status_code for response in asyncio.run(scenario())] == [200, 200, 200]
+    assert limiter.stats()["admitted"] == 0
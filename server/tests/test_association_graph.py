@@ -0,0 +1,138 @@
+# Association graph: joins over paged v4 associations, unloaded neighbors and deleted records
+
+import re
+
+from association_graph import AssociationGraph
+
+
+class FakeHubSpot:
+    """Records and associations served through the list, search and v4 batch endpoints"""
+
+    def __init__(self, records, associations, page_size=2, associations_page_size=2):
+        self.records = records
+        self.associations = associations
+        self.archived = {object_type: [] for object_type in records}
+        self.modified = {object_type: [] for object_type in records}
+        self.page_size = page_size
+        self.associations_page_size = associations_page_size
+        self.calls = []
+
+    def __call__(self, endpoint, method="GET", params=None, data=None):
+        self.calls.append((endpoint, dict(params or {}), data))
+        batch = re.match(r"/crm/v4/associations/(\w+)/(\w+)/batch/read$", endpoint)
+        if batch:
+            return self._read_associations(batch.group(1), batch.group(2), data["inputs"])
+        search = re.match(r"/crm/v3/objects/(\w+)/search$", endpoint)
+        if search:
+            return {"results": self.modified[search.group(1)]}
+        object_type = endpoint.rsplit("/", 1)[1]
+        if params.get("archived") == "true":
+            rows = [{"id": hubspot_id} for hubspot_id in self.archived[object_type]]
+        else:
+            rows = [{"id": hubspot_id, "properties": props} for hubspot_id, props in self.records[object_type].items()]
+        return self._page(rows, params.get("after"), self.page_size)
+
+    def _page(self, rows, after, size):
+        start = int(after or 0)
+        response = {"results": rows[start:start + size]}
+        if start + size < len(rows):
+            response["paging"] = {"next": {"after": str(start + size)}}
+        return response
+
+    def _read_associations(self, from_type, to_type, inputs):
+        results = []
+        for item in inputs:
+            to_ids = self.associations.get((from_type, to_type), {}).get(item["id"], [])
+            page = self._page([{"toObjectId": int(to_id)} for to_id in to_ids], item.get("after"), self.associations_page_size)
+            if page["results"]:
+                results.append({"from": {"id": item["id"]}, "to": page["results"], **({"paging": page["paging"]} if "paging" in page else {})})
+        return {"results": results}
+
+
+def make_hubspot():
+    records = {
+        "contacts": {
+            "1": {"firstname": "Ada", "lastname": "Lovelace"},
+            "2": {"firstname": "Alan", "lastname": "Turing"},
+            "3": {"firstname": "Grace", "lastname": "Hopper"},
+        },
+        "companies": {
+            "10": {"name": "Acme Corp"},
+            "11": {"name": "Globex"},
+        },
+        "deals": {
+            "100": {"dealname": "Acme renewal", "amount": "80000", "dealstage": "contractsent"},
+            "101": {"dealname": "Acme pilot", "amount": "5000", "dealstage": "closedwon"},
+            "102": {"dealname": "Acme expansion", "amount": "60000", "dealstage": "appointmentscheduled"},
+            "103": {"dealname": "Globex deal", "amount": "90000", "dealstage": "contractsent"},
+        },
+    }
+    associations = {
+        ("contacts", "companies"): {"1": ["10"], "2": ["10"], "3": ["11"]},
+        # Ada has more deals than fit on one page of associations, plus one that was never listed
+        ("contacts", "deals"): {"1": ["100", "101", "102", "999"], "3": ["103"]},
+        ("companies", "deals"): {"10": ["100"], "11": ["103"]},
+    }
+    return FakeHubSpot(records, associations)
+
+
+def loaded_graph(hubspot):
+    graph = AssociationGraph(hubspot)
+    graph.load()
+    return graph
+
+
+def ids(result):
+    return sorted(record["id"] for record in result["results"])
+
+
+def test_join_follows_every_page_of_associations():
+    graph = loaded_graph(make_hubspot())
+
+    assert ids(graph.related("deals", "contacts", source_name="ada")) == ["100", "101", "102"]
+    assert ids(graph.related("deals", "companies", source_name="acme", via="contacts")) == ["100", "101", "102"]
+    assert ids(graph.related("companies", "deals", min_amount=50000, open_only=True)) == ["10", "11"]
+
+
+def test_associated_records_that_were_never_loaded_are_not_returned():
+    graph = loaded_graph(make_hubspot())
+
+    # Deal 999 is only known from Ada's associations, so it has no name, amount or stage
+    assert "999" not in ids(graph.related("deals", "contacts", source_name="ada", open_only=True))
+    assert graph.associated_ids("contacts", ["1"], "deals") == {"1": ["100", "101", "102"]}
+    assert graph.stats()["nodes"] == {"contacts": 3, "companies": 2, "deals": 4}
+
+
+def test_refresh_removes_deleted_records_and_their_edges():
+    hubspot = make_hubspot()
+    graph = loaded_graph(hubspot)
+    hubspot.archived["deals"] = ["100"]
+
+    graph.refresh()
+
+    assert ids(graph.related("deals", "companies", source_name="acme")) == []
+    assert ids(graph.related("deals", "contacts", source_name="ada")) == ["101", "102"]
+
+
+def test_archived_sweep_resumes_where_the_last_refresh_stopped():
+    hubspot = make_hubspot()
+    graph = AssociationGraph(hubspot, archived_pages_per_refresh=1)
+    graph.load()
+    hubspot.archived["contacts"] = ["7", "8", "9", "1", "2"]
+
+    def archived_cursors():
+        return [
+            call[1].get("after") for call in hubspot.calls
+            if call[0] == "/crm/v3/objects/contacts" and call[1].get("archived") == "true"
+        ]
+
+    graph.refresh()
+    graph.refresh()
+    assert archived_cursors() == [None, "2"]
+    assert ids(graph.related("contacts", "companies", source_name="acme")) == ["2"]
+
+    graph.refresh()
+    graph.refresh()
+    # After the last page the sweep starts over from the beginning
+    assert archived_cursors() == [None, "2", "4", None]
+    assert ids(graph.related("contacts", "companies", source_name="acme")) == []
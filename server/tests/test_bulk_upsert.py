@@ -0,0 +1,123 @@
+# BulkUpserter: splitting rejected batches, checkpoints that only cover finished rows, and deduplication
+
+import threading
+import time
+
+from bulk_upsert import BulkUpserter, Checkpoint
+
+
+def rows(*emails):
+    return [(number, {"email": email, "firstname": f"Row {number}"}, None) for number, email in enumerate(emails, start=1)]
+
+
+def upserted(inputs):
+    return {"results": [{"id": item["id"], "new": True} for item in inputs]}
+
+
+def test_rejected_batch_is_split_down_to_the_bad_record():
+    calls = []
+
+    def fetch(endpoint, method="GET", data=None, **kwargs):
+        inputs = data["inputs"]
+        calls.append([item["id"] for item in inputs])
+        if any(item["id"] == "bad@example.com" for item in inputs):
+            return {"error": "HTTP 400", "status_code": 400, "details": {"message": "Property values were not valid"}}
+        return upserted(inputs)
+
+    errors = []
+    upserter = BulkUpserter(fetch, "contacts", on_error=lambda row, record_id, message: errors.append((row, record_id, message)))
+    stats = upserter.run(rows("a@example.com", "b@example.com", "bad@example.com", "d@example.com"))
+
+    assert errors == [(3, "bad@example.com", "Property values were not valid")]
+    assert stats["upserted"] == 3
+    assert stats["row_errors"] == 1
+    assert stats["committed_row"] == 4
+    assert calls == [
+        ["a@example.com", "b@example.com", "bad@example.com", "d@example.com"],
+        ["a@example.com", "b@example.com"],
+        ["bad@example.com", "d@example.com"],
+        ["bad@example.com"],
+        ["d@example.com"],
+    ]
+
+
+def test_checkpoint_waits_for_earlier_batches(tmp_path):
+    second_written = threading.Event()
+    committed = []
+    committed_while_first_ran = []
+
+    def fetch(endpoint, method="GET", data=None, **kwargs):
+        inputs = data["inputs"]
+        if inputs[0]["id"] == "a@example.com":
+            # The first batch finishes only after the second one
+            assert second_written.wait(5)
+            # Give the second batch time to be marked done
+            time.sleep(0.1)
+            committed_while_first_ran.extend(committed)
+        else:
+            second_written.set()
+        return upserted(inputs)
+
+    checkpoint = Checkpoint(str(tmp_path / "contacts.checkpoint"), "contacts", "contacts.csv")
+    upserter = BulkUpserter(
+        fetch, "contacts", batch_size=2, concurrency=2, checkpoint=checkpoint,
+        on_progress=lambda stats: committed.append(stats["committed_row"]),
+    )
+    stats = upserter.run(rows("a@example.com", "b@example.com", "c@example.com", "d@example.com"))
+
+    # Rows 3-4 were written first, but the checkpoint could not pass rows 1-2 until they were
+    assert committed_while_first_ran == []
+    assert committed[0] == 4
+    assert committed == sorted(committed)
+    assert stats["upserted"] == 4
+    assert Checkpoint(checkpoint.path, "contacts", "contacts.csv").committed_row == 4
+
+
+def test_run_resumes_after_the_checkpoint(tmp_path):
+    path = str(tmp_path / "contacts.checkpoint")
+    Checkpoint(path, "contacts", "contacts.csv").save(2, {})
+    written = []
+
+    def fetch(endpoint, method="GET", data=None, **kwargs):
+        written.extend(item["id"] for item in data["inputs"])
+        return upserted(data["inputs"])
+
+    stats = BulkUpserter(fetch, "contacts", checkpoint=Checkpoint(path, "contacts", "contacts.csv")).run(
+        rows("a@example.com", "b@example.com", "c@example.com")
+    )
+    assert written == ["c@example.com"]
+    assert stats["rows_skipped"] == 2
+    assert stats["committed_row"] == 3
+
+
+def one_at_a_time(all_rows, committed):
+    """Yield each row only once the rows before it are committed"""
+    for row in all_rows:
+        deadline = time.monotonic() + 5
+        while (committed[-1] if committed else 0) < row[0] - 1 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        yield row
+
+
+def test_row_whose_write_failed_is_written_when_it_comes_again():
+    written = []
+    failed_once = []
+
+    def fetch(endpoint, method="GET", data=None, **kwargs):
+        inputs = data["inputs"]
+        if inputs[0]["id"] == "a@example.com" and not failed_once:
+            failed_once.append(True)
+            return {"error": "HTTP 400", "status_code": 400, "details": {"message": "Property values were not valid"}}
+        written.extend(item["id"] for item in inputs)
+        return upserted(inputs)
+
+    committed = []
+    upserter = BulkUpserter(fetch, "contacts", batch_size=1, concurrency=1, on_progress=lambda stats: committed.append(stats["committed_row"]))
+    same = {"email": "a@example.com", "firstname": "Ada"}
+    stats = upserter.run(one_at_a_time([(1, same, None), (2, dict(same), None), (3, dict(same), None)], committed))
+
+    # Row 1 was rejected, row 2 is written, and only row 3 repeats what HubSpot already has
+    assert written == ["a@example.com"]
+    assert stats["row_errors"] == 1
+    assert stats["duplicates"] == 1
+    assert stats["upserted"] == 1
@@ -0,0 +1,115 @@
+# Circuit breakers: open after failures, probe when half-open, and serve the last good result meanwhile
+
+import threading
+import time
+
+import pytest
+
+import simple_server
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, LastKnownGood, hubspot_family
+
+
+def fail(breaker, times=1):
+    for _ in range(times):
+        breaker.allow()
+        breaker.record_failure("HubSpot returned 503")
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    breaker = CircuitBreaker("hubspot:search", failure_threshold=3, reset_timeout=30)
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as raised:
+        breaker.call(lambda: "never called")
+    assert 0 < raised.value.retry_after <= 30
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("hubspot:search", failure_threshold=2)
+    fail(breaker)
+    breaker.call(lambda: "ok")
+    fail(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    breaker = CircuitBreaker("hubspot:objects", failure_threshold=1, reset_timeout=0.02)
+    fail(breaker)
+    time.sleep(0.03)
+
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # A second caller waits for the probe's outcome
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_failed_probe_opens_the_circuit_again():
+    breaker = CircuitBreaker("hubspot:objects", failure_threshold=3, reset_timeout=0.02)
+    fail(breaker, 3)
+    time.sleep(0.03)
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.stats()["times_opened"] == 2
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+
+def test_endpoint_families():
+    assert hubspot_family("/crm/v3/objects/contacts/search") == "search"
+    assert hubspot_family("/crm/v3/objects/contacts/batch/upsert") == "batch_write"
+    assert hubspot_family("/crm/v3/objects/contacts/batch/read") == "batch"
+    assert hubspot_family("/crm/v4/associations/contacts/companies/batch/read") == "associations"
+    assert hubspot_family("/crm/v3/objects/deals") == "objects"
+    assert hubspot_family("/oauth/v1/access-tokens") == "other"
+
+
+def test_last_known_good_serves_and_refreshes_once():
+    cache = LastKnownGood()
+    cache.put("GET /crm/v3/objects/deals", {"results": [{"id": "1"}]})
+
+    value, age = cache.get("GET /crm/v3/objects/deals")
+    assert value == {"results": [{"id": "1"}]}
+    assert age >= 0
+    assert cache.get("GET /crm/v3/objects/companies") is None
+
+    release = threading.Event()
+    refreshed = []
+
+    def refresh():
+        release.wait(1)
+        refreshed.append(True)
+
+    cache.revalidate("GET /crm/v3/objects/deals", refresh)
+    cache.revalidate("GET /crm/v3/objects/deals", refresh)
+    release.set()
+    cache._executor.shutdown(wait=True)
+    assert refreshed == [True]
+    assert cache.stats()["background_refreshes"] == 1
+
+
+def test_last_known_good_expires_old_entries():
+    cache = LastKnownGood(max_age_seconds=0)
+    cache.put("key", {"results": []})
+    time.sleep(0.01)
+    assert cache.get("key") is None
+
+
+def test_stale_result_is_marked_while_degraded():
+    simple_server.last_known_good.put("test-stale-key", {"results": [{"id": "7"}], "total": 1})
+    stale = simple_server.serve_stale("test-stale-key", "circuit open", lambda: None)
+
+    assert stale["results"] == [{"id": "7"}]
+    assert stale["stale"] is True
+    assert stale["degraded_reason"] == "circuit open"
+    assert simple_server.serve_stale("missing-key", "circuit open", lambda: None) is None
+    assert simple_server.serve_stale(None, "circuit open", lambda: None) is None
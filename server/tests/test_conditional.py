@@ -0,0 +1,125 @@
+# Entity tags, If-None-Match matching and changes_since sync-token paging
+
+import pytest
+
+from conditional import ConditionalResponses, changes_since, compute_etag, decode_sync_token, etag_matches
+
+
+def record(record_id, modified):
+    return {"id": record_id, "properties": {"hs_lastmodifieddate": modified}}
+
+
+class FakeSearch:
+    """fetch() stand-in answering each search with the next canned page"""
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.bodies = []
+
+    def __call__(self, endpoint, method="GET", params=None, data=None, allow_stale=True):
+        assert endpoint == "/crm/v3/objects/companies/search" and method == "POST" and not allow_stale
+        self.bodies.append(data)
+        return self.pages.pop(0)
+
+
+def since_value(body):
+    return body["filterGroups"][0]["filters"][0]["value"]
+
+
+# ETags and 304s
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"abc-gzip"', True),
+    ('"abc-br"', True),
+    ('"old", "abc"', True),
+    ("*", True),
+    ('"abd"', False),
+    ("", False),
+    (None, False),
+])
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, '"abc"') is matches
+
+
+def test_etag_never_matches_a_missing_tag():
+    assert not etag_matches("*", None)
+
+
+def test_etag_changes_with_record_versions():
+    page = {"results": [record("1", "2024-01-01T00:00:00Z")], "total": 1}
+    etag = compute_etag("key", page)
+    assert etag == compute_etag("key", {"results": [record("1", "2024-01-01T00:00:00Z")], "total": 1})
+    assert etag != compute_etag("key", {"results": [record("1", "2024-01-02T00:00:00Z")], "total": 1})
+    assert etag != compute_etag("other key", page)
+
+
+def test_stale_and_failed_results_get_no_etag():
+    assert compute_etag("key", {"results": [], "stale": True}) is None
+    assert compute_etag("key", {"error": "HubSpot is down"}) is None
+
+
+def test_not_modified_response():
+    responses = ConditionalResponses()
+    response = responses.not_modified_response('"abc"', fresh=True)
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"abc"'
+    assert not response.body
+    assert responses.stats()["fresh_not_modified"] == 1
+
+
+def test_stored_plan_is_scoped_to_the_request():
+    responses = ConditionalResponses(max_age_seconds=600)
+    key = ConditionalResponses.key("acme", "/query", {"query": "list contacts"})
+    responses.put(key, '"abc"', "plan", b"{}")
+    assert responses.plan(key) == "plan"
+    assert responses.plan(ConditionalResponses.key("beta", "/query", {"query": "list contacts"})) is None
+    assert responses.stats()["revalidations"] == 0
+
+
+# Sync tokens
+
+def test_changes_since_advances_past_returned_records():
+    fetch = FakeSearch(
+        {"results": [record("a", "1000"), record("b", "2000"), record("c", "2000")]},
+        {"results": [record("b", "2000"), record("c", "2000"), record("d", "3000")]},
+    )
+    first = changes_since(fetch, "companies", None, ["name"])
+    assert [r["id"] for r in first["results"]] == ["a", "b", "c"]
+    assert since_value(fetch.bodies[0]) == "0"
+    assert not first["has_more"]
+
+    second = changes_since(fetch, "companies", first["next_token"], ["name"])
+    # b and c share the token's modification time and were already returned
+    assert since_value(fetch.bodies[1]) == "2000"
+    assert [r["id"] for r in second["results"]] == ["d"]
+    assert decode_sync_token(second["next_token"], "companies") == {"since_ms": 3000, "seen_ids": ["d"], "after": None}
+
+
+def test_changes_since_pages_through_records_with_one_modification_time():
+    fetch = FakeSearch(
+        {"results": [record("a", "5000"), record("b", "5000")], "paging": {"next": {"after": "2"}}},
+        {"results": [record("a", "5000"), record("b", "5000")], "paging": {"next": {"after": "2"}}},
+        {"results": [record("c", "5000"), record("d", "6000")]},
+    )
+    token = changes_since(fetch, "companies", None, ["name"], limit=2)["next_token"]
+
+    # Every record on the page has the token's time, so only HubSpot's cursor can move on
+    first = changes_since(fetch, "companies", token, ["name"], limit=2)
+    assert first["results"] == []
+    assert first["has_more"]
+    assert decode_sync_token(first["next_token"], "companies") == {"since_ms": 5000, "seen_ids": ["a", "b"], "after": "2"}
+
+    second = changes_since(fetch, "companies", first["next_token"], ["name"], limit=2)
+    assert fetch.bodies[-1]["after"] == "2"
+    assert [r["id"] for r in second["results"]] == ["c", "d"]
+    assert decode_sync_token(second["next_token"], "companies") == {"since_ms": 6000, "seen_ids": ["d"], "after": None}
+
+
+def test_changes_since_rejects_a_token_for_another_object_type():
+    token = changes_since(FakeSearch({"results": []}), "companies", None, [])["next_token"]
+    with pytest.raises(ValueError):
+        decode_sync_token(token, "deals")
+    with pytest.raises(ValueError):
+        decode_sync_token("not a token", "companies")
@@ -0,0 +1,90 @@
+# Request deadlines: stages give up when time runs out or the request is cancelled
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from deadlines import Deadline, DeadlineExceeded, get_deadline, parse_timeouts
+
+
+def test_check_raises_once_expired():
+    deadline = Deadline(0.01)
+    deadline.check()
+    time.sleep(0.02)
+
+    assert deadline.expired
+    with pytest.raises(DeadlineExceeded, match="deadline exceeded"):
+        deadline.check()
+
+
+def test_stage_gets_a_share_and_is_cancelled_with_the_request():
+    deadline = Deadline(10)
+    stage = deadline.stage(0.5)
+    assert 4 < stage.remaining() <= 5
+
+    deadline.cancel("client disconnected")
+
+    assert stage.cancelled
+    with pytest.raises(DeadlineExceeded, match="client disconnected"):
+        stage.check()
+
+
+def test_wait_abandons_a_slow_stage_at_its_budget():
+    async def scenario():
+        deadline = Deadline(0.05)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await deadline.wait(asyncio.sleep(5))
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 1
+
+
+def test_wait_returns_as_soon_as_the_request_is_cancelled():
+    async def scenario():
+        deadline = Deadline(30)
+        asyncio.get_running_loop().call_later(0.02, deadline.cancel, "client disconnected")
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded, match="client disconnected"):
+            await deadline.wait(asyncio.sleep(5))
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 1
+
+
+def test_run_cancels_the_stage_seen_by_an_abandoned_thread():
+    seen = {}
+    finished = threading.Event()
+
+    def blocking_stage():
+        stage = get_deadline()
+        seen["stage"] = stage
+        while not stage.expired:
+            time.sleep(0.005)
+        finished.set()
+        return "done"
+
+    async def scenario():
+        deadline = Deadline(0.05, runner=asyncio.to_thread)
+        with pytest.raises(DeadlineExceeded):
+            await deadline.run(blocking_stage)
+        return deadline
+
+    deadline = asyncio.run(scenario())
+    assert finished.wait(1)
+    assert seen["stage"] is not deadline
+    assert seen["stage"].cancel_reason == "stage abandoned"
+    assert get_deadline() is None
+
+
+def test_run_returns_the_result_within_budget():
+    async def scenario():
+        return await Deadline(5, runner=asyncio.to_thread).run(lambda x: x * 2, 21)
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_parse_timeouts():
+    assert parse_timeouts("/query:30, /chat:90,") == {"/query": 30.0, "/chat": 90.0}
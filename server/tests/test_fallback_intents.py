@@ -0,0 +1,29 @@
+# Rule-based intent fallback: relationship questions get their own intent, other queries keep theirs
+
+import pytest
+
+from simple_server import fallback_analyze_query_intent
+
+
+@pytest.mark.parametrize("query, intent", [
+    ("list companies", "list"),
+    ("is there a company named acme", "lookup"),
+    ("find contacts who has email", "search"),
+    ("who has the most deals", "search"),
+    ("how many contacts where industry is software", "search"),
+    ("how many deals", "count"),
+    ("how many contacts at acme", "count"),
+    ("show contacts with email test@x.com", "filter"),
+    ("only deals in negotiation", "filter"),
+])
+def test_existing_queries_keep_their_intent(query, intent):
+    assert fallback_analyze_query_intent(query)[0] == intent
+
+
+@pytest.mark.parametrize("query", [
+    "deals for contacts at acme",
+    "find deals for contacts at acme",
+    "companies with open deals over 50k",
+])
+def test_relationship_questions_are_related(query):
+    assert fallback_analyze_query_intent(query)[0] == "related"
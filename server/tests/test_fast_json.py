@@ -0,0 +1,54 @@
+# Fast JSON path: untouched HubSpot payloads keep their bytes, changed ones are re-encoded
+
+import pytest
+
+from fast_json import RawPayload, encode_envelope, loads
+
+# Spacing and key order differ from what the encoder writes, so reuse of the bytes is visible
+RAW = b'{"results": [{"id": "1"}],  "paging": null, "total": 1}'
+
+
+def test_unmodified_payload_is_spliced_in_as_is():
+    payload = RawPayload.from_bytes(RAW)
+    body = encode_envelope({"response": "ok", "data": payload})
+
+    assert body == b'{"response":"ok","data":' + RAW + b"}"
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda payload: payload.__setitem__("total", 2),
+    lambda payload: payload.__delitem__("paging"),
+    lambda payload: payload.update(total=2),
+    lambda payload: payload.pop("total"),
+    lambda payload: payload.popitem(),
+    lambda payload: payload.setdefault("extra", 1),
+    lambda payload: payload.clear(),
+])
+def test_mutation_drops_the_original_bytes(mutate):
+    payload = RawPayload.from_bytes(RAW)
+    mutate(payload)
+
+    assert payload.raw is None
+    assert loads(encode_envelope({"data": payload}))["data"] == dict(payload)
+
+
+def test_in_place_union_drops_the_original_bytes():
+    payload = RawPayload.from_bytes(RAW)
+    payload |= {"total": 5}
+
+    assert isinstance(payload, RawPayload)
+    assert payload.raw is None
+    assert loads(encode_envelope({"data": payload}))["data"]["total"] == 5
+
+
+def test_reading_keeps_the_original_bytes():
+    payload = RawPayload.from_bytes(RAW)
+    payload.setdefault("total", 3)
+    payload.get("results")
+
+    assert payload.raw == RAW
+
+
+def test_non_object_payload_is_rejected():
+    with pytest.raises(ValueError):
+        RawPayload.from_bytes(b"[1, 2]")
@@ -0,0 +1,77 @@
+# Intent micro-batching: one prompt per group and size limit, and None when a query needs its own call
+
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from intent_batcher import IntentBatcher
+
+
+class FakeLLM:
+    """Answers each batched prompt with a list intent per query, unless told otherwise"""
+
+    def __init__(self, answer=None):
+        self.prompts = []
+        self.answer = answer
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        queries = [json.loads(q) for q in re.findall(r'^\s*\d+\. (".*")$', prompt, re.MULTILINE)]
+        with self._lock:
+            self.prompts.append(queries)
+        if self.answer is not None:
+            return self.answer(queries)
+        return json.dumps([{"id": i, "intent": "list", "intent_data": {"object_type": q}} for i, q in enumerate(queries, start=1)])
+
+
+def classify_together(batcher, queries, groups=None):
+    groups = groups or [None] * len(queries)
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        return list(pool.map(lambda args: batcher.classify(args[0], timeout=5, group=args[1]), zip(queries, groups)))
+
+
+def test_concurrent_queries_share_one_prompt():
+    llm = FakeLLM()
+    batcher = IntentBatcher(llm, "Instructions", window_ms=100, max_batch_size=8)
+    results = classify_together(batcher, ["contacts", "deals", "companies"])
+
+    assert results == [("list", {"object_type": q}) for q in ["contacts", "deals", "companies"]]
+    assert len(llm.prompts) == 1
+    stats = batcher.stats()
+    assert (stats["batches"], stats["items"], stats["avg_batch_size"]) == (1, 3, 3.0)
+
+
+def test_batches_split_by_size_and_group():
+    llm = FakeLLM()
+    batcher = IntentBatcher(llm, "Instructions", window_ms=100, max_batch_size=2)
+    queries = ["a1", "a2", "a3", "a4", "b1", "b2"]
+    results = classify_together(batcher, queries, ["acme"] * 4 + ["beta"] * 2)
+
+    assert [r[1]["object_type"] for r in results] == queries
+    assert all(len(prompt) == 2 for prompt in llm.prompts)
+    # No prompt mixes the portals
+    assert all(len({q[0] for q in prompt}) == 1 for prompt in llm.prompts)
+    assert batcher.stats()["batches"] == 3
+
+
+def test_single_query_falls_back_without_a_batch_call():
+    llm = FakeLLM()
+    batcher = IntentBatcher(llm, "Instructions", window_ms=1)
+
+    assert batcher.classify("contacts", timeout=5) is None
+    assert llm.prompts == []
+    stats = batcher.stats()
+    assert (stats["batches"], stats["items"], stats["unbatched"]) == (0, 0, 1)
+
+
+def test_unusable_answers_fall_back_per_query():
+    # The answer covers only the first query
+    llm = FakeLLM(lambda queries: json.dumps([{"id": 1, "intent": "count", "intent_data": {}}]))
+    batcher = IntentBatcher(llm, "Instructions", window_ms=100)
+    assert classify_together(batcher, ["first", "second"]) == [("count", {}), None]
+    assert batcher.stats()["item_fallbacks"] == 1
+
+    broken = IntentBatcher(FakeLLM(lambda queries: "not json"), "Instructions", window_ms=100)
+    assert classify_together(broken, ["first", "second"]) == [None, None]
+    assert broken.stats()["parse_failures"] == 1
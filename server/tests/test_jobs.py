@@ -0,0 +1,85 @@
+# JobManager: cancelling queued and running jobs, and restoring jobs after a restart
+
+import threading
+import time
+
+from jobs import CANCELLED, FAILED, RUNNING, SUCCEEDED, Job, JobManager, JobStore
+
+
+def wait_for(job, *statuses, timeout=5):
+    stop = time.monotonic() + timeout
+    while job.status not in statuses:
+        assert time.monotonic() < stop, f"job is still {job.status}"
+        time.sleep(0.01)
+
+
+def blocking_handlers(started, ran):
+    def wait(ctx, params):
+        ran.append(params["name"])
+        started.set()
+        while True:
+            ctx.check()
+            time.sleep(0.01)
+
+    return {"wait": wait, "echo": lambda ctx, params: params}
+
+
+def test_cancel_running_job():
+    started, ran = threading.Event(), []
+    manager = JobManager(blocking_handlers(started, ran), max_workers=1)
+    job = manager.submit("wait", {"name": "first"}, "acme")
+    assert started.wait(5)
+    assert job.status == RUNNING
+
+    manager.cancel(job)
+    wait_for(job, CANCELLED)
+    assert job.error == "job cancelled"
+    assert manager.stats()["completed"][CANCELLED] == 1
+
+
+def test_cancel_queued_job_never_runs_it():
+    started, ran = threading.Event(), []
+    manager = JobManager(blocking_handlers(started, ran), max_workers=1)
+    running = manager.submit("wait", {"name": "first"}, "acme")
+    assert started.wait(5)
+    queued = manager.submit("wait", {"name": "second"}, "acme")
+
+    manager.cancel(queued)
+    assert queued.status == CANCELLED
+    assert queued.error == "Cancelled before it started"
+    manager.cancel(running)
+    wait_for(running, CANCELLED)
+    manager._executor.shutdown(wait=True)
+    assert ran == ["first"]
+
+
+def test_cancel_finished_job_deletes_it(tmp_path):
+    manager = JobManager({"echo": lambda ctx, params: params}, JobStore(str(tmp_path)))
+    job = manager.submit("echo", {"x": 1}, "acme")
+    wait_for(job, SUCCEEDED)
+    manager.cancel(job)
+    assert manager.get(job.job_id, "acme") is None
+    assert not (tmp_path / f"{job.job_id}.json").exists()
+
+
+def test_restore_after_restart(tmp_path):
+    store = JobStore(str(tmp_path))
+    manager = JobManager({"echo": lambda ctx, params: {"echoed": params}}, store)
+    done = manager.submit("echo", {"x": 1}, "acme")
+    wait_for(done, SUCCEEDED)
+
+    # A job that was running when the server stopped, and one whose results have expired
+    interrupted = Job("interrupted", "echo", {}, "acme")
+    interrupted.status = RUNNING
+    store.save(interrupted)
+    expired = Job("expired", "echo", {}, "acme")
+    expired.status, expired.expires_at = SUCCEEDED, time.time() - 1
+    store.save(expired)
+
+    restored = JobManager({"echo": lambda ctx, params: params}, JobStore(str(tmp_path)))
+    assert restored.get(done.job_id, "acme").result == {"echoed": {"x": 1}}
+    failed = restored.get("interrupted", "acme")
+    assert failed.status == FAILED
+    assert failed.error == "The server restarted before the job finished"
+    assert restored.get("expired", "acme") is None
+    assert not (tmp_path / "expired.json").exists()
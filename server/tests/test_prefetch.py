@@ -0,0 +1,89 @@
+# Follow-up prefetch: associated records of returned entities are warmed and served to matching follow-ups
+
+import pytest
+
+from prefetch import FollowUpPrefetcher
+from tool_cache import ToolResultCache
+
+PROPERTIES = {"contacts": ["firstname", "lastname"], "deals": ["dealname"]}
+FORMATTERS = {
+    "contacts": lambda record: {"id": record["id"], "name": record["properties"]["firstname"]},
+    "deals": lambda record: {"id": record["id"], "name": record["properties"]["dealname"]},
+}
+
+
+class FakeHubSpot:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, endpoint, method="GET", params=None, data=None):
+        self.calls.append(endpoint)
+        if endpoint == "/crm/v4/associations/companies/contacts/batch/read":
+            return {"results": [{"from": {"id": "10"}, "to": [{"toObjectId": 1}, {"toObjectId": 2}]}]}
+        if endpoint == "/crm/v4/associations/companies/deals/batch/read":
+            return {"results": [{"from": {"id": "10"}, "to": [{"toObjectId": 100}]}]}
+        if endpoint == "/crm/v3/objects/contacts/batch/read":
+            return {"results": [
+                {"id": "1", "properties": {"firstname": "Ada"}},
+                {"id": "2", "properties": {"firstname": "Alan"}},
+            ]}
+        if endpoint == "/crm/v3/objects/deals/batch/read":
+            return {"results": [{"id": "100", "properties": {"dealname": "Acme renewal"}}]}
+        return {"error": f"unexpected {endpoint}"}
+
+
+def warmed_prefetcher():
+    prefetcher = FollowUpPrefetcher(ToolResultCache(), PROPERTIES)
+    hubspot = FakeHubSpot()
+    sources = prefetcher.predict([("companies", {"id": "10", "name": "Acme Corp"}), ("contacts", {"id": "1"})])
+    prefetcher.warm("conversation", sources, hubspot, None, FORMATTERS)
+    return prefetcher, hubspot
+
+
+def test_warming_stays_within_the_call_budget():
+    prefetcher, hubspot = warmed_prefetcher()
+    assert len(hubspot.calls) == 4
+    assert prefetcher.stats()["warmed_entries"] == 2
+
+
+@pytest.mark.parametrize("object_type, query, names", [
+    ("contacts", "contacts at Acme Corp", ["Ada", "Alan"]),
+    ("contacts", "Show me all the people at acme corp?", ["Ada", "Alan"]),
+    ("deals", "deals for Acme Corp", ["Acme renewal"]),
+])
+def test_follow_up_about_a_warmed_entity_is_answered(object_type, query, names):
+    prefetcher, _ = warmed_prefetcher()
+    records, total = prefetcher.lookup("conversation", object_type, query)
+
+    assert [record["name"] for record in records] == names
+    assert total == len(names)
+    assert prefetcher.stats()["lookup_hits"] == 1
+
+
+@pytest.mark.parametrize("object_type, query", [
+    # Extra criteria need a real search
+    ("deals", "closed won deals at Acme Corp over $50k"),
+    # A plain name is a text search, not a relation
+    ("contacts", "Acme Corp"),
+    # Part of a word is not the entity's name
+    ("contacts", "contacts at Acme Corporation"),
+    # Nothing was warmed for this type or conversation
+    ("companies", "companies at Acme Corp"),
+])
+def test_other_queries_are_not_answered(object_type, query):
+    prefetcher, _ = warmed_prefetcher()
+    assert prefetcher.lookup("conversation", object_type, query) is None
+
+
+def test_lookup_is_scoped_to_the_conversation():
+    prefetcher, _ = warmed_prefetcher()
+    assert prefetcher.lookup("another-conversation", "contacts", "contacts at Acme Corp") is None
+    assert prefetcher.lookup(None, "contacts", "contacts at Acme Corp") is None
+
+
+def test_expired_prefetch_is_not_served():
+    prefetcher = FollowUpPrefetcher(ToolResultCache(), PROPERTIES, ttl_seconds=0)
+    sources = prefetcher.predict([("companies", {"id": "10", "name": "Acme Corp"})])
+    prefetcher.warm("conversation", sources, FakeHubSpot(), None, FORMATTERS)
+
+    assert prefetcher.lookup("conversation", "contacts", "contacts at Acme Corp") is None
@@ -0,0 +1,55 @@
+# Per-request profiling: only admin requests sent with X-Profile are profiled, others pass straight through
+
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import RequestProfilingMiddleware, current_profile, profiled_runner
+
+ADMIN_KEY = "secret"
+
+
+def make_client():
+    app = FastAPI()
+    runner = profiled_runner(asyncio.to_thread)
+    seen = []
+
+    @app.get("/work")
+    async def work():
+        seen.append(current_profile.get())
+        total = await runner(sum, range(1000))
+        return {"response": "ok", "data": total}
+
+    app.add_middleware(RequestProfilingMiddleware, admin_api_key=ADMIN_KEY)
+    return TestClient(app), seen
+
+
+def test_requests_without_the_header_are_not_profiled():
+    client, seen = make_client()
+    response = client.get("/work", headers={"X-Admin-Key": ADMIN_KEY})
+
+    assert response.json() == {"response": "ok", "data": 499500}
+    assert "x-profile-wall-ms" not in response.headers
+    assert seen == [None]
+
+
+def test_non_admin_requests_are_not_profiled():
+    client, seen = make_client()
+    response = client.get("/work", headers={"X-Profile": "1", "X-Admin-Key": "wrong"})
+
+    assert "profile" not in response.json()
+    assert seen == [None]
+
+
+def test_admin_request_gets_a_profile_report():
+    client, seen = make_client()
+    response = client.get("/work", headers={"X-Profile": "1", "X-Admin-Key": ADMIN_KEY})
+
+    body = response.json()
+    assert body["data"] == 499500
+    assert seen[0] is not None
+    assert [stage["stage"] for stage in body["profile"]["stages"]] == ["sum"]
+    assert body["profile"]["top_cumulative"]
+    assert float(response.headers["x-profile-wall-ms"]) >= 0
+    assert int(response.headers["content-length"]) == len(response.content)
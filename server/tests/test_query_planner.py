@@ -0,0 +1,61 @@
+# Search operators chosen by the query planner from property types and filter values
+
+import pytest
+
+from query_planner import QueryPlanner, choose_operator
+
+
+def search_filters(plan):
+    return [f for group in plan.body["filterGroups"] for f in group["filters"]]
+
+
+@pytest.mark.parametrize("object_type, prop, value, operator", [
+    ("contacts", "email", "jane@example.com", "EQ"),
+    ("contacts", "email", "jane", "CONTAINS_TOKEN"),
+    ("companies", "domain", "example.com", "EQ"),
+    ("companies", "domain", "example", "CONTAINS_TOKEN"),
+    ("companies", "industry", "COMPUTER_SOFTWARE", "EQ"),
+    ("companies", "industry", "software", "CONTAINS_TOKEN"),
+    ("deals", "dealstage", "closedwon", "EQ"),
+    ("deals", "dealstage", "Closed Won", "CONTAINS_TOKEN"),
+    ("deals", "amount", "5000", "EQ"),
+    ("contacts", "company", "Acme", "CONTAINS_TOKEN"),
+    ("contacts", "unknown_property", "x", "CONTAINS_TOKEN"),
+])
+def test_choose_operator(object_type, prop, value, operator):
+    assert choose_operator(object_type, prop, value) == operator
+
+
+def test_operator_follows_value_not_cached_shape():
+    planner = QueryPlanner()
+    exact = planner.plan("filter", "contacts", {"email": "jane@example.com"})
+    partial = planner.plan("filter", "contacts", {"email": "example"})
+    assert search_filters(exact) == [{"propertyName": "email", "operator": "EQ", "value": "jane@example.com"}]
+    assert search_filters(partial) == [{"propertyName": "email", "operator": "CONTAINS_TOKEN", "value": "example"}]
+    assert planner.stats()["misses"] == 2
+
+
+def test_range_and_stage_filters():
+    plan = QueryPlanner().plan("filter", "deals", {"min_amount": 1000, "max_amount": 5000, "stage": "closed won"})
+    assert sorted((f["propertyName"], f["operator"], f["value"]) for f in search_filters(plan)) == [
+        ("amount", "GTE", 1000),
+        ("amount", "LTE", 5000),
+        ("dealstage", "EQ", "closedwon"),
+    ]
+
+
+def test_full_name_fans_out_into_or_groups():
+    plan = QueryPlanner().plan("lookup", "contacts", {"contact_name": "Jane Doe", "company": "Acme"})
+    groups = [[(f["propertyName"], f["operator"], f["value"]) for f in group["filters"]] for group in plan.body["filterGroups"]]
+    shared = ("company", "CONTAINS_TOKEN", "Acme")
+    assert groups == [
+        [shared, ("firstname", "CONTAINS_TOKEN", "Jane"), ("lastname", "CONTAINS_TOKEN", "Doe")],
+        [shared, ("firstname", "CONTAINS_TOKEN", "Jane Doe")],
+        [shared, ("lastname", "CONTAINS_TOKEN", "Jane Doe")],
+    ]
+
+
+def test_unusable_filters_plan_a_list():
+    plan = QueryPlanner().plan("filter", "contacts", {"favourite_color": "blue", "email": "  "})
+    assert plan.kind == "list"
+    assert plan.unfiltered
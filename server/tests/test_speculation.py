@@ -0,0 +1,67 @@
+# Speculative prefetch: a guessed plan is used when the LLM confirms it, dropped otherwise
+
+import asyncio
+import threading
+import time
+
+from query_planner import QueryPlanner
+from speculation import WARMUP_SAMPLES, SpeculativePrefetcher
+
+planner = QueryPlanner()
+
+
+def test_confirmed_guess_is_used():
+    fetched = []
+
+    def fetch(plan):
+        fetched.append(plan.key())
+        return {"results": [{"id": "1"}]}
+
+    prefetcher = SpeculativePrefetcher(max_workers=1)
+    guess = planner.plan("list", "contacts")
+    speculation = prefetcher.start(guess, fetch)
+    result = asyncio.run(prefetcher.resolve(speculation, planner.plan("list", "contacts"), time.monotonic()))
+
+    assert result == {"results": [{"id": "1"}]}
+    assert fetched == [guess.key()]
+    stats = prefetcher.stats()
+    assert (stats["hits"], stats["misses"], stats["wasted_requests"]) == (1, 0, 0)
+
+
+def test_different_plan_discards_the_guess():
+    started, release = threading.Event(), threading.Event()
+
+    def fetch(plan):
+        started.set()
+        release.wait(5)
+        return {"results": []}
+
+    prefetcher = SpeculativePrefetcher(max_workers=1)
+    speculation = prefetcher.start(planner.plan("list", "contacts"), fetch)
+    assert started.wait(5)
+    result = asyncio.run(prefetcher.resolve(speculation, planner.plan("list", "companies"), time.monotonic()))
+    release.set()
+
+    assert result is None
+    stats = prefetcher.stats()
+    # The guessed request was already running, so it was wasted
+    assert (stats["hits"], stats["misses"], stats["wasted_requests"]) == (0, 1, 1)
+
+
+def test_rarely_confirmed_intents_stop_speculating():
+    prefetcher = SpeculativePrefetcher(max_workers=1, min_hit_rate=0.5, probe_every=100)
+    guess, actual = planner.plan("list", "contacts"), planner.plan("list", "deals")
+
+    async def miss():
+        await prefetcher.resolve(prefetcher.start(guess, lambda plan: {}), actual, time.monotonic())
+
+    for _ in range(WARMUP_SAMPLES):
+        asyncio.run(miss())
+    assert prefetcher.start(guess, lambda plan: {}) is None
+    assert prefetcher.stats()["skipped"] == 1
+
+
+def test_disabled_prefetcher_never_fetches():
+    prefetcher = SpeculativePrefetcher(enabled=False)
+    assert prefetcher.start(planner.plan("list", "contacts"), lambda plan: {}) is None
+    assert asyncio.run(prefetcher.resolve(None, planner.plan("list", "contacts"), time.monotonic())) is None
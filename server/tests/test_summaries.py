@@ -0,0 +1,69 @@
+# Dashboard summaries: which questions they answer and when a computed value is reported stale
+
+import time
+
+import pytest
+
+from summaries import STALE_AFTER_INTERVALS, SummaryStore, configure_summaries
+
+
+def fake_fetch(endpoint, method="GET", params=None, data=None):
+    return {"results": [{"properties": {"dealstage": "closedwon", "amount": "1000"}}]}
+
+
+def make_store(spec="pipeline_by_stage:300,new_contacts_last_7_days:600,top_industries:3600"):
+    return SummaryStore(configure_summaries(fake_fetch, spec))
+
+
+@pytest.mark.parametrize("query, name", [
+    ("pipeline by stage", "pipeline_by_stage"),
+    ("Show me the pipeline summary?", "pipeline_by_stage"),
+    ("what are our deals by stage", "pipeline_by_stage"),
+    ("how many new contacts were added in the last 7 days", "new_contacts_last_7_days"),
+    ("top industries", "top_industries"),
+    ("companies by industry", "top_industries"),
+])
+def test_whole_questions_match_their_summary(query, name):
+    assert make_store().match(query).name == name
+
+
+@pytest.mark.parametrize("query", [
+    "pipeline by stage for acme",
+    "top industries this month",
+    "list contacts",
+])
+def test_scoped_or_unrelated_questions_do_not_match(query):
+    assert make_store().match(query) is None
+
+
+def test_summaries_left_out_of_the_spec_do_not_match():
+    store = make_store("top_industries:3600,unknown_summary:60")
+    assert list(store.definitions) == ["top_industries"]
+    assert store.match("pipeline by stage") is None
+
+
+def test_value_is_stale_after_missed_refreshes(monkeypatch):
+    store = make_store("pipeline_by_stage:300")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    store.record("pipeline_by_stage", {"stages": {}, "total_count": 0, "total_amount": 0.0}, 0.1)
+
+    assert store.get("pipeline_by_stage")["stale"] is False
+
+    monkeypatch.setattr(time, "time", lambda: now + 300 * STALE_AFTER_INTERVALS + 1)
+    summary = store.get("pipeline_by_stage")
+    assert summary["stale"] is True
+    assert summary["text"].startswith("Pipeline: 0 deals")
+    assert store.status()["pipeline_by_stage"]["stale"] is True
+
+
+def test_failed_refresh_keeps_the_last_value():
+    store = make_store("pipeline_by_stage:300")
+    assert store.get("pipeline_by_stage") is None
+
+    store.record("pipeline_by_stage", {"stages": {}, "total_count": 2, "total_amount": 10.0}, 0.1)
+    store.record("pipeline_by_stage", None, 0.1, error="HubSpot unavailable")
+
+    summary = store.get("pipeline_by_stage")
+    assert summary["value"]["total_count"] == 2
+    assert summary["error"] == "HubSpot unavailable"
@@ -0,0 +1,63 @@
+# Portals never see each other's cached responses or jobs
+
+import asyncio
+import time
+
+import httpx
+
+from connectors import ConnectorRegistry, HubSpotConnector, ResponseCache
+from jobs import SUCCEEDED, JobManager
+from tenants import Tenant
+
+
+def portals():
+    return Tenant("acme", bearer_token="acme-token", access_key="acme-key"), Tenant("beta", bearer_token="beta-token", access_key="beta-key")
+
+
+def test_connector_caches_are_per_portal():
+    sent = []
+
+    def handler(request):
+        token = request.headers["Authorization"]
+        sent.append(token)
+        return httpx.Response(200, json={"results": [{"id": token, "properties": {}}]})
+
+    registry = ConnectorRegistry()
+    registry.register("hubspot", lambda tenant: HubSpotConnector.for_tenant(
+        tenant, cache=ResponseCache(ttl_seconds=60), http_transport=httpx.MockTransport(handler),
+    ))
+    acme, beta = portals()
+
+    async def read(tenant):
+        page = await registry.get("hubspot", tenant).list("contacts", limit=10)
+        return [record["id"] for record in page.results]
+
+    async def main():
+        try:
+            return [await read(acme), await read(beta), await read(acme), await read(beta)]
+        finally:
+            await registry.close()
+
+    assert asyncio.run(main()) == [["Bearer acme-token"], ["Bearer beta-token"]] * 2
+    # The same call was sent once per portal; repeats were answered from that portal's cache
+    assert sent == ["Bearer acme-token", "Bearer beta-token"]
+    assert registry.get("hubspot", acme).transport.cache is not registry.get("hubspot", beta).transport.cache
+
+
+def test_jobs_are_invisible_to_other_portals():
+    manager = JobManager({"echo": lambda ctx, params: params})
+    job = manager.submit("echo", {"query": "list contacts"}, "acme")
+    stop = time.monotonic() + 5
+    while job.status != SUCCEEDED:
+        assert time.monotonic() < stop
+        time.sleep(0.01)
+
+    assert manager.get(job.job_id, "acme") is job
+    assert manager.get(job.job_id, "beta") is None
+    assert manager.list_jobs("beta") == []
+    assert manager.list_jobs("acme") == [job]
+
+
+def test_namespaced_keys_differ_per_portal():
+    acme, beta = portals()
+    assert acme.namespace("conversation-1") != beta.namespace("conversation-1")
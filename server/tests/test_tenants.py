@@ -0,0 +1,58 @@
+# RateBudget.acquire_async: waiting for tokens without blocking the event loop
+
+import asyncio
+import time
+
+from tenants import RateBudget
+
+
+def test_acquire_async_takes_burst_then_waits_for_refill():
+    budget = RateBudget(requests_per_second=20, burst=2)
+
+    async def acquire_three():
+        return [await budget.acquire_async(timeout=1) for _ in range(3)]
+
+    started = time.monotonic()
+    assert asyncio.run(acquire_three()) == [True, True, True]
+    assert time.monotonic() - started >= 0.04
+    stats = budget.stats()
+    assert stats["acquired"] == 3
+    assert stats["throttled"] == 1
+
+
+def test_acquire_async_gives_up_without_sleeping_past_the_timeout():
+    budget = RateBudget(requests_per_second=0.1, burst=1)
+    assert budget.acquire(timeout=0)
+
+    started = time.monotonic()
+    assert asyncio.run(budget.acquire_async(timeout=0.5)) is False
+    assert time.monotonic() - started < 0.1
+    assert budget.stats()["rejected"] == 1
+
+
+def test_acquire_async_leaves_the_event_loop_running():
+    budget = RateBudget(requests_per_second=5, burst=1)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.create_task(tick())
+        results = [await budget.acquire_async(timeout=1), await budget.acquire_async(timeout=1)]
+        ticker.cancel()
+        return results
+
+    assert asyncio.run(main()) == [True, True]
+    # The second token takes ~0.2s; the loop kept serving other tasks meanwhile
+    assert len(ticks) >= 10
+
+
+def test_acquire_and_acquire_async_share_tokens():
+    budget = RateBudget(requests_per_second=0.1, burst=2)
+    assert budget.acquire(timeout=0)
+    assert asyncio.run(budget.acquire_async(timeout=0))
+    assert not budget.acquire(timeout=0)
+    assert budget.stats()["acquired"] == 2
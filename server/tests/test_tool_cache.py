@@ -0,0 +1,59 @@
+# Agent tool results: compact, token-budgeted observations and per-conversation memoization
+
+import time
+
+from tool_cache import CHARS_PER_TOKEN, ToolResultCache, estimate_tokens, format_observation
+
+FIELDS = ["name", "email"]
+
+
+def contacts(count):
+    return [{"name": f"Contact {i}", "email": f"contact{i}@example.com"} for i in range(count)]
+
+
+def test_observation_fits_the_token_budget():
+    observation = format_observation("contacts", contacts(50), FIELDS, budget_tokens=40, total=120)
+    lines = observation.split("\n")
+    assert lines[0] == "120 contacts found. Fields: name | email"
+    shown = len(lines) - 2
+    assert 0 < shown < 50
+    assert lines[-1].startswith(f"... {120 - shown} more not shown")
+    assert len("\n".join(lines[:-1])) <= 40 * CHARS_PER_TOKEN
+
+
+def test_observation_shows_everything_within_budget():
+    observation = format_observation("contacts", [{"name": "Jane", "email": None}], FIELDS, budget_tokens=100)
+    assert observation == "1 contacts found. Fields: name | email\nJane | -"
+    assert estimate_tokens(observation) <= 100
+
+
+def test_observation_shows_one_record_however_long():
+    record = {"name": "x" * 500, "email": "a@example.com"}
+    observation = format_observation("contacts", [record, record], FIELDS, budget_tokens=10)
+    assert observation.split("\n")[1].startswith("x" * 500)
+    assert observation.endswith("1 more not shown; use a narrower query or a smaller limit to see them")
+
+
+def test_empty_observation():
+    assert format_observation("deals", [], FIELDS, budget_tokens=10) == "0 deals found."
+
+
+def test_equivalent_calls_share_an_entry():
+    cache = ToolResultCache(ttl_seconds=60)
+    cache.put("c1", "get_contacts", {"query": "Jane  DOE", "limit": 5, "after": None}, "result")
+    assert cache.get("c1", "get_contacts", {"limit": 5, "query": "jane doe"}) == "result"
+    # Other conversations have their own entries
+    assert cache.get("c2", "get_contacts", {"limit": 5, "query": "jane doe"}) is None
+
+
+def test_entries_expire_after_their_ttl():
+    cache = ToolResultCache(ttl_seconds=0.05)
+    cache.put("c1", "get_deals", {"limit": 5}, "deals")
+    cache.put("c1", "get_companies", {"limit": 5}, "companies", ttl=60)
+    assert cache.get("c1", "get_deals", {"limit": 5}) == "deals"
+
+    time.sleep(0.1)
+    assert cache.get("c1", "get_deals", {"limit": 5}) is None
+    assert cache.get("c1", "get_companies", {"limit": 5}) == "companies"
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
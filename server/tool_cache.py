@@ -0,0 +1,172 @@
+# Tool execution layer for the LangChain agent
+# Memoizes HubSpot tool results per conversation and renders them as compact,
+# token-budgeted observations for the agent scratchpad.
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import threading
+import time
+
+# Rough characters-per-token ratio used to budget observations without a tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of LLM tokens in a string"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def normalize_args(args: Dict[str, Any]) -> Tuple:
+    """Normalize tool arguments so equivalent calls share a cache key"""
+    normalized = []
+    for key in sorted(args):
+        value = args[key]
+        if value is None or value == "" or value == []:
+            continue
+        if isinstance(value, str):
+            value = " ".join(value.lower().split())
+        elif isinstance(value, (list, tuple)):
+            value = tuple(sorted(str(item).lower() for item in value))
+        normalized.append((key, value))
+    return tuple(normalized)
+
+
+def format_observation(
+    object_type: str,
+    records: List[Dict[str, Any]],
+    fields: List[str],
+    budget_tokens: int,
+    total: Optional[int] = None,
+) -> str:
+    """Render records as a compact table, truncating to the token budget with an "N more" hint"""
+    total = max(total or 0, len(records))
+    if not records:
+        return f"0 {object_type} found."
+
+    header = f"{total} {object_type} found. Fields: {' | '.join(fields)}"
+    budget_chars = budget_tokens * CHARS_PER_TOKEN
+    lines = [header]
+    used = len(header)
+    shown = 0
+    for record in records:
+        line = " | ".join("-" if record.get(field) in (None, "") else str(record[field]) for field in fields)
+        # Always show at least one record, however long
+        if shown and used + len(line) + 1 > budget_chars:
+            break
+        lines.append(line)
+        used += len(line) + 1
+        shown += 1
+
+    remaining = total - shown
+    if remaining > 0:
+        lines.append(f"... {remaining} more not shown; use a narrower query or a smaller limit to see them")
+    return "\n".join(lines)
+
+
+class TurnStats:
+    """Tool usage for one agent turn in a conversation"""
+
+    def __init__(self):
+        self.tool_calls = 0
+        self.cache_hits = 0
+        self.hubspot_calls = 0
+        self.observation_tokens = 0
+        self.verbose_observation_tokens = 0
+        # Observations returned so far, used to answer if the turn runs out of time
+        self.observations: List[str] = []
+        # (object type, record) returned to the agent, used to predict the next question
+        self.returned: List[Tuple[str, Dict[str, Any]]] = []
+        self.prefetch_hits = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tool_calls": self.tool_calls,
+            "cache_hits": self.cache_hits,
+            "hubspot_calls": self.hubspot_calls,
+            "hubspot_calls_saved": self.cache_hits,
+            "prefetch_hits": self.prefetch_hits,
+            "observation_tokens": self.observation_tokens,
+            "verbose_observation_tokens": self.verbose_observation_tokens,
+            "observation_tokens_saved": self.verbose_observation_tokens - self.observation_tokens,
+        }
+
+
+class ToolResultCache:
+    """Per-conversation memoization of tool results with a short TTL"""
+
+    def __init__(self, ttl_seconds: float = 60, max_conversations: int = 1000, max_entries_per_conversation: int = 64):
+        self.ttl = ttl_seconds
+        self.max_conversations = max_conversations
+        self.max_entries = max_entries_per_conversation
+        self._entries: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._turns: Dict[str, TurnStats] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation_id: str, tool_name: str, args: Dict[str, Any]) -> Optional[Any]:
+        """Return a memoized result if one exists and has not expired"""
+        key = (tool_name, normalize_args(args))
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(conversation_id)
+            entry = entries.get(key) if entries is not None else None
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, conversation_id: str, tool_name: str, args: Dict[str, Any], value: Any, ttl: Optional[float] = None):
+        """Memoize a tool result for this conversation"""
+        key = (tool_name, normalize_args(args))
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            entries = self._entries.setdefault(conversation_id, OrderedDict())
+            self._entries.move_to_end(conversation_id)
+            entries[key] = (expires_at, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            while len(self._entries) > self.max_conversations:
+                evicted, _ = self._entries.popitem(last=False)
+                self._turns.pop(evicted, None)
+
+    def begin_turn(self, conversation_id: str) -> TurnStats:
+        """Start collecting tool usage for a new agent turn"""
+        stats = TurnStats()
+        with self._lock:
+            self._turns[conversation_id] = stats
+        return stats
+
+    def turn(self, conversation_id: Optional[str]) -> Optional[TurnStats]:
+        """Tool usage collector for the conversation's current turn"""
+        if conversation_id is None:
+            return None
+        with self._lock:
+            return self._turns.get(conversation_id)
+
+    def end_turn(self, conversation_id: str) -> Dict[str, Any]:
+        """Finish the current turn and return its tool usage report"""
+        with self._lock:
+            stats = self._turns.pop(conversation_id, None)
+        return stats.to_dict() if stats is not None else TurnStats().to_dict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def verbose_observation(object_type: str, records: List[Dict[str, Any]]) -> str:
+    """The previous indented-JSON observation format, used as the baseline for savings"""
+    return json.dumps({"count": len(records), object_type: records}, indent=2)